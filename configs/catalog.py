@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.core.cache import cache
+
+from .models import TDS, Component
+
+# Shared version of the catalog; bumped whenever a Component or TDS changes
+VERSION_KEY = 'configs:catalog:version'
+
+_lock = threading.Lock()
+_catalog = {'version': None, 'components': [], 'tds_percentages': {}}
+
+
+def _get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # A fresh, unique version so no process keeps a stale copy when the
+        # key was evicted
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _get_catalog():
+    """
+    Returns the in-process copy of the Component and TDS tables, reloading
+    it when the shared version changed since it was loaded.
+    """
+    version = _get_version()
+    if _catalog['version'] != version or version is None:
+        with _lock:
+            _catalog.update(
+                version=version,
+                components=list(Component.objects.order_by('id')),
+                tds_percentages=dict(TDS.objects.values_list(
+                    'tds_legal_name', 'tds_percentage')))
+    return _catalog
+
+
+def get_components(operation=None):
+    """
+    Returns the components, optionally only those with the given operation
+    ('sum' or 'subtract').
+    """
+    return [component for component in _get_catalog()['components']
+            if operation is None or component.operation == operation]
+
+
+def get_tds_percentage(tds_legal_name):
+    """
+    Returns the TDS percentage of the given TDS legal name, or None.
+    """
+    return _get_catalog()['tds_percentages'].get(tds_legal_name)
+
+
+def get_tds_percentages():
+    """
+    Returns the TDS percentages keyed by TDS legal name, checking the
+    shared version once for callers that look up many payees.
+    """
+    return _get_catalog()['tds_percentages']
+
+
+def invalidate_catalog():
+    """
+    Bumps the shared catalog version so every process reloads its copy.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import invalidate_catalog
+from .models import TDS, Component
+
+
+@receiver([post_save, post_delete], sender=Component)
+@receiver([post_save, post_delete], sender=TDS)
+def invalidate_catalog_on_change(sender, **kwargs):
+    """
+    Invalidates the catalog right away and again once the change is
+    committed, so no process can cache the rows of the old transaction.
+    """
+    invalidate_catalog()
+    transaction.on_commit(invalidate_catalog)
@@ -1,3 +1,38 @@
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from .catalog import get_components, get_tds_percentage
+from .models import TDS, Component
+
+
+class CatalogTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.bonus = Component.objects.create(component_name='Bonus',
+                                              operation='sum')
+        TDS.objects.create(tds_legal_name='individual', tds_percentage=10)
+
+    def test_serves_reference_data_without_queries(self):
+        get_components()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_components('sum'), [self.bonus])
+            self.assertEqual(get_components('subtract'), [])
+            self.assertEqual(get_tds_percentage('individual'), 10)
+            self.assertIsNone(get_tds_percentage('company'))
+
+    def test_saving_or_deleting_invalidates_the_catalog(self):
+        get_components()
+
+        recovery = Component.objects.create(component_name='Recovery',
+                                            operation='subtract')
+        self.assertEqual(get_components('subtract'), [recovery])
+
+        TDS.objects.filter(tds_legal_name='individual').get().delete()
+        self.assertIsNone(get_tds_percentage('individual'))
+
+        tds = TDS.objects.create(tds_legal_name='company', tds_percentage=2)
+        tds.tds_percentage = 5
+        tds.save()
+        self.assertEqual(get_tds_percentage('company'), 5)
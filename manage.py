@@ -8,6 +8,9 @@ from decouple import config
 def main():
     """Run administrative tasks."""
 
+    if sys.argv[1:2] == ['test']:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                              'youpayroll.settings.testing')
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'youpayroll.settings.base')
 
     try:
@@ -1,19 +1,49 @@
+import json
 import logging
-
-from django.contrib import admin
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Count, Sum
+from django.http import (Http404, HttpResponse, HttpResponseNotAllowed,
+                         JsonResponse)
 from django.shortcuts import redirect
-from django.urls import reverse
-from django.utils.html import format_html
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.decorators import method_decorator
+from django.utils.html import format_html, format_html_join
+from django.utils.http import urlencode
+from django.views.decorators.http import require_POST
 
-from decimal import Decimal
 from payees.utils import restrict_queryset_by_group
 from payees.constants import RESTRICTED_PAYEE_GROUP
 from .models import (Payment, PayRecordRegister, PayRun,
-                     PayRunStatusChoices, Form16, Form16Entries,
-                     ComponentValue)
+                     PayRunStatusChoices, PayRunError, PayRunErrorCodeChoices,
+                     Form16, Form16Entries, Form16StatusChoices,
+                     Form16UnmatchedPAN, ComponentValue)
 from .alerts import (approve_payrun_action, reject_payrun_action,
-                     run_payrun_action, is_payrun_exists)
+                     run_payrun_action, resume_payrun_action,
+                     recalculate_payrun_action, export_register_action,
+                     export_bank_file_action, is_payrun_exists)
+from . import register_export as register
+from .bank_files import CONTENT_TYPES, CSV, FIXED_WIDTH, bank_file_response
+from .engine import (get_error_counts, get_pay_run_preview,
+                     recalculate_pay_record)
+from .form16_archive import form16_zip_response
 from .forms import PayRunForm
+from .locks import get_lock_metrics
+from .multipart import (LocalMultipartBackend, abort_form16_upload,
+                        complete_form16_upload, get_multipart_backend,
+                        start_form16_upload)
+from .progress import get_progress
+from .summaries import TOTAL_FIELDS, adjust_pay_run_summary
+from .variance import (get_variance, get_variance_base_run,
+                       variance_csv_response)
+from .tasks import (run_pay_run_task, resume_pay_run_task,
+                    run_pay_run_shard_task, complete_pay_run_task)
+from configs.catalog import get_components, get_tds_percentage
 from configs.models import Component
 
 logger = logging.getLogger(__name__)
@@ -32,12 +62,19 @@ class PaymentAdmin(admin.ModelAdmin):
 
 
 class PayRunAdmin(admin.ModelAdmin):
-    list_display = ('display_month_name', 'year', 'status', 'created_by')
+    list_display = ('display_month_name', 'year', 'status', 'created_by',
+                    'headcount', 'total_gross_amount', 'total_net_income')
     list_filter = ('status', 'month', 'year')
     search_fields = ('status', 'get_month_name', 'year')
-    readonly_fields = ('status', 'created_at','error_log_summary')
+    readonly_fields = ('status', 'created_at', 'error_log_summary',
+                       'summary_table', 'preview_link', 'register_links',
+                       'bank_file_links', 'variance_link')
     ordering = ['-created_at']
-    actions = ['run_payrun', 'approve_payrun', 'reject_payrun']
+    change_form_template = 'admin/payroll/payrun/change_form.html'
+    actions = ['run_payrun', 'resume_payrun', 'approve_payrun',
+               'reject_payrun', 'recalculate_payrun', 'export_register_csv',
+               'export_register_xlsx', 'export_bank_file_csv',
+               'export_bank_file_fixed_width']
     form = PayRunForm
 
 
@@ -66,16 +103,339 @@ class PayRunAdmin(admin.ModelAdmin):
 
     run_payrun.short_description = 'Run selected payrun'
 
+    def resume_payrun(self, request, queryset):
+        resume_payrun_action(self, request, queryset)
+
+    resume_payrun.short_description = 'Resume selected interrupted payrun'
+
+    def recalculate_payrun(self, request, queryset):
+        recalculate_payrun_action(self, request, queryset)
+
+    recalculate_payrun.short_description = ('Recalculate gross and net of '
+                                            'selected payrun records')
+
+    def export_register_csv(self, request, queryset):
+        return export_register_action(self, request, queryset, register.CSV)
+
+    export_register_csv.short_description = 'Download register (CSV)'
+
+    def export_register_xlsx(self, request, queryset):
+        return export_register_action(self, request, queryset, register.XLSX)
+
+    export_register_xlsx.short_description = 'Download register (XLSX)'
+
+    def export_bank_file_csv(self, request, queryset):
+        return export_bank_file_action(self, request, queryset, CSV)
+
+    export_bank_file_csv.short_description = ('Download bank transfer file '
+                                              '(CSV)')
+
+    def export_bank_file_fixed_width(self, request, queryset):
+        return export_bank_file_action(self, request, queryset, FIXED_WIDTH)
+
+    export_bank_file_fixed_width.short_description = (
+        'Download bank transfer file (fixed width)')
+
+    def get_queryset(self, request):
+        # The totals are summed over the few summary rows of each pay run
+        return super().get_queryset(request).annotate(
+            **{field: Sum(f'summaries__{field}')
+               for field in ('headcount', 'total_gross_amount',
+                             'total_net_income')})
+
+    def headcount(self, obj):
+        return obj.headcount
+    headcount.short_description = 'Headcount'
+    headcount.admin_order_field = 'headcount'
+
+    def total_gross_amount(self, obj):
+        return obj.total_gross_amount
+    total_gross_amount.short_description = 'Total gross'
+    total_gross_amount.admin_order_field = 'total_gross_amount'
+
+    def total_net_income(self, obj):
+        return obj.total_net_income
+    total_net_income.short_description = 'Total net income'
+    total_net_income.admin_order_field = 'total_net_income'
+
+    def summary_table(self, obj):
+        summaries = list(obj.summaries.all()) if obj.pk else []
+        if not summaries:
+            return "-"
+
+        rows = [(summary.get_tds_type_display() or 'No TDS type',
+                 *(getattr(summary, field) for field in TOTAL_FIELDS))
+                for summary in summaries]
+        rows.append(('Total', *(sum(row[index] for row in rows)
+                                for index in range(1, len(TOTAL_FIELDS) + 1))))
+        return format_html(
+            '<table><tr><th>TDS type</th><th>Headcount</th><th>Amount</th>'
+            '<th>Gross</th><th>TDS</th><th>Net income</th></tr>{}</table>',
+            format_html_join('', '<tr>' + '<td>{}</td>' * len(rows[0])
+                             + '</tr>', rows))
+    summary_table.short_description = 'Summary'
+
     def has_errors(self, obj):
         return bool(obj.error_log)
     has_errors.boolean = True
 
     def error_log_summary(self, obj):
-        if not obj.error_log:
+        if not obj.pk:
             return "-"
-        return format_html("<pre>{}</pre>", obj.error_log)
+        error_counts = get_error_counts(obj)
+        if not error_counts:
+            return obj.error_log or "-"
+        url = reverse('admin:payroll_payrunerror_changelist')
+        return format_html_join(
+            format_html("<br>"), '<a href="{}?pay_run__id__exact={}&code={}">'
+            '{}: {}</a>',
+            ((url, obj.pk, code, PayRunErrorCodeChoices(code).label, count)
+             for code, count in error_counts.items()))
     error_log_summary.short_description = 'Error Log'
 
+    def preview_link(self, obj):
+        if not obj.pk:
+            return "-"
+        return format_html(
+            '<a class="button" href="{}">Preview pay records</a>',
+            reverse('admin:payroll_payrun_preview', args=[obj.pk]))
+    preview_link.short_description = 'Preview'
+
+    def register_links(self, obj):
+        if not obj.pk:
+            return "-"
+        return format_html_join(' ', '<a class="button" href="{}">{}</a>', (
+            (reverse('admin:payroll_payrun_register',
+                     args=[obj.pk, file_format]), label)
+            for file_format, label in ((register.CSV, 'CSV'),
+                                       (register.XLSX, 'XLSX'))))
+    register_links.short_description = 'Register'
+
+    def bank_file_links(self, obj):
+        if obj.status != PayRunStatusChoices.APPROVED:
+            return "-"
+        return format_html_join(' ', '<a class="button" href="{}">{}</a>', (
+            (reverse('admin:payroll_payrun_bank_file',
+                     args=[obj.pk, file_format]), label)
+            for file_format, label in ((CSV, 'CSV'),
+                                       (FIXED_WIDTH, 'Fixed width'))))
+    bank_file_links.short_description = 'Bank transfer file'
+
+    def variance_link(self, obj):
+        if not obj.pk:
+            return "-"
+        return format_html(
+            '<a class="button" href="{}">Compare with previous pay run</a>',
+            reverse('admin:payroll_payrun_variance', args=[obj.pk]))
+    variance_link.short_description = 'Variance'
+
+    def get_urls(self):
+        custom_urls = [
+            path('<path:object_id>/preview/',
+                 self.admin_site.admin_view(self.preview_view),
+                 name='payroll_payrun_preview'),
+            path('<path:object_id>/progress/',
+                 self.admin_site.admin_view(self.progress_view),
+                 name='payroll_payrun_progress'),
+            path('<path:object_id>/bank-file/<str:file_format>/',
+                 self.admin_site.admin_view(self.bank_file_view),
+                 name='payroll_payrun_bank_file'),
+            path('<path:object_id>/register/<str:file_format>/',
+                 self.admin_site.admin_view(self.register_view),
+                 name='payroll_payrun_register'),
+            path('<path:object_id>/variance/',
+                 self.admin_site.admin_view(self.variance_view),
+                 name='payroll_payrun_variance'),
+            path('lock-metrics/',
+                 self.admin_site.admin_view(self.lock_metrics_view),
+                 name='payroll_payrun_lock_metrics'),
+        ]
+        return custom_urls + super().get_urls()
+
+    def preview_view(self, request, object_id):
+        """
+        Shows the register, totals and error log the pay run would produce
+        if it was run now, without writing any pay records. The preview is
+        computed once and reused while its pages are browsed, until it is
+        refreshed.
+        """
+        pay_run = self.get_object(request, object_id)
+        if pay_run is None:
+            return self._get_obj_does_not_exist_redirect(request, self.opts,
+                                                         object_id)
+        if not self.has_view_permission(request, pay_run):
+            raise PermissionDenied
+
+        preview = get_pay_run_preview(pay_run,
+                                      refresh='refresh' in request.GET)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.opts,
+            'title': f'Preview of {pay_run}',
+            'pay_run': pay_run,
+            'preview': preview,
+            'page_obj': Paginator(preview['records'], 100).get_page(
+                request.GET.get('page')),
+        }
+        return TemplateResponse(request, 'admin/payroll/payrun/preview.html',
+                                context)
+
+    def progress_view(self, request, object_id):
+        """
+        Returns the progress counters of a pay run as JSON for polling.
+        They are read from the cache only, so polling does not query the
+        PayRun table.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        return JsonResponse(get_progress(object_id) or {'status': None})
+
+    def get_register_queryset(self, request):
+        """
+        Returns the pay records the user may see in the PayRecordRegister
+        admin, which the exports of a pay run are limited to, or raises
+        PermissionDenied without the permission to view them.
+        """
+        register_admin = self.admin_site._registry[PayRecordRegister]
+        if not register_admin.has_view_permission(request):
+            raise PermissionDenied
+        return register_admin.get_queryset(request)
+
+    def bank_file_view(self, request, object_id, file_format):
+        """
+        Streams the bulk bank transfer file of an approved pay run.
+        """
+        pay_run = self.get_object(request, object_id)
+        if pay_run is None:
+            return self._get_obj_does_not_exist_redirect(request, self.opts,
+                                                         object_id)
+        if not self.has_view_permission(request, pay_run):
+            raise PermissionDenied
+        if pay_run.status != PayRunStatusChoices.APPROVED or \
+                file_format not in CONTENT_TYPES:
+            raise Http404
+
+        try:
+            return bank_file_response(
+                pay_run, file_format,
+                records=self.get_register_queryset(request))
+        except ValidationError as error:
+            self.message_user(request,
+                              "The bank transfer file was not generated: "
+                              + ' '.join(error.messages),
+                              level=messages.ERROR)
+            return redirect(reverse('admin:payroll_payrun_change',
+                                    args=[pay_run.pk]))
+
+    def register_view(self, request, object_id, file_format):
+        """
+        Downloads the payroll register of a pay run with one column per
+        earning and deduction component.
+        """
+        pay_run = self.get_object(request, object_id)
+        if pay_run is None:
+            return self._get_obj_does_not_exist_redirect(request, self.opts,
+                                                         object_id)
+        if not self.has_view_permission(request, pay_run):
+            raise PermissionDenied
+        if file_format not in register.CONTENT_TYPES:
+            raise Http404
+
+        return register.register_response(
+            pay_run, file_format, records=self.get_register_queryset(request))
+
+    def variance_view(self, request, object_id):
+        """
+        Lists the payees that are new, removed or whose pay changed by more
+        than a threshold against a base pay run, by default the previous
+        approved one. `?format=csv` downloads the full report.
+        """
+        pay_run = self.get_object(request, object_id)
+        if pay_run is None:
+            return self._get_obj_does_not_exist_redirect(request, self.opts,
+                                                         object_id)
+        if not self.has_view_permission(request, pay_run):
+            raise PermissionDenied
+
+        if request.GET.get('base'):
+            base_run = self.get_object(request, request.GET['base'])
+            if base_run is None:
+                raise Http404
+        else:
+            base_run = get_variance_base_run(pay_run)
+
+        try:
+            threshold = Decimal(request.GET.get(
+                'threshold', str(settings.PAYRUN_VARIANCE_THRESHOLD)))
+        except InvalidOperation:
+            threshold = Decimal(str(settings.PAYRUN_VARIANCE_THRESHOLD))
+
+        if base_run is not None and request.GET.get('format') == 'csv':
+            return variance_csv_response(pay_run, base_run, threshold)
+
+        rows = (get_variance(pay_run, base_run, threshold)
+                if base_run is not None else [])
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.opts,
+            'title': f'Variance of {pay_run}',
+            'pay_run': pay_run,
+            'base_run': base_run,
+            'threshold': threshold,
+            'page_obj': Paginator(rows, 100).get_page(
+                request.GET.get('page')),
+        }
+        return TemplateResponse(request, 'admin/payroll/payrun/variance.html',
+                                context)
+
+    def lock_metrics_view(self, request):
+        """
+        Returns the lock contention and hold time metrics of the pay run
+        tasks as JSON.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        return JsonResponse(get_lock_metrics([
+            task.name for task in (run_pay_run_task, resume_pay_run_task,
+                                   run_pay_run_shard_task,
+                                   complete_pay_run_task)]))
+
+
+
+class PayRunErrorAdmin(admin.ModelAdmin):
+    list_display = ('payee', 'code', 'pay_run', 'created_at')
+    list_filter = ('code', 'pay_run')
+    list_select_related = ('payee', 'pay_run')
+    search_fields = ('payee__full_name', 'payee__hrm_id')
+    list_per_page = 100
+    change_list_template = 'admin/payroll/payrunerror/change_list.html'
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        if hasattr(response, 'context_data'):
+            # Aggregated counts per error type of the filtered errors
+            queryset = response.context_data['cl'].queryset
+            response.context_data['error_counts'] = [
+                (PayRunErrorCodeChoices(code).label, count)
+                for code, count in queryset.order_by('code').values_list(
+                    'code').annotate(count=Count('id'))]
+        return response
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+def component_choices(formfield, operation):
+    """
+    Returns the select choices of the catalog components with the given
+    operation, led by the empty choice of the form field.
+    """
+    return [('', formfield.empty_label)] + [
+        (component.pk, str(component))
+        for component in get_components(operation)]
 
 
 class EarningsInline(admin.TabularInline):
@@ -91,6 +451,12 @@ class EarningsInline(admin.TabularInline):
     def formfield_for_foreignkey(self, db_field, request=None, **kwargs):
         if db_field.name == "component":
             kwargs["queryset"] = Component.objects.filter(operation='sum')
+            formfield = super().formfield_for_foreignkey(db_field, request,
+                                                         **kwargs)
+            # Render the choices from the catalog instead of querying the
+            # components again for every inline form
+            formfield.choices = component_choices(formfield, 'sum')
+            return formfield
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
     def get_formset(self, request, obj=None, **kwargs):
@@ -129,6 +495,12 @@ class DeductionsInline(admin.TabularInline):
     def formfield_for_foreignkey(self, db_field, request=None, **kwargs):
         if db_field.name == "component":
             kwargs["queryset"] = Component.objects.filter(operation='subtract')
+            formfield = super().formfield_for_foreignkey(db_field, request,
+                                                         **kwargs)
+            # Render the choices from the catalog instead of querying the
+            # components again for every inline form
+            formfield.choices = component_choices(formfield, 'subtract')
+            return formfield
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
     def get_formset(self, request, obj=None, **kwargs):
@@ -196,9 +568,12 @@ class PayRecordRegisterAdmin(admin.ModelAdmin):
                     except BankDetails.DoesNotExist:
                         pass
                 
+                obj.tds_type = obj.payee.tds_type_id or ''
+
                 # Autopopulate tds_percentage
-                if not obj.tds_percentage and obj.payee.tds_type:
-                    obj.tds_percentage = obj.payee.tds_type.tds_percentage
+                if not obj.tds_percentage and obj.payee.tds_type_id:
+                    obj.tds_percentage = get_tds_percentage(
+                        obj.payee.tds_type_id)
 
         super().save_model(request, obj, form, change)
 
@@ -240,33 +615,24 @@ class PayRecordRegisterAdmin(admin.ModelAdmin):
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
 
-        pay_record_register = form.instance
-
-        # Calculate the total based on component operations (sum or subtract)
-        total = pay_record_register.amount + sum(
-            component_value.value if component_value.component.operation == 'sum'
-            else -component_value.value
-            for component_value in
-            ComponentValue.objects.filter(pay_record=pay_record_register)
-        )
+        record = form.instance
+        previous = ((record.amount, record.gross_amount, record.net_income)
+                    if change else None)
 
-        # Update gross_amount and save the instance
-        pay_record_register.gross_amount = total
-        pay_record_register.save()
+        # Recalculate gross_amount and net_income from the saved components
+        recalculate_pay_record(record)
 
-        tds_percentage = Decimal(str(pay_record_register.tds_percentage or 0))  # Safe default to 0
-        tds_amount = (pay_record_register.gross_amount * tds_percentage) / Decimal('100')
-        total_net_income = pay_record_register.gross_amount - tds_amount
-
-        pay_record_register.net_income = total_net_income
-        pay_record_register.save()
+        # Apply the difference to the totals of the pay run
+        adjust_pay_run_summary(record, previous)
 
 
 class Forms16EntriesAdmin(admin.ModelAdmin):
     list_display = (
         'financial_year', 'form_16_link', 'form_16_link_to_download')
-    list_filter = ('financial_year',)
+    list_filter = ('financial_year',
+                   ('superseded_by', admin.EmptyFieldListFilter))
     list_per_page = 20
+    actions = ['download_zip']
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
@@ -293,6 +659,41 @@ class Forms16EntriesAdmin(admin.ModelAdmin):
     form_16_link_to_download.short_description = 'Form 16'
     form_16_link_to_download.allow_tags = True
 
+    def download_zip(self, request, queryset):
+        return form16_zip_response(queryset)
+
+    download_zip.short_description = 'Download selected Form 16s (ZIP)'
+
+    def get_urls(self):
+        custom_urls = [
+            path('download/',
+                 self.admin_site.admin_view(self.download_view),
+                 name='payroll_form16entries_download'),
+        ]
+        return custom_urls + super().get_urls()
+
+    def download_view(self, request):
+        """
+        Streams a ZIP of the current Form16 documents, optionally of one
+        financial year (`?financial_year=2024-25`) and of a set of payees
+        (`?payee=1&payee=2`).
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        entries = self.get_queryset(request).filter(superseded_by=None)
+        financial_year = request.GET.get('financial_year')
+        if financial_year:
+            entries = entries.filter(
+                financial_year__financial_year=financial_year)
+        payee_ids = request.GET.getlist('payee')
+        if payee_ids:
+            entries = entries.filter(payee_id__in=payee_ids)
+
+        return form16_zip_response(
+            entries, f'form16-{financial_year}.zip' if financial_year
+            else 'form16.zip')
+
 
 class Form16Inline(admin.TabularInline):  # or StackedInline
     model = Form16Entries
@@ -318,7 +719,31 @@ class Form16Inline(admin.TabularInline):  # or StackedInline
 
 
 class Forms16Admin(admin.ModelAdmin):
-    list_display = ('financial_year', 'form_16_link', 'view_form_entries')
+    list_display = ('financial_year', 'form_16_link', 'status',
+                    'extraction_progress', 'view_form_entries',
+                    'unmatched_pans_link', 'download_link')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'is_extracted', 'total_files',
+                       'extracted_files', 'error')
+    change_list_template = 'admin/payroll/form16/change_list.html'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            unmatched_pans_count=Count('unmatched_pans'))
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            self.message_user(
+                request, "The ZIP file is being extracted in the background.")
+
+    def extraction_progress(self, obj):
+        progress = obj.progress()
+        if progress is None:
+            return "-"
+        return f"{obj.extracted_files}/{obj.total_files} ({progress}%)"
+
+    extraction_progress.short_description = "Progress"
 
     def form_16_link(self, obj):
         if obj.form16_zip_file:
@@ -344,9 +769,177 @@ class Forms16Admin(admin.ModelAdmin):
 
     view_form_entries.short_description = "View Form Entries"
 
+    def unmatched_pans_link(self, obj):
+        if not obj.unmatched_pans_count:
+            return "-"
+        url = reverse('admin:payroll_form16unmatchedpan_changelist')
+        return format_html('<a href="{}?form16__id__exact={}">{}</a>', url,
+                           obj.id, obj.unmatched_pans_count)
+
+    unmatched_pans_link.short_description = "Unmatched PANs"
+
+    def download_link(self, obj):
+        if obj.status != Form16StatusChoices.EXTRACTED:
+            return "-"
+        url = reverse('admin:payroll_form16entries_download')
+        return format_html('<a class="button" href="{}?{}">Download ZIP</a>',
+                           url, urlencode({'financial_year':
+                                           obj.financial_year}))
+
+    download_link.short_description = "Form 16s"
+
+    def get_urls(self):
+        custom_urls = [
+            path('upload/',
+                 self.admin_site.admin_view(self.upload_view),
+                 name='payroll_form16_upload'),
+            path('upload/start/',
+                 self.admin_site.admin_view(self.upload_start_view),
+                 name='payroll_form16_upload_start'),
+            path('<path:object_id>/upload/part/<int:part_number>/',
+                 self.admin_site.admin_view(self.upload_part_view),
+                 name='payroll_form16_upload_part'),
+            path('<path:object_id>/upload/complete/',
+                 self.admin_site.admin_view(self.upload_complete_view),
+                 name='payroll_form16_upload_complete'),
+            path('<path:object_id>/upload/abort/',
+                 self.admin_site.admin_view(self.upload_abort_view),
+                 name='payroll_form16_upload_abort'),
+        ]
+        return custom_urls + super().get_urls()
+
+    def get_uploading_form16(self, request, object_id):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form16 = self.get_object(request, object_id)
+        if form16 is None or \
+                form16.status != Form16StatusChoices.UPLOADING:
+            raise Http404
+        return form16
+
+    def upload_view(self, request):
+        """
+        Page uploading a Form16 ZIP in parts straight to the storage, for
+        archives too large to go through the add form.
+        """
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.opts,
+            'title': 'Upload Form 16 ZIP',
+        }
+        return TemplateResponse(request, 'admin/payroll/form16/upload.html',
+                                context)
+
+    @method_decorator(require_POST)
+    def upload_start_view(self, request):
+        """
+        Starts the multipart upload of a ZIP described by a JSON body with
+        `financial_year`, `file_name` and `size`, and returns the Form16 ID,
+        the part size and the part URLs as JSON.
+        """
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        try:
+            data = json.loads(request.body)
+            size = int(data['size'])
+            file_name = str(data['file_name'])
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'Invalid upload request.'},
+                                status=400)
+        if not file_name.lower().endswith('.zip') or size <= 0:
+            return JsonResponse({'error': 'Select a non-empty ZIP file.'},
+                                status=400)
+
+        form16, part_size, part_urls = start_form16_upload(
+            data.get('financial_year') or None, file_name, size)
+        return JsonResponse({
+            'id': form16.pk,
+            'part_size': part_size,
+            'part_urls': part_urls,
+            'complete_url': reverse('admin:payroll_form16_upload_complete',
+                                    args=[form16.pk]),
+            'abort_url': reverse('admin:payroll_form16_upload_abort',
+                                 args=[form16.pk]),
+        })
+
+    def upload_part_view(self, request, object_id, part_number):
+        """
+        Stores a part PUT by the browser when the storage has no presigned
+        URLs, and returns its ETag like S3 does.
+        """
+        if request.method != 'PUT':
+            return HttpResponseNotAllowed(['PUT'])
+        backend = get_multipart_backend()
+        if not isinstance(backend, LocalMultipartBackend):
+            raise Http404
+        form16 = self.get_uploading_form16(request, object_id)
+
+        response = HttpResponse()
+        response['ETag'] = backend.save_part(form16, part_number, request)
+        return response
+
+    @method_decorator(require_POST)
+    def upload_complete_view(self, request, object_id):
+        """
+        Completes a multipart upload from a JSON body with the `parts` as
+        {part_number, etag} objects and queues the extraction of the ZIP
+        if its central directory is valid.
+        """
+        form16 = self.get_uploading_form16(request, object_id)
+        try:
+            parts = [(int(part['part_number']), part['etag'])
+                     for part in json.loads(request.body)['parts']]
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'Invalid parts.'}, status=400)
+        # The ETag header is null unless the bucket's CORS rule exposes it
+        if not parts or not all(isinstance(etag, str) and etag
+                                for _, etag in parts):
+            return JsonResponse({'error': 'The ETag of a part is missing. '
+                                          'Check the CORS rule of the '
+                                          'bucket.'}, status=400)
+
+        try:
+            complete_form16_upload(form16, parts)
+        except ValidationError as error:
+            return JsonResponse({'error': ' '.join(error.messages)},
+                                status=400)
+        return JsonResponse({
+            'status': form16.status,
+            'url': reverse('admin:payroll_form16_change', args=[form16.pk]),
+        })
+
+
+    @method_decorator(require_POST)
+    def upload_abort_view(self, request, object_id):
+        """
+        Aborts a multipart upload the browser gave up on, discarding the
+        parts already stored, and marks the Form16 FAILED.
+        """
+        form16 = self.get_uploading_form16(request, object_id)
+        abort_form16_upload(form16, 'The upload was cancelled.')
+        return JsonResponse({'status': form16.status})
+
+
+class Form16UnmatchedPANAdmin(admin.ModelAdmin):
+    list_display = ('pan_no', 'file_name', 'form16')
+    list_filter = ('form16',)
+    list_select_related = ('form16',)
+    search_fields = ('pan_no', 'file_name')
+    list_per_page = 100
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 
 admin.site.register(Payment, PaymentAdmin)
 admin.site.register(PayRecordRegister, PayRecordRegisterAdmin)
 admin.site.register(PayRun, PayRunAdmin)
+admin.site.register(PayRunError, PayRunErrorAdmin)
 admin.site.register(Form16, Forms16Admin)
 admin.site.register(Form16Entries, Forms16EntriesAdmin)
+admin.site.register(Form16UnmatchedPAN, Form16UnmatchedPANAdmin)
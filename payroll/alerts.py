@@ -1,7 +1,13 @@
 from django.contrib import messages
+from django.core.exceptions import ValidationError
+from django.db import transaction
 
-from .models import PayRun, PayRunStatusChoices, Payee
-from .tasks import run_pay_run_task
+from .bank_files import bank_file_response
+from .engine import recalculate_pay_run
+from .models import PayRunStatusChoices, Payee
+from .register_export import register_response
+from .state import get_current_pay_run, get_open_pay_run, set_status
+from .tasks import run_pay_run_task, resume_pay_run_task
 from .utils import check_single_payrun_selection, check_latest_payrun
 
 
@@ -12,26 +18,28 @@ def approve_payrun_action(modeladmin, request, queryset):
     # Retrieves the first PayRun from the queryset or None if empty.
     selected_payrun = queryset.first()
 
-    # Retrieves the most recent PayRun or None if none exist.
-    latest_payrun = PayRun.objects.last()
-
     if check_single_payrun_selection(queryset, modeladmin, request) == False:
         return
 
-    if check_latest_payrun(modeladmin, request, selected_payrun,
-                           latest_payrun) == False:
-        return
+    with transaction.atomic():
+        # Locks the most recent PayRun, or None if none exist, so concurrent
+        # actions on it wait for this one to finish.
+        latest_payrun = get_current_pay_run(lock=True)
 
-    if latest_payrun.status == PayRunStatusChoices.COMPLETED:
-        latest_payrun.status = PayRunStatusChoices.APPROVED
-        latest_payrun.save()
-        modeladmin.message_user(request,
-                                "Pay records have been approved successfully.",
-                                level=messages.SUCCESS)
-    else:
-        modeladmin.message_user(request,
-                                "Entries can only be approved if their status "
-                                "is 'Completed'.", level=messages.ERROR)
+        if check_latest_payrun(modeladmin, request, selected_payrun,
+                               latest_payrun) == False:
+            return
+
+        if latest_payrun.status == PayRunStatusChoices.COMPLETED:
+            set_status(latest_payrun, PayRunStatusChoices.APPROVED)
+            modeladmin.message_user(request,
+                                    "Pay records have been approved "
+                                    "successfully.", level=messages.SUCCESS)
+        else:
+            modeladmin.message_user(request,
+                                    "Entries can only be approved if their "
+                                    "status is 'Completed'.",
+                                    level=messages.ERROR)
 
 
 def reject_payrun_action(modeladmin, request, queryset):
@@ -41,31 +49,33 @@ def reject_payrun_action(modeladmin, request, queryset):
     # Retrieves the first PayRun from the queryset or None if empty.
     selected_payrun = queryset.first()
 
-    # Retrieves the most recent PayRun or None if none exist.
-    latest_payrun = PayRun.objects.last()
-
     if check_single_payrun_selection(queryset, modeladmin, request) == False:
         return
 
-    if check_latest_payrun(modeladmin, request, selected_payrun,
-                           latest_payrun) == False:
-        return
+    with transaction.atomic():
+        # Locks the most recent PayRun, or None if none exist, so concurrent
+        # actions on it wait for this one to finish.
+        latest_payrun = get_current_pay_run(lock=True)
 
-    if latest_payrun.status in [PayRunStatusChoices.COMPLETED,
-                                PayRunStatusChoices.APPROVED,
-                                PayRunStatusChoices.IN_PROGRESS,
-                                PayRunStatusChoices.DUE]:
+        if check_latest_payrun(modeladmin, request, selected_payrun,
+                               latest_payrun) == False:
+            return
 
-        latest_payrun.status = PayRunStatusChoices.REJECTED
-        latest_payrun.save()
+        if latest_payrun.status in [PayRunStatusChoices.COMPLETED,
+                                    PayRunStatusChoices.APPROVED,
+                                    PayRunStatusChoices.IN_PROGRESS,
+                                    PayRunStatusChoices.DUE]:
 
-        modeladmin.message_user(request, "The payrun entry has been rejected.",
-                                level=messages.SUCCESS)
-    else:
-        modeladmin.message_user(request,
-                                "Entries can only be rejected if their status "
-                                "is 'Completed', 'Approved' or 'Due'. ",
-                                level=messages.ERROR)
+            set_status(latest_payrun, PayRunStatusChoices.REJECTED)
+
+            modeladmin.message_user(request,
+                                    "The payrun entry has been rejected.",
+                                    level=messages.SUCCESS)
+        else:
+            modeladmin.message_user(request,
+                                    "Entries can only be rejected if their "
+                                    "status is 'Completed', 'Approved' or "
+                                    "'Due'. ", level=messages.ERROR)
 
 
 def run_payrun_action(modeladmin, request, queryset):
@@ -75,81 +85,196 @@ def run_payrun_action(modeladmin, request, queryset):
     # Retrieves the first PayRun from the queryset or None if empty.
     selected_payrun = queryset.first()
 
-    # Retrieves the most recent PayRun or None if none exist.
-    latest_payrun = PayRun.objects.last()
-
     if check_single_payrun_selection(queryset, modeladmin, request) == False:
         return
 
-    if check_latest_payrun(modeladmin, request, selected_payrun,
-                           latest_payrun) == False:
-        return
+    with transaction.atomic():
+        # Locks the most recent PayRun, or None if none exist, so concurrent
+        # actions on it wait for this one to finish.
+        latest_payrun = get_current_pay_run(lock=True)
 
-    if latest_payrun.status == PayRunStatusChoices.APPROVED:
-        modeladmin.message_user(request,
-                                "The selected pay run has already been "
-                                "approved.", level=messages.ERROR)
+        if check_latest_payrun(modeladmin, request, selected_payrun,
+                               latest_payrun) == False:
+            return
 
-    elif latest_payrun.status == PayRunStatusChoices.COMPLETED:
-        modeladmin.message_user(request,
-                                "The pay run has been completed. To proceed, "
-                                "please choose either 'Approve' or 'Reject'.",
-                                level=messages.ERROR)
+        if latest_payrun.status == PayRunStatusChoices.APPROVED:
+            modeladmin.message_user(request,
+                                    "The selected pay run has already been "
+                                    "approved.", level=messages.ERROR)
 
-    elif latest_payrun.status == PayRunStatusChoices.IN_PROGRESS:
-        modeladmin.message_user(request,
-                                "We’re currently syncing your pay record. "
-                                "Please hold on while we update your "
-                                "information.", level=messages.SUCCESS)
+        elif latest_payrun.status == PayRunStatusChoices.COMPLETED:
+            modeladmin.message_user(request,
+                                    "The pay run has been completed. To "
+                                    "proceed, please choose either 'Approve' "
+                                    "or 'Reject'.", level=messages.ERROR)
 
-    elif latest_payrun.status == PayRunStatusChoices.REJECTED:
-        modeladmin.message_user(request,
-                                "The pay records have been rejected."
-                                "Please initiate a new pay run to proceed.",
-                                level=messages.ERROR)
+        elif latest_payrun.status == PayRunStatusChoices.IN_PROGRESS:
+            modeladmin.message_user(request,
+                                    "We’re currently syncing your pay "
+                                    "record. Please hold on while we update "
+                                    "your information.",
+                                    level=messages.SUCCESS)
+
+        elif latest_payrun.status == PayRunStatusChoices.REJECTED:
+            modeladmin.message_user(request,
+                                    "The pay records have been rejected."
+                                    "Please initiate a new pay run to "
+                                    "proceed.", level=messages.ERROR)
+
+        elif latest_payrun.status == PayRunStatusChoices.DUE:
+
+            payees = Payee.objects.filter(
+                status='active',
+                bankdetails__payee_acknowledgement=True)
+
+            if payees.exists() == False:
+                modeladmin.message_user(request,
+                                        "No active payees found with "
+                                        "acknowledged bank details. Please "
+                                        "check and try again",
+                                        level=messages.ERROR)
+
+                set_status(latest_payrun, PayRunStatusChoices.REJECTED)
+            else:
+                # The pay run is marked in progress under the lock, so a
+                # second click finds it in progress instead of queueing it
+                # again; the task is queued once the status is committed.
+                # A pay run is run once, so its id is the idempotency key
+                # of the task and redeliveries are dropped by the worker.
+                set_status(latest_payrun, PayRunStatusChoices.IN_PROGRESS)
+                payrun_id = latest_payrun.id
+                transaction.on_commit(lambda: run_pay_run_task.apply_async(
+                    (payrun_id,), task_id=f'run-pay-run-{payrun_id}'))
+
+                modeladmin.message_user(request,
+                                        "Your pay run has been successfully "
+                                        "started and is currently being "
+                                        "processed.", level=messages.SUCCESS)
 
-    elif latest_payrun.status == PayRunStatusChoices.DUE:
 
-        payees = Payee.objects.filter(
-            status='active',
-            bankdetails__payee_acknowledgement=True)
+def resume_payrun_action(modeladmin, request, queryset):
+    """
+    Queue a Celery task to resume the selected payrun entry when its
+    processing was interrupted.
+    """
+    # Retrieves the first PayRun from the queryset or None if empty.
+    selected_payrun = queryset.first()
+
+    if check_single_payrun_selection(queryset, modeladmin, request) == False:
+        return
+
+    with transaction.atomic():
+        # Locks the most recent PayRun, or None if none exist, so concurrent
+        # actions on it wait for this one to finish.
+        latest_payrun = get_current_pay_run(lock=True)
 
-        if payees.exists() == False:
+        if check_latest_payrun(modeladmin, request, selected_payrun,
+                               latest_payrun) == False:
+            return
+
+        if latest_payrun.status != PayRunStatusChoices.IN_PROGRESS:
             modeladmin.message_user(request,
-                                    "No active payees found with acknowledged "
-                                    "bank details. Please check and try again",
-                                    level=messages.ERROR)
+                                    "Only pay runs that are in progress can "
+                                    "be resumed.", level=messages.ERROR)
 
-            latest_payrun.status = PayRunStatusChoices.REJECTED
-            latest_payrun.save()
+        elif latest_payrun.is_interrupted() == False:
+            modeladmin.message_user(request,
+                                    "The pay run is still being processed. "
+                                    "It can be resumed once it stops making "
+                                    "progress.", level=messages.ERROR)
         else:
-            run_pay_run_task.delay(latest_payrun.id)
+            payrun_id = latest_payrun.id
+            transaction.on_commit(
+                lambda: resume_pay_run_task.delay(payrun_id))
 
             modeladmin.message_user(request,
-                                    "Your pay run has been successfully "
-                                    "started and is currently being processed.",
+                                    "Your pay run has been resumed and the "
+                                    "remaining payees are being processed.",
                                     level=messages.SUCCESS)
 
 
+def recalculate_payrun_action(modeladmin, request, queryset):
+    """
+    Recalculate the gross amount and net income of every pay record of the
+    selected payrun entries, e.g. after their components were edited.
+    Only completed payruns are recalculated: records still being processed
+    or of rejected and approved payruns are left untouched. The records are
+    rewritten in one UPDATE, so their own history does not show the new
+    amounts; one entry in the history of the payrun records it instead.
+    """
+    payruns = list(queryset.filter(status=PayRunStatusChoices.COMPLETED))
+    if not payruns:
+        modeladmin.message_user(request,
+                                "Only completed pay runs can be "
+                                "recalculated.", level=messages.ERROR)
+        return
+
+    updated = sum(recalculate_pay_run(payrun, actor=request.user)
+                  for payrun in payruns)
+
+    modeladmin.message_user(request,
+                            f"Gross and net amounts have been recalculated "
+                            f"for {updated} pay records of {len(payruns)} "
+                            f"completed pay runs. The history of the pay "
+                            f"runs records this; the history of the pay "
+                            f"records does not.",
+                            level=messages.SUCCESS)
+
+
+def export_bank_file_action(modeladmin, request, queryset, file_format):
+    """
+    Download the bulk bank transfer file of the selected payrun entry,
+    which must be approved.
+    """
+    if check_single_payrun_selection(queryset, modeladmin, request) == False:
+        return None
+
+    selected_payrun = queryset.first()
+    if selected_payrun.status != PayRunStatusChoices.APPROVED:
+        modeladmin.message_user(request,
+                                "Bank transfer files can only be exported "
+                                "for approved pay runs.",
+                                level=messages.ERROR)
+        return None
+
+    try:
+        return bank_file_response(
+            selected_payrun, file_format,
+            records=modeladmin.get_register_queryset(request))
+    except ValidationError as error:
+        modeladmin.message_user(request,
+                                "The bank transfer file was not generated: "
+                                + ' '.join(error.messages),
+                                level=messages.ERROR)
+        return None
+
+
+def export_register_action(modeladmin, request, queryset, file_format):
+    """
+    Download the payroll register of the selected payrun entry, with one
+    column per earning and deduction component.
+    """
+    if check_single_payrun_selection(queryset, modeladmin, request) == False:
+        return None
+
+    return register_response(
+        queryset.first(), file_format,
+        records=modeladmin.get_register_queryset(request))
+
+
 def is_payrun_exists(request):
     """
-    Checks the status of the latest PayRun instance. If the status is DUE,
-    COMPLETED, or IN_PROGRESS, it displays an error message and returns True,
+    Checks whether a PayRun is still open, i.e. its status is DUE, COMPLETED
+    or IN_PROGRESS. If so, it displays an error message and returns True,
     indicating that a new PayRun cannot be created until the existing one is
     finished. Otherwise, it returns False.
     """
-    latest_payrun = PayRun.objects.last()
-    if latest_payrun:
-        conflicting_statuses = [
-            PayRunStatusChoices.DUE,
-            PayRunStatusChoices.COMPLETED,
-            PayRunStatusChoices.IN_PROGRESS
-        ]
-        if latest_payrun.status in conflicting_statuses:
-            messages.error(request, (
-                f"A Pay Run already exists with the status "
-                f"'{latest_payrun.get_status_display()}'. "
-                "Please finish the existing Pay Run before creating a new one."
-            ))
-            return True
+    open_payrun = get_open_pay_run()
+    if open_payrun:
+        messages.error(request, (
+            f"A Pay Run already exists with the status "
+            f"'{open_payrun.get_status_display()}'. "
+            "Please finish the existing Pay Run before creating a new one."
+        ))
+        return True
     return False
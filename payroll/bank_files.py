@@ -0,0 +1,203 @@
+"""
+Bulk bank transfer files for approved pay runs.
+
+The file is generated in a single pass over the pay records, read through a
+server-side cursor, so memory stays constant whatever the headcount. The
+trailer carries the record count, the control total of the amounts and a
+SHA-256 checksum of the detail lines, computed in the same pass.
+
+A value that does not fit its field is never truncated, as a cut account
+number pays the wrong account: the records are checked in a first pass
+before the response starts, and generating the line of one raises.
+"""
+import csv
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import StreamingHttpResponse
+
+from .calculations import from_paise, to_paise
+from .models import PayRecordRegister
+
+# Transfers from this amount (in rupees) go over RTGS, smaller ones over NEFT
+RTGS_MINIMUM_AMOUNT = 200000
+
+CSV = 'csv'
+FIXED_WIDTH = 'fixed'
+
+CONTENT_TYPES = {CSV: 'text/csv', FIXED_WIDTH: 'text/plain'}
+EXTENSIONS = {CSV: 'csv', FIXED_WIDTH: 'txt'}
+
+# (label, width, alignment, padding) of the fields of a detail line; the
+# widths bound the values of the CSV format as well
+FIXED_WIDTH_FIELDS = (
+    ('Record type', 1, '<', ' '),
+    ('Transfer mode', 4, '<', ' '),
+    ('Account number', 20, '>', '0'),
+    ('IFSC code', 11, '<', ' '),
+    ('Beneficiary name', 35, '<', ' '),
+    ('Amount in paise', 15, '>', '0'),
+    ('Reference', 20, '<', ' '),
+    ('Narration', 30, '<', ' '),
+)
+
+# Index of the amount in paise in the values of a detail line
+AMOUNT_INDEX = 5
+
+# Fields of a detail line that must not be blank, as the bank cannot credit
+# a transfer without them
+REQUIRED_FIELDS = ('Account number', 'IFSC code', 'Beneficiary name')
+
+RECORD_FIELDS = ('payee__hrm_id', 'account_number', 'ifsc_code',
+                 'account_holder_name', 'net_income')
+
+
+class Echo:
+    """ File-like object whose write() returns the value written """
+
+    def write(self, value):
+        return value
+
+
+def _clean(value):
+    """
+    Strips the separators and control characters banks reject from a
+    free-text field.
+    """
+    return re.sub(r'[^A-Za-z0-9 ./-]', ' ', value or '').strip()
+
+
+def _fixed_width_line(values):
+    fields = []
+    for value, (_, width, alignment, padding) in zip(values,
+                                                     FIXED_WIDTH_FIELDS):
+        value = '' if value is None else str(value)
+        fields.append(f'{value:{padding}{alignment}{width}}')
+    return ''.join(fields) + '\r\n'
+
+
+def _get_narration(pay_run):
+    return _clean(f'Salary {pay_run.display_month_name()} {pay_run.year}')
+
+
+def _get_records(pay_run, records=None):
+    if records is None:
+        records = PayRecordRegister.objects.all()
+    return records.filter(pay_run=pay_run).order_by(
+        'id').values_list(*RECORD_FIELDS).iterator(
+        chunk_size=settings.PAYRUN_EXPORT_CHUNK_SIZE)
+
+
+def get_detail_values(record, narration):
+    """
+    Returns the values of the detail line of a pay record, with the amount
+    in paise. Raises a ValueError if a value is longer than its field, the
+    account number, IFSC code or beneficiary name is blank or the amount
+    is not positive.
+    """
+    reference, account_number, ifsc_code, name, net_income = record
+    paise = to_paise(net_income)
+    mode = ('RTGS' if paise >= RTGS_MINIMUM_AMOUNT * 100 else 'NEFT')
+    values = ['D', mode, account_number, ifsc_code, _clean(name), paise,
+              reference, narration]
+
+    for value, (label, width, _, _) in zip(values, FIXED_WIDTH_FIELDS):
+        value = '' if value is None else str(value)
+        if label in REQUIRED_FIELDS and not value.strip():
+            raise ValueError(f"{label} is missing.")
+        if len(value) > width:
+            raise ValueError(f"{label} '{value}' is longer than {width} "
+                             f"characters.")
+    if paise <= 0:
+        raise ValueError(f"Amount {from_paise(paise)} is not positive.")
+    return values
+
+
+def get_bank_file_errors(pay_run, records=None):
+    """
+    Returns a message for every pay record of a pay run that cannot be
+    written to its bank file, read in one pass over the register.
+    """
+    narration = _get_narration(pay_run)
+    errors = []
+    for record in _get_records(pay_run, records):
+        try:
+            get_detail_values(record, narration)
+        except ValueError as error:
+            errors.append(f'{record[0]}: {error}')
+    return errors
+
+
+def get_bank_file_name(pay_run, file_format):
+    return (f'bank-transfer-{pay_run.year}-{pay_run.month:02d}.'
+            f'{EXTENSIONS[file_format]}')
+
+
+def generate_bank_file(pay_run, file_format=CSV, records=None):
+    """
+    Yields the lines of the bulk payment file of a pay run: a header, one
+    NEFT/RTGS detail line per pay record and a trailer with the record
+    count, the control total and the SHA-256 checksum of the detail lines.
+    `file_format` is CSV or FIXED_WIDTH; `records` limits the file to a
+    queryset of pay records. Raises a ValueError at a pay record that does
+    not fit the file.
+    """
+    writer = csv.writer(Echo())
+    narration = _get_narration(pay_run)
+    debit_account = settings.BANK_TRANSFER_DEBIT_ACCOUNT
+
+    if file_format == CSV:
+        yield writer.writerow(['H', debit_account, pay_run.month,
+                               pay_run.year])
+        yield writer.writerow(['Record type', 'Transfer mode',
+                               'Beneficiary account number', 'IFSC code',
+                               'Beneficiary name', 'Amount', 'Reference',
+                               'Narration'])
+    else:
+        yield (f'H{debit_account:<20}{pay_run.year:04d}'
+               f'{pay_run.month:02d}\r\n')
+
+    checksum = hashlib.sha256()
+    count = 0
+    control_total = 0
+
+    for record in _get_records(pay_run, records):
+        values = get_detail_values(record, narration)
+        paise = values[AMOUNT_INDEX]
+
+        if file_format == CSV:
+            values[AMOUNT_INDEX] = from_paise(paise)
+            line = writer.writerow(values)
+        else:
+            line = _fixed_width_line(values)
+
+        checksum.update(line.encode())
+        count += 1
+        control_total += paise
+        yield line
+
+    if file_format == CSV:
+        yield writer.writerow(['T', count, from_paise(control_total),
+                               checksum.hexdigest()])
+    else:
+        yield f'T{count:09d}{control_total:018d}{checksum.hexdigest()}\r\n'
+
+
+def bank_file_response(pay_run, file_format=CSV, records=None):
+    """
+    Returns a StreamingHttpResponse that downloads the bulk payment file of
+    a pay run as it is generated. Raises a ValidationError listing the pay
+    records that cannot be written to the file before anything is sent.
+    """
+    errors = get_bank_file_errors(pay_run, records)
+    if errors:
+        raise ValidationError(errors)
+
+    response = StreamingHttpResponse(
+        generate_bank_file(pay_run, file_format, records),
+        content_type=CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = (
+        f'attachment; filename="{get_bank_file_name(pay_run, file_format)}"')
+    return response
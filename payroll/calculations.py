@@ -0,0 +1,57 @@
+"""
+Gross/TDS/net calculation shared by the pay run and the admin.
+
+Amounts stay rupee Decimals, as the register stores them, and the TDS amount
+is rounded half up to the paisa. Converting whole columns to integer paise
+for a batched calculation was measured slower end to end than this per-row
+Decimal arithmetic, as every value has to be converted both ways; the
+benchmark_pay_kernel command compares the two.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+PAISA = Decimal('0.01')
+
+ZERO = Decimal('0')
+
+
+def to_paise(amount):
+    """
+    Converts a rupee amount (Decimal, int, str or None) to integer paise.
+    """
+    if amount is None:
+        return 0
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int(amount.scaleb(2).to_integral_value(ROUND_HALF_UP))
+
+
+def from_paise(paise):
+    """
+    Converts integer paise back to a rupee Decimal with two decimal places.
+    """
+    return Decimal(paise).scaleb(-2)
+
+
+@lru_cache(maxsize=None)
+def to_tds_rate(tds_percentage):
+    """
+    Converts a TDS percentage (float, Decimal or None) to the Decimal
+    fraction of the gross amount withheld.
+    """
+    if tds_percentage is None:
+        return ZERO
+    return Decimal(str(tds_percentage)).scaleb(-2)
+
+
+def compute_pay(amount, earnings, deductions, tds_percentage):
+    """
+    Computes gross, TDS and net pay of a payee from the base amount, the
+    sums of the 'sum' and 'subtract' components and the TDS percentage.
+    The TDS amount is rounded half up to the nearest paisa.
+    Returns the three amounts as Decimals.
+    """
+    gross = (amount or ZERO) + earnings - deductions
+    tds = (gross * to_tds_rate(tds_percentage)).quantize(PAISA,
+                                                         ROUND_HALF_UP)
+    return gross, tds, gross - tds
@@ -0,0 +1,511 @@
+import hashlib
+import logging
+
+from auditlog.models import LogEntry
+from collections import Counter, defaultdict
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (Count, DecimalField, F, OuterRef, Q, Subquery,
+                              Sum, Value)
+from django.db.models.functions import Cast, Coalesce, Round
+from django.utils import timezone
+
+from .calculations import ZERO, compute_pay
+from .models import (Payment, PayRun, PayRecordRegister, PayRunCheckpoint,
+                     PayRunError, PayRunErrorCodeChoices, PayRunStatusChoices,
+                     ComponentValue)
+from .progress import finish_progress, record_progress
+from .state import set_status
+from .summaries import build_pay_run_summary
+from configs.catalog import get_components, get_tds_percentages
+from payees.models import Payee, BankDetails
+
+# For getting the named logger
+logger = logging.getLogger('celery_debug')
+
+# The PayRecordRegister fields taken from the payee's payment, bank details
+# and TDS type; a record whose fingerprint over these fields is unchanged
+# can be carried forward from a rejected run of the same month.
+FINGERPRINT_FIELDS = ('amount', 'bank_name', 'account_number',
+                      'account_holder_name', 'account_type', 'ifsc_code',
+                      'micr_code', 'swift_code', 'branch_address',
+                      'tds_percentage')
+
+# Seconds a computed preview is reused while its pages are browsed
+PREVIEW_TIMEOUT = 60 * 5
+
+# Would-be errors listed on the preview page; the rest are only counted
+PREVIEW_ERROR_LIMIT = 100
+
+
+def get_eligible_payees():
+    """
+    Returns the payees that take part in a pay run: active and not deleted.
+    """
+    return Payee.objects.filter(status='active', is_deleted=False)
+
+
+def get_payee_shards(payees, shard_size=None, parallelism=None):
+    """
+    Splits the payees into contiguous ID ranges for a sharded pay run.
+    Each shard holds about `shard_size` payees; when that would produce more
+    than `parallelism` shards the shards are widened instead.
+    Returns a list of (first_payee_id, last_payee_id) tuples.
+    """
+    shard_size = shard_size or settings.PAYRUN_SHARD_SIZE
+    parallelism = parallelism or settings.PAYRUN_SHARD_PARALLELISM
+
+    payee_ids = list(payees.order_by('id').values_list('id', flat=True))
+    if not payee_ids:
+        return []
+
+    shard_count = min(parallelism, -(-len(payee_ids) // shard_size))
+    shard_size = -(-len(payee_ids) // shard_count)
+
+    return [(payee_ids[start],
+             payee_ids[min(start + shard_size, len(payee_ids)) - 1])
+            for start in range(0, len(payee_ids), shard_size)]
+
+
+def load_pay_run_inputs(payees):
+    """
+    Loads everything a pay run needs for the given payees in a constant
+    number of queries, independent of the headcount.
+    Returns the payees and two lookups keyed by payee id: acknowledged bank
+    details and payment amounts.
+    """
+    payee_ids = payees.values('id')
+
+    bank_details_by_payee = {
+        bank_details.payee_id: bank_details
+        for bank_details in BankDetails.objects.filter(
+            payee__in=payee_ids, payee_acknowledgement=True).order_by('id')
+    }
+
+    amount_by_payee = dict(
+        Payment.objects.filter(payee__in=payee_ids).values_list(
+            'payee_id', 'amount'))
+
+    payees = list(payees.order_by('id'))
+
+    return payees, bank_details_by_payee, amount_by_payee
+
+
+def get_previous_pay_run(pay_run):
+    """
+    Returns the latest rejected pay run of the same month that a re-run can
+    reuse unchanged records from, or None when PAYRUN_DIFFERENTIAL_RERUN is
+    disabled or there is none.
+    """
+    if not settings.PAYRUN_DIFFERENTIAL_RERUN:
+        return None
+
+    return PayRun.objects.filter(
+        month=pay_run.month, year=pay_run.year,
+        status=PayRunStatusChoices.REJECTED,
+        created_at__lte=pay_run.created_at).exclude(
+        id=pay_run.id).order_by('-created_at').first()
+
+
+def load_previous_pay_records(previous_pay_run, payees):
+    """
+    Loads the register snapshot of a previous pay run for the given payees
+    in two queries.
+    Returns two lookups keyed by payee id: the previous records and the
+    (component id, operation, value) tuples of their component values.
+    """
+    if previous_pay_run is None:
+        return {}, {}
+
+    payee_ids = payees.values('id')
+
+    previous_records = {
+        record.payee_id: record
+        for record in PayRecordRegister.objects.filter(
+            pay_run=previous_pay_run, payee__in=payee_ids).only(
+            'payee_id', 'gross_amount', 'net_income', 'input_fingerprint')
+    }
+
+    operations = {component.id: component.operation
+                  for component in get_components()}
+    previous_components = defaultdict(list)
+    for payee_id, component_id, value in ComponentValue.objects.filter(
+            pay_record__pay_run=previous_pay_run,
+            pay_record__payee__in=payee_ids).order_by('id').values_list(
+            'pay_record__payee_id', 'component_id', 'value'):
+        previous_components[payee_id].append(
+            (component_id, operations.get(component_id), value))
+
+    return previous_records, dict(previous_components)
+
+
+def get_input_fingerprint(record):
+    """
+    Returns a SHA-256 fingerprint of the payment, bank and TDS inputs of a
+    pay record.
+    """
+    return hashlib.sha256('\x1f'.join(
+        str(getattr(record, field)) for field in FINGERPRINT_FIELDS
+    ).encode()).hexdigest()
+
+
+def build_pay_records(pay_run, payees, bank_details_by_payee,
+                      amount_by_payee, previous_records=None,
+                      previous_components=None):
+    """
+    Computes the PayRecordRegister rows of a pay run in memory.
+    When the snapshot of a previous run is given, records whose input
+    fingerprint did not change carry their gross amount and net income
+    forward; the others are recomputed including the component values
+    carried over from the previous run.
+    Returns the unsaved records and the unsaved PayRunError rows for the
+    payees that could not be processed.
+    """
+    previous_records = previous_records or {}
+    previous_components = previous_components or {}
+    records = []
+    changed_records = []
+    errors = []
+    # Resolved once, as every catalog lookup checks the shared version
+    tds_percentages = get_tds_percentages()
+
+    for payee in payees:
+        bank_details = bank_details_by_payee.get(payee.id)
+        if bank_details is None:
+            errors.append(PayRunError(
+                pay_run=pay_run, payee=payee,
+                code=PayRunErrorCodeChoices.MISSING_BANK_DETAILS))
+            continue
+
+        amount = amount_by_payee.get(payee.id)
+        if amount is None:
+            errors.append(PayRunError(
+                pay_run=pay_run, payee=payee,
+                code=PayRunErrorCodeChoices.MISSING_PAYMENT))
+            continue
+
+        tds_percentage = Decimal(str(
+            tds_percentages.get(payee.tds_type_id) or 0))
+
+        record = PayRecordRegister(
+            pay_run=pay_run,
+            amount=amount,
+            payee=payee,
+            bank_name=bank_details.bank_name,
+            account_number=bank_details.account_no,
+            account_holder_name=bank_details.account_holder_name,
+            account_type=bank_details.account_type,
+            ifsc_code=bank_details.ifsc_code,
+            micr_code=bank_details.micr_code,
+            swift_code=bank_details.swift_code,
+            branch_address=bank_details.branch_address,
+            tds_percentage=tds_percentage,
+            tds_type=payee.tds_type_id or '',
+        )
+        record.input_fingerprint = get_input_fingerprint(record)
+        records.append(record)
+
+        previous_record = previous_records.get(payee.id)
+        if previous_record is not None and \
+                previous_record.input_fingerprint == record.input_fingerprint:
+            record.gross_amount = previous_record.gross_amount
+            # net_income is read back from a FloatField
+            record.net_income = (
+                None if previous_record.net_income is None
+                else Decimal(str(previous_record.net_income)))
+        else:
+            changed_records.append(record)
+
+    earnings = [ZERO] * len(changed_records)
+    deductions = [ZERO] * len(changed_records)
+    for index, record in enumerate(changed_records):
+        for _, operation, value in previous_components.get(record.payee_id,
+                                                           []):
+            if operation == 'sum':
+                earnings[index] += value
+            else:
+                deductions[index] += value
+
+    apply_pay_calculations(changed_records, earnings, deductions)
+
+    return records, errors
+
+
+def carry_forward_component_values(records, previous_components):
+    """
+    Copies the component values of the previous run onto the saved records
+    of the same payees with one bulk insert.
+    """
+    ComponentValue.objects.bulk_create([
+        ComponentValue(pay_record=record, component_id=component_id,
+                       value=value)
+        for record in records
+        for component_id, _, value in previous_components.get(
+            record.payee_id, [])
+    ], batch_size=settings.PAYRUN_BULK_CREATE_BATCH_SIZE)
+
+
+def apply_pay_calculations(records, earnings=None, deductions=None):
+    """
+    Sets gross_amount and net_income of the given records from their amount
+    and TDS percentage.
+    `earnings` and `deductions` are optional columns of component sums,
+    aligned with the records.
+    """
+    no_components = [ZERO] * len(records)
+    for record, earning, deduction in zip(records,
+                                          earnings or no_components,
+                                          deductions or no_components):
+        record.gross_amount, _, record.net_income = compute_pay(
+            record.amount, earning, deduction, record.tds_percentage)
+
+
+def get_component_totals(pay_record):
+    """
+    Returns the sums of the 'sum' and 'subtract' component values of a pay
+    record with a single conditional aggregate query.
+    """
+    totals = ComponentValue.objects.filter(pay_record=pay_record).aggregate(
+        earnings=Sum('value', filter=Q(component__operation='sum')),
+        deductions=Sum('value', filter=Q(component__operation='subtract')))
+    return totals['earnings'] or ZERO, totals['deductions'] or ZERO
+
+
+def recalculate_pay_record(pay_record):
+    """
+    Recomputes gross_amount and net_income of a pay record from its amount,
+    component values and TDS percentage and writes them in one UPDATE.
+    """
+    earnings, deductions = get_component_totals(pay_record)
+    apply_pay_calculations([pay_record], [earnings], [deductions])
+    pay_record.save(update_fields=['gross_amount', 'net_income'])
+
+
+def _component_sum(operation):
+    """
+    Subquery summing the component values of the outer pay record for one
+    operation, or 0 when there are none.
+    """
+    money = DecimalField(max_digits=12, decimal_places=2)
+    return Coalesce(Subquery(
+        ComponentValue.objects.filter(
+            pay_record=OuterRef('pk'), component__operation=operation
+        ).order_by().values('pay_record').annotate(
+            total=Sum('value')).values('total'),
+        output_field=money), Value(Decimal('0')), output_field=money)
+
+
+def recalculate_pay_records(pay_records):
+    """
+    Recomputes gross_amount and net_income of every given pay record in a
+    single set-based UPDATE, with the same half-up rounding of the TDS
+    amount to the paisa as compute_pay.
+    The UPDATE bypasses auditlog, so no history is kept per pay record; see
+    recalculate_pay_run.
+    Returns the number of updated records.
+    """
+    money = DecimalField(max_digits=12, decimal_places=2)
+    gross = (Coalesce(F('amount'), Value(Decimal('0')), output_field=money)
+             + _component_sum('sum') - _component_sum('subtract'))
+    tds_amount = Round(
+        gross * Cast(Coalesce(F('tds_percentage'), Value(0.0)),
+                     DecimalField(max_digits=9, decimal_places=4))
+        / Value(Decimal('100')), 2, output_field=money)
+
+    return pay_records.update(gross_amount=gross,
+                              net_income=gross - tds_amount)
+
+
+def recalculate_pay_run(pay_run, actor=None):
+    """
+    Recomputes the pay records and the summary of a pay run, and records the
+    recalculation as one audit log entry on the pay run, since the history
+    of the individual pay records does not show it.
+    Returns the number of updated records.
+    """
+    with transaction.atomic():
+        updated = recalculate_pay_records(
+            PayRecordRegister.objects.filter(pay_run=pay_run))
+        build_pay_run_summary(pay_run)
+        LogEntry.objects.log_create(
+            pay_run, force_log=True, action=LogEntry.Action.UPDATE,
+            actor=actor, changes={
+                'pay records': ['', f'{updated} recalculated']})
+    return updated
+
+
+def get_unprocessed_payees(pay_run, payees):
+    """
+    Excludes the payees already covered by a checkpoint of the pay run.
+    """
+    for first_payee_id, last_payee_id in pay_run.checkpoints.values_list(
+            'first_payee_id', 'last_payee_id'):
+        payees = payees.exclude(id__range=(first_payee_id, last_payee_id))
+    return payees
+
+
+def run_pay_run(pay_run, payees=None, heartbeat=None):
+    """
+    Creates the PayRecordRegister rows of a pay run.
+    The inputs are loaded once; the rows are then written in chunks of
+    PAYRUN_CHECKPOINT_SIZE payees, each chunk committed with chunked bulk
+    inserts in one transaction together with its PayRunCheckpoint.
+    Payees already covered by a checkpoint are skipped, so calling this
+    again after an interruption only processes the remainder.
+    `heartbeat`, if given, is called after every committed chunk.
+    Returns the number of payees that were skipped.
+    """
+    if payees is None:
+        payees = get_eligible_payees()
+
+    payees = get_unprocessed_payees(pay_run, payees)
+    previous_records, previous_components = load_previous_pay_records(
+        get_previous_pay_run(pay_run), payees)
+    payees, bank_details_by_payee, amount_by_payee = load_pay_run_inputs(
+        payees)
+
+    checkpoint_size = settings.PAYRUN_CHECKPOINT_SIZE
+    created_count = 0
+    error_count = 0
+
+    for start in range(0, len(payees), checkpoint_size):
+        chunk = payees[start:start + checkpoint_size]
+        records, errors = build_pay_records(
+            pay_run, chunk, bank_details_by_payee, amount_by_payee,
+            previous_records, previous_components)
+
+        with transaction.atomic():
+            PayRecordRegister.objects.bulk_create(
+                records, batch_size=settings.PAYRUN_BULK_CREATE_BATCH_SIZE)
+            carry_forward_component_values(records, previous_components)
+            PayRunError.objects.bulk_create(
+                errors, batch_size=settings.PAYRUN_BULK_CREATE_BATCH_SIZE)
+            PayRunCheckpoint.objects.create(
+                pay_run=pay_run,
+                first_payee_id=chunk[0].id,
+                last_payee_id=chunk[-1].id)
+
+        record_progress(pay_run.id, len(records), len(errors))
+        if heartbeat is not None:
+            heartbeat()
+        created_count += len(records)
+        error_count += len(errors)
+
+    logger.info('PayRun %s: %s records created, %s payees skipped.',
+                pay_run.id, created_count, error_count)
+    return error_count
+
+
+def preview_pay_run(pay_run, payees=None):
+    """
+    Computes the full register of a pay run in memory without writing to
+    the database, using the same batched reads and calculations as
+    run_pay_run.
+    Returns a dict with the unsaved records, the would-be errors and the
+    totals of the register.
+    """
+    if payees is None:
+        payees = get_eligible_payees()
+
+    records, errors = build_pay_records(
+        pay_run, *load_pay_run_inputs(payees),
+        *load_previous_pay_records(get_previous_pay_run(pay_run), payees))
+
+    total_amount = sum((record.amount for record in records), Decimal('0'))
+    total_gross_amount = sum((record.gross_amount for record in records),
+                             Decimal('0'))
+    total_net_income = sum((record.net_income for record in records),
+                           Decimal('0'))
+
+    return {
+        'records': records,
+        'errors': errors,
+        'headcount': len(records),
+        'total_amount': total_amount,
+        'total_gross_amount': total_gross_amount,
+        'total_tds': total_gross_amount - total_net_income,
+        'total_net_income': total_net_income,
+    }
+
+
+def get_pay_run_preview(pay_run, refresh=False):
+    """
+    Returns the preview of a pay run for display, computed by
+    preview_pay_run once and cached for PREVIEW_TIMEOUT seconds so paging
+    through it does not recompute the register, unless `refresh` is set.
+    The records are reduced to their displayed values and the would-be
+    errors to their counts per error code and the first
+    PREVIEW_ERROR_LIMIT of them.
+    """
+    key = f'payroll:payrun:{pay_run.id}:preview'
+    preview = None if refresh else cache.get(key)
+    if preview is not None:
+        return preview
+
+    computed = preview_pay_run(pay_run)
+    errors = computed.pop('errors')
+    error_counts = Counter(error.code for error in errors)
+    preview = {
+        **computed,
+        'records': [{
+            'payee': str(record.payee),
+            'amount': record.amount,
+            'tds_percentage': record.tds_percentage,
+            'net_income': record.net_income,
+            'bank_name': record.bank_name,
+            'account_number': record.account_number,
+        } for record in computed['records']],
+        'error_count': len(errors),
+        'error_counts': [(PayRunErrorCodeChoices(code).label, count)
+                         for code, count in sorted(error_counts.items())],
+        'errors': [str(error) for error in errors[:PREVIEW_ERROR_LIMIT]],
+        'computed_at': timezone.now(),
+    }
+    cache.set(key, preview, PREVIEW_TIMEOUT)
+    return preview
+
+
+def get_error_counts(pay_run):
+    """
+    Returns the number of skipped payees of a pay run per error code, with
+    a single GROUP BY query.
+    """
+    return dict(pay_run.errors.order_by('code').values_list('code').annotate(
+        count=Count('id')))
+
+
+def complete_pay_run(pay_run):
+    """
+    Summarizes the errors recorded for a processed pay run in its error log,
+    builds its PayRunSummary rows and marks it as completed.
+    The pay run is locked and completed only if it is still in progress, so
+    a pay run rejected while its workers were finishing stays rejected.
+    Returns the completed pay run, or None when it was left unchanged.
+    """
+    with transaction.atomic():
+        pay_run = PayRun.objects.select_for_update().get(id=pay_run.id)
+
+        if pay_run.status != PayRunStatusChoices.IN_PROGRESS:
+            logger.warning('PayRun %s is %s, not completing it.',
+                           pay_run.id, pay_run.status)
+            finish_progress(pay_run.id, pay_run.status)
+            return None
+
+        error_counts = get_error_counts(pay_run)
+
+        if error_counts:
+            pay_run.error_log = '\n'.join(
+                f"{PayRunErrorCodeChoices(code).label}: {count}"
+                for code, count in error_counts.items())
+        else:
+            pay_run.error_log = ('PayRecordRegister created successfully for '
+                                 'every payee.')
+
+        build_pay_run_summary(pay_run)
+        set_status(pay_run, PayRunStatusChoices.COMPLETED,
+                   fields=['error_log'])
+
+    finish_progress(pay_run.id)
+    return pay_run
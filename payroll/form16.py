@@ -0,0 +1,323 @@
+"""
+Extraction of the Form16 ZIP uploads into Form16Entries.
+
+Extraction runs in a Celery task rather than in the admin request. The
+members are streamed out of the archive with ZipFile.open() straight to
+storage, so a PDF is never read fully into memory, and the progress is
+recorded on the Form16 row. Each member is stored under a deterministic
+key derived from the upload and its file name, so extracting it again
+overwrites it while the documents of other uploads are left alone.
+
+Every entry records the SHA-256 of its document. When a corrected ZIP is
+uploaded for the same financial year, the members whose hash matches the
+current entry of their file name are not uploaded again and their entries
+point to the stored document, and the previous entries are marked as
+superseded by the new ones, keeping their own documents.
+"""
+import hashlib
+import logging
+import os
+import zipfile
+
+from django.core.exceptions import ValidationError
+
+from .models import (Form16, Form16Entries, Form16StatusChoices,
+                     Form16UnmatchedPAN)
+from .upload_helpers import check_zip_limits
+from .uploaders import StorageUploader, download_stored_file
+from payees.models import Payee
+
+# For getting the named logger
+logger = logging.getLogger('celery_debug')
+
+# Form16Entries inserted per bulk insert, after which the progress counter
+# is saved
+BATCH_SIZE = 500
+
+FORM16_EXTENSIONS = ('.pdf', '.xml')
+
+# Bytes read from a ZIP member at a time while hashing it
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class HashingReader:
+    """ File-like object that hashes the content read through it """
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.hash.update(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MemberUpload:
+    """
+    Opens a ZIP member for the StorageUploader. A member without a current
+    entry is hashed as it is uploaded; otherwise it is hashed first and not
+    opened for upload when the hash matches the one of the entry, whose
+    document `name` it then shares.
+    """
+
+    def __init__(self, zip_ref, info, key, stored_name='', stored_hash=''):
+        self.zip_ref = zip_ref
+        self.info = info
+        self.key = key
+        self.stored_name = stored_name
+        self.stored_hash = stored_hash
+        self.unchanged = False
+        self.reader = None
+        self._content_hash = ''
+
+    @property
+    def content_hash(self):
+        if self.reader is not None:
+            return self.reader.hash.hexdigest()
+        return self._content_hash
+
+    @property
+    def name(self):
+        """ The storage name of the member's document """
+        return self.stored_name if self.unchanged else self.key
+
+    def __call__(self):
+        if not self.stored_hash:
+            self.reader = HashingReader(self.zip_ref.open(self.info))
+            return self.reader
+
+        digest = hashlib.sha256()
+        with self.zip_ref.open(self.info) as member:
+            for chunk in iter(lambda: member.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        self._content_hash = digest.hexdigest()
+
+        if self._content_hash == self.stored_hash:
+            self.unchanged = True
+            return None
+        return self.zip_ref.open(self.info)
+
+
+def is_form16_member(info):
+    """
+    Whether a ZIP member is a Form16 document, skipping directories and
+    the Apple metadata files.
+    """
+    file_name = info.filename
+    if info.is_dir() or '__MACOSX' in file_name or \
+            os.path.basename(file_name).startswith('._'):
+        return False
+    return file_name.lower().endswith(FORM16_EXTENSIONS)
+
+
+def validate_form16_zip(file):
+    """
+    Raises a ValidationError unless `file` is a ZIP containing Form16
+    documents within the limits of check_zip_limits. Only the end record
+    and the central directory are read, so a ranged reader over storage
+    fetches a small part of the archive.
+    """
+    try:
+        with zipfile.ZipFile(file) as zip_ref:
+            check_zip_limits(zip_ref.infolist())
+            if not any(is_form16_member(info)
+                       for info in zip_ref.infolist()):
+                raise ValidationError(
+                    "The ZIP file contains no Form16 PDF or XML files.")
+    except zipfile.BadZipFile:
+        raise ValidationError("The uploaded file is not a valid ZIP file.")
+
+
+def get_pan_no(file_name):
+    """ Returns the PAN prefixing the file name of a Form16 document """
+    return os.path.basename(file_name).split('_')[0].upper()
+
+
+def resolve_payee_ids(pan_numbers):
+    """
+    Returns the IDs of the payees with one of the PANs, keyed by PAN, read
+    in a single query.
+    """
+    return dict(Payee.objects.filter(pan_no__in=set(pan_numbers)).values_list(
+        'pan_no', 'id'))
+
+
+def claim_form16(form16_id):
+    """
+    Moves a pending Form16 to EXTRACTING and returns it, or returns None if
+    another task already claimed it.
+    """
+    claimed = Form16.objects.filter(
+        pk=form16_id, status=Form16StatusChoices.PENDING).update(
+        status=Form16StatusChoices.EXTRACTING, extracted_files=0, error='')
+    if not claimed:
+        return None
+    return Form16.objects.get(pk=form16_id)
+
+
+def form16_entry_path(form16, filename):
+    """ Returns the storage path of an extracted Form16 document """
+    return Form16Entries.form_16.field.generate_filename(
+        Form16Entries(financial_year=form16), filename)
+
+
+def get_current_entries(form16):
+    """
+    Returns the entries of the other uploads of the financial year of a
+    Form16 that are not superseded, keyed by the file name of their
+    document.
+    """
+    entries = Form16Entries.objects.filter(
+        financial_year__financial_year=form16.financial_year,
+        superseded_by=None).exclude(financial_year=form16).only(
+        'id', 'form_16', 'content_hash')
+    return {os.path.basename(entry.form_16.name): entry for entry in entries}
+
+
+def _save_progress(form16, **fields):
+    Form16.objects.filter(pk=form16.pk).update(**fields)
+    for field, value in fields.items():
+        setattr(form16, field, value)
+
+
+def extract_form16(form16, uploader=None):
+    """
+    Extracts the PDF and XML members of the ZIP of a Form16 and creates a
+    Form16Entries row for each, assigned to the payee whose PAN prefixes
+    the file name. The archive is downloaded once, the PANs are read from
+    its central directory and resolved up front, the members are uploaded
+    concurrently by a StorageUploader and the entries are inserted in
+    batches. The PANs that match no payee are recorded as Form16UnmatchedPAN
+    rows. Unchanged documents of a re-upload are not uploaded again.
+    Marks the Form16 as EXTRACTED, or FAILED with the error if the archive
+    cannot be extracted, and returns the number of files uploaded and
+    skipped and the files per second achieved.
+    """
+    uploader = uploader or StorageUploader()
+    try:
+        with download_stored_file(form16.form16_zip_file.name,
+                                  form16.form16_zip_file.storage) as archive, \
+                zipfile.ZipFile(archive) as zip_ref:
+            check_zip_limits(zip_ref.infolist())
+            members = [info for info in zip_ref.infolist()
+                       if is_form16_member(info)]
+            _save_progress(form16, total_files=len(members))
+
+            current_entries = get_current_entries(form16)
+            uploads = get_member_uploads(form16, zip_ref, members,
+                                         current_entries)
+            payee_ids = _resolve_members(form16, uploads)
+
+            entries = []
+            for count, key in enumerate(
+                    uploader.upload_all(uploads.items()), start=1):
+                upload = uploads[key]
+                entries.append(Form16Entries(
+                    financial_year=form16, form_16=upload.name,
+                    content_hash=upload.content_hash,
+                    payee_id=payee_ids.get(get_pan_no(upload.info.filename))))
+                if len(entries) == BATCH_SIZE:
+                    Form16Entries.objects.bulk_create(entries)
+                    _save_progress(form16, extracted_files=count)
+                    entries = []
+            Form16Entries.objects.bulk_create(entries)
+            _supersede_entries(form16, current_entries)
+
+    except zipfile.BadZipFile:
+        logger.error('Bad ZIP file for Form16 %s: %s', form16.pk,
+                     form16.form16_zip_file.name)
+        _save_progress(form16, status=Form16StatusChoices.FAILED,
+                       error='The uploaded file is not a valid ZIP file.')
+        return None
+    except ValidationError as error:
+        logger.error('Form16 %s rejected: %s', form16.pk, error.messages)
+        _save_progress(form16, status=Form16StatusChoices.FAILED,
+                       error=' '.join(error.messages))
+        return None
+    except Exception as error:
+        logger.exception('Extraction failed for Form16 %s', form16.pk)
+        _save_progress(form16, status=Form16StatusChoices.FAILED,
+                       error=str(error))
+        raise
+
+    _save_progress(form16, status=Form16StatusChoices.EXTRACTED,
+                   extracted_files=len(members), is_extracted=True)
+    logger.info('Extraction complete for Form16 %s', form16.pk)
+    return {'files': uploader.uploaded, 'skipped': uploader.skipped,
+            'files_per_second': uploader.files_per_second}
+
+
+def get_member_uploads(form16, zip_ref, members, current_entries):
+    """
+    Returns the MemberUpload of every non-empty member keyed by its
+    deterministic storage key, with the document and hash of the current
+    entry of its file name. A later member with the same file name is
+    skipped.
+    """
+    uploads = {}
+    for info in members:
+        file_name = os.path.basename(info.filename)
+        key = form16_entry_path(form16, file_name)
+
+        if not info.file_size:
+            logger.warning("File '%s' is empty. Skipping.", info.filename)
+        elif key in uploads:
+            logger.warning("File '%s' is a duplicate. Skipping.",
+                           info.filename)
+        else:
+            entry = current_entries.get(file_name)
+            if entry is None:
+                uploads[key] = MemberUpload(zip_ref, info, key)
+            else:
+                uploads[key] = MemberUpload(zip_ref, info, key,
+                                            entry.form_16.name,
+                                            entry.content_hash)
+    return uploads
+
+
+def _supersede_entries(form16, current_entries):
+    """
+    Marks the current entries of the other uploads of the financial year
+    as superseded by the entry of this Form16 with the same file name.
+    """
+    replaced = []
+    for entry_id, name in form16.form16entries_set.values_list('id',
+                                                               'form_16'):
+        entry = current_entries.get(os.path.basename(name))
+        if entry is not None:
+            entry.superseded_by_id = entry_id
+            replaced.append(entry)
+    Form16Entries.objects.bulk_update(replaced, ['superseded_by'],
+                                      batch_size=BATCH_SIZE)
+
+
+def _resolve_members(form16, uploads):
+    """
+    Resolves the PANs of the members to payee IDs and replaces the
+    unmatched PAN report of the Form16 with the members matching none.
+    """
+    members = [upload.info for upload in uploads.values()]
+    payee_ids = resolve_payee_ids(get_pan_no(info.filename)
+                                  for info in members)
+
+    unmatched = [
+        Form16UnmatchedPAN(form16=form16, pan_no=get_pan_no(info.filename),
+                           file_name=os.path.basename(info.filename))
+        for info in members if get_pan_no(info.filename) not in payee_ids]
+    form16.unmatched_pans.all().delete()
+    Form16UnmatchedPAN.objects.bulk_create(unmatched, batch_size=BATCH_SIZE)
+
+    if unmatched:
+        logger.warning('No Payee found for %s PANs of Form16 %s',
+                       len(unmatched), form16.pk)
+    return payee_ids
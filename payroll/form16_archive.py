@@ -0,0 +1,119 @@
+"""
+Bulk download of Form16 documents as a ZIP built on the fly.
+
+The archive is written by zipfile into an unseekable buffer that is drained
+after every chunk, and each document is copied from storage in chunks, so
+the response is streamed in constant memory without a temporary file
+whatever the number of documents.
+
+A document is only added to the archive once its first chunk has been
+read, so a document missing from storage, which on S3 only fails on the
+first read, is left out and logged instead of cutting the response short.
+"""
+import logging
+import os
+import zipfile
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+# For getting the named logger
+logger = logging.getLogger('celery_debug')
+
+# Bytes copied from storage into the archive at a time
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class ZipStreamBuffer:
+    """
+    Unseekable file-like object collecting what zipfile writes until it is
+    drained. Without tell() and seek() zipfile writes every member with a
+    data descriptor instead of seeking back to its header.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def get_archive_name(entry, used_names):
+    """
+    Returns the path of an entry's document in the archive, under its
+    financial year, suffixed with the entry ID if the name is taken.
+    """
+    name = (f'{entry.financial_year.financial_year}/'
+            f'{os.path.basename(entry.form_16.name)}')
+    if name in used_names:
+        stem, extension = os.path.splitext(name)
+        name = f'{stem}-{entry.id}{extension}'
+    used_names.add(name)
+    return name
+
+
+def _open_document(entry):
+    """
+    Returns the chunks of the document of an entry with the first one read,
+    or None if it cannot be read from storage.
+    """
+    try:
+        source = entry.form_16.open('rb')
+        chunks = source.chunks(COPY_CHUNK_SIZE)
+        first_chunk = next(chunks, b'')
+    except (OSError, ClientError) as error:
+        logger.warning('Form16 document unreadable, left out of the ZIP: '
+                       '%s (%s)', entry.form_16.name, error)
+        return None
+    return source, first_chunk, chunks
+
+
+def generate_form16_zip(entries):
+    """
+    Yields the bytes of a ZIP of the documents of a queryset of
+    Form16Entries. Entries whose document cannot be read from storage are
+    left out and logged.
+    """
+    buffer = ZipStreamBuffer()
+    used_names = set()
+
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for entry in entries.select_related('financial_year').order_by(
+                'id').iterator(chunk_size=settings.PAYRUN_EXPORT_CHUNK_SIZE):
+            if not entry.form_16:
+                continue
+            document = _open_document(entry)
+            if document is None:
+                continue
+
+            source, first_chunk, chunks = document
+            name = get_archive_name(entry, used_names)
+            with source, archive.open(name, 'w') as target:
+                target.write(first_chunk)
+                for chunk in chunks:
+                    target.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+
+    yield buffer.drain()
+
+
+def form16_zip_response(entries, file_name='form16.zip'):
+    """
+    Returns a StreamingHttpResponse that downloads the documents of a
+    queryset of Form16Entries as a ZIP generated as it is sent.
+    """
+    response = StreamingHttpResponse(generate_form16_zip(entries),
+                                     content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    return response
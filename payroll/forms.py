@@ -3,6 +3,7 @@ import datetime
 from django import forms
 
 from .models import PayRunStatusChoices, PayRun
+from .state import get_current_pay_run
 
 
 class PayRunForm(forms.ModelForm):
@@ -28,8 +29,8 @@ class PayRunForm(forms.ModelForm):
             self.fields['year'].widget.attrs['readonly'] = 'readonly'
 
         else:
-            if PayRun.objects.exists():
-                latest_payrun = PayRun.objects.latest('created_at')
+            latest_payrun = get_current_pay_run()
+            if latest_payrun is not None:
                 next_month = latest_payrun.month + 1
                 next_year = latest_payrun.year
 
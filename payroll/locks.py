@@ -0,0 +1,133 @@
+"""
+Distributed locks and delivery deduplication for the pay run tasks.
+
+Both live in the shared cache (Redis in production, the local memory cache
+in tests), so a duplicate delivery of a task is dropped before it touches
+the database.
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+# For getting the named logger
+logger = logging.getLogger('celery_debug')
+
+# A task id is remembered as done for a week, longer than any redelivery
+DEDUP_TIMEOUT = 60 * 60 * 24 * 7
+
+# Metrics are kept for a month after their last update
+METRICS_TIMEOUT = 60 * 60 * 24 * 30
+
+METRICS = ('acquired', 'contended', 'duplicates', 'hold_ms')
+
+
+def _lock_key(payrun_id, scope):
+    return f'payroll:payrun:{payrun_id}:lock:{scope}'
+
+
+def _dedup_key(task_id):
+    return f'payroll:task:{task_id}:done'
+
+
+def _metric_key(task_name, metric):
+    return f'payroll:locks:{task_name}:{metric}'
+
+
+def _increment(task_name, metric, value=1):
+    key = _metric_key(task_name, metric)
+    try:
+        cache.incr(key, value)
+    except ValueError:
+        if not cache.add(key, value, timeout=METRICS_TIMEOUT):
+            cache.incr(key, value)
+
+
+class PayRunLock:
+    """
+    Lock on one scope of a pay run, e.g. its processing or one shard.
+    The lock expires after PAYRUN_RESUME_AFTER_MINUTES, the same time after
+    which a pay run without progress counts as interrupted, so the holder
+    extends it after every checkpoint.
+    """
+
+    def __init__(self, payrun_id, scope):
+        self.key = _lock_key(payrun_id, scope)
+        self.token = uuid.uuid4().hex
+        self.timeout = settings.PAYRUN_RESUME_AFTER_MINUTES * 60
+
+    def acquire(self):
+        return cache.add(self.key, self.token, timeout=self.timeout)
+
+    def extend(self):
+        if cache.get(self.key) == self.token:
+            cache.touch(self.key, self.timeout)
+
+    def release(self):
+        # Only the holder releases the lock; an expired lock may have been
+        # taken by another worker in the meantime
+        if cache.get(self.key) == self.token:
+            cache.delete(self.key)
+
+
+@contextmanager
+def pay_run_task_guard(task, payrun_id, scope):
+    """
+    Guards a pay run task against duplicate and concurrent deliveries.
+    Yields the held PayRunLock, or None when the task must be dropped: its
+    id already completed, or another worker holds the lock of the scope.
+    On success the task id is recorded as done. Lock contention and hold
+    times are counted per task name.
+    """
+    task_id = task.request.id
+    if task_id and cache.get(_dedup_key(task_id)):
+        logger.warning('Task %s for PayRun %s was already processed. '
+                       'Dropping duplicate delivery.', task_id, payrun_id)
+        _increment(task.name, 'duplicates')
+        yield None
+        return
+
+    lock = PayRunLock(payrun_id, scope)
+    if not lock.acquire():
+        logger.warning('PayRun %s is locked for %s by another worker. '
+                       'Dropping task %s.', payrun_id, scope, task_id)
+        _increment(task.name, 'contended')
+        yield None
+        return
+
+    _increment(task.name, 'acquired')
+    started = time.perf_counter()
+    try:
+        yield lock
+        if task_id:
+            cache.set(_dedup_key(task_id), True, timeout=DEDUP_TIMEOUT)
+    finally:
+        lock.release()
+        hold_ms = round((time.perf_counter() - started) * 1000)
+        _increment(task.name, 'hold_ms', hold_ms)
+        logger.info('PayRun %s lock for %s held for %s ms.', payrun_id,
+                    scope, hold_ms)
+
+
+def get_lock_metrics(task_names):
+    """
+    Returns the lock metrics of the given tasks, keyed by task name: the
+    number of acquired, contended and duplicate deliveries, and the total
+    and average hold time in milliseconds.
+    """
+    keys = {(task_name, metric): _metric_key(task_name, metric)
+            for task_name in task_names for metric in METRICS}
+    values = cache.get_many(list(keys.values()))
+
+    metrics = {}
+    for task_name in task_names:
+        counters = {metric: values.get(keys[task_name, metric], 0)
+                    for metric in METRICS}
+        counters['avg_hold_ms'] = (
+            round(counters['hold_ms'] / counters['acquired'])
+            if counters['acquired'] else None)
+        metrics[task_name] = counters
+    return metrics
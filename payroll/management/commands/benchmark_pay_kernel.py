@@ -0,0 +1,107 @@
+import random
+import time
+from array import array
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payroll.calculations import compute_pay, from_paise, to_paise
+
+TDS_PERCENTAGES = [0, 1, 2, 5, 7.5, 10, 20]
+
+# TDS percentages are scaled to ten-thousandths of a percent (10.5 -> 105000)
+TDS_RATE_SCALE = 10000
+
+_TDS_DIVISOR = 100 * TDS_RATE_SCALE
+_HALF_TDS_DIVISOR = _TDS_DIVISOR // 2
+
+
+def to_scaled_rate(tds_percentage):
+    return int((Decimal(str(tds_percentage)) * TDS_RATE_SCALE)
+               .to_integral_value(ROUND_HALF_UP))
+
+
+def paise_kernel(amounts, earnings, deductions, tds_rates):
+    """
+    The batched alternative to compute_pay: columns of integer paise and
+    scaled TDS rates in, `array('q')` columns of gross, TDS and net paise
+    out, with the TDS amount rounded half up to the paisa.
+    """
+    gross = array('q', [amount + earning - deduction
+                        for amount, earning, deduction
+                        in zip(amounts, earnings, deductions)])
+    tds = array('q', [
+        (value + _HALF_TDS_DIVISOR) // _TDS_DIVISOR if value >= 0
+        else -((_HALF_TDS_DIVISOR - value) // _TDS_DIVISOR)
+        for value in map(int.__mul__, gross, tds_rates)])
+    net = array('q', map(int.__sub__, gross, tds))
+    return gross, tds, net
+
+
+def decimal_pay(amounts, earnings, deductions, tds_percentages):
+    """ The per-row Decimal path of the pay run and the admin """
+    return [compute_pay(amount, earning, deduction, tds_percentage)
+            for amount, earning, deduction, tds_percentage in zip(
+                amounts, earnings, deductions, tds_percentages)]
+
+
+def kernel_pay(amounts, earnings, deductions, tds_percentages):
+    """
+    The batched kernel with the conversions the pay run would need, from
+    the Decimal inputs to paise and back to the Decimals the register
+    stores.
+    """
+    gross, tds, net = paise_kernel(
+        [to_paise(amount) for amount in amounts],
+        [to_paise(earning) for earning in earnings],
+        [to_paise(deduction) for deduction in deductions],
+        [to_scaled_rate(rate) for rate in tds_percentages])
+    return [(from_paise(gross_paise), from_paise(tds_paise),
+             from_paise(net_paise))
+            for gross_paise, tds_paise, net_paise in zip(gross, tds, net)]
+
+
+class Command(BaseCommand):
+    help = ("Compares the throughput of the per-row Decimal pay calculation "
+            "with a batched integer-paise kernel, with and without the "
+            "conversions the pay run would need")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=200000)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        rng = random.Random(options["seed"])
+
+        def random_amount(low, high):
+            return Decimal(rng.randint(low * 100, high * 100)).scaleb(-2)
+
+        amounts = [random_amount(10000, 500000) for _ in range(rows)]
+        earnings = [random_amount(0, 20000) for _ in range(rows)]
+        deductions = [random_amount(0, 5000) for _ in range(rows)]
+        tds_percentages = [rng.choice(TDS_PERCENTAGES) for _ in range(rows)]
+        columns = (amounts, earnings, deductions, tds_percentages)
+        paise_columns = ([to_paise(amount) for amount in amounts],
+                         [to_paise(earning) for earning in earnings],
+                         [to_paise(deduction) for deduction in deductions],
+                         [to_scaled_rate(rate) for rate in tds_percentages])
+
+        if decimal_pay(*columns) != kernel_pay(*columns):
+            raise CommandError("The kernel and compute_pay disagree.")
+
+        for label, function, arguments in [
+                ("Per-row Decimal", decimal_pay, columns),
+                ("Kernel incl. conversion", kernel_pay, columns),
+                ("Kernel on paise columns", paise_kernel, paise_columns)]:
+            best = min(self.time_call(function, arguments)
+                       for _ in range(options["repeat"]))
+            self.stdout.write(f"{label:<25} {best:8.4f}s "
+                              f"{rows / best:14,.0f} rows/s")
+
+    @staticmethod
+    def time_call(function, arguments):
+        started = time.perf_counter()
+        function(*arguments)
+        return time.perf_counter() - started
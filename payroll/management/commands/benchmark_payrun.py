@@ -0,0 +1,164 @@
+import random
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from configs.models import TDS, Component
+from payees.constants import TDS_LEGAL_NAME_CHOICES
+from payees.models import Payee, BankDetails
+from payroll.engine import complete_pay_run, run_pay_run
+from payroll.models import (Payment, PayRun, PayRunStatusChoices,
+                            PayRecordRegister)
+
+# Synthetic pay runs are created for a month no real pay run uses
+BENCHMARK_MONTH = 1
+BENCHMARK_YEAR = 1900
+
+TDS_PERCENTAGES = [10, 2, 0, 5]
+
+# Progress and catalog keys are kept out of the shared cache, as the pay run
+# IDs of the throwaway database collide with the real ones
+BENCHMARK_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+COMPONENTS = [('Bonus', 'sum'), ('Reimbursement', 'sum'),
+              ('Advance Recovery', 'subtract')]
+
+
+class Rollback(Exception):
+    """ Raised to discard the synthetic payroll after a measurement """
+
+
+def create_synthetic_payroll(size, rng):
+    """
+    Bulk inserts `size` active payees with users, acknowledged bank details
+    and payments, plus the TDS types and components they refer to.
+    About 1% of the payees miss their bank acknowledgement and 1% their
+    payment, so the error path is measured as well.
+    Returns a queryset of the synthetic payees.
+    """
+    tds_types = [TDS.objects.get_or_create(
+        tds_legal_name=legal_name,
+        defaults={'tds_percentage': percentage})[0]
+        for (legal_name, _), percentage in zip(TDS_LEGAL_NAME_CHOICES,
+                                               TDS_PERCENTAGES)]
+    for component_name, operation in COMPONENTS:
+        Component.objects.get_or_create(component_name=component_name,
+                                        operation=operation)
+
+    prefix = f'bench{size}-{rng.randrange(10 ** 6):06d}-'
+    batch_size = settings.PAYRUN_BULK_CREATE_BATCH_SIZE
+
+    User.objects.bulk_create([User(username=f'{prefix}{index}')
+                              for index in range(size)],
+                             batch_size=batch_size)
+    users = User.objects.filter(username__startswith=prefix).order_by('id')
+
+    Payee.objects.bulk_create([
+        Payee(user=user, hrm_id=f'B{index:08d}', full_name=user.username,
+              tds_type=rng.choice(tds_types))
+        for index, user in enumerate(users.iterator(chunk_size=batch_size))
+    ], batch_size=batch_size)
+    payees = Payee.objects.filter(user__username__startswith=prefix)
+
+    bank_details = []
+    payments = []
+    for payee_id in payees.values_list('id', flat=True).iterator(
+            chunk_size=batch_size):
+        bank_details.append(BankDetails(
+            payee_id=payee_id, bank_name='Synthetic Bank',
+            account_no=f'{payee_id:012d}',
+            account_holder_name=f'Payee {payee_id}', account_type='savings',
+            ifsc_code='SYNT0000001',
+            payee_acknowledgement=rng.random() >= 0.01))
+        if rng.random() >= 0.01:
+            payments.append(Payment(
+                payee_id=payee_id, label='Salary',
+                amount=Decimal(rng.randint(1000000, 50000000)).scaleb(-2)))
+
+    BankDetails.objects.bulk_create(bank_details, batch_size=batch_size)
+    Payment.objects.bulk_create(payments, batch_size=batch_size)
+
+    return payees
+
+
+class Command(BaseCommand):
+    help = ("Generates synthetic payrolls and measures the pay run end to "
+            "end: wall time, query count, peak memory and rows per second. "
+            "Runs in a throwaway test database created next to the "
+            "configured one (DATABASE_ENGINE) and destroyed afterwards, so "
+            "real pay runs are never read or locked.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+",
+                            default=[1000, 10000, 100000])
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        verbosity = options["verbosity"]
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=verbosity,
+                                           autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCHMARK_CACHES):
+                self.benchmark_sizes(options["sizes"], rng)
+        finally:
+            connection.creation.destroy_test_db(old_name,
+                                                verbosity=verbosity)
+
+    def benchmark_sizes(self, sizes, rng):
+        self.stdout.write(f"Database: {connection.vendor} "
+                          f"({connection.settings_dict['NAME']})")
+        self.stdout.write(f"{'Payees':>8} {'Setup':>9} {'Run':>9} "
+                          f"{'Queries':>8} {'Peak MiB':>9} {'Rows/s':>10}")
+
+        for size in sizes:
+            try:
+                with transaction.atomic():
+                    self.stdout.write(self.benchmark(size, rng))
+                    raise Rollback
+            except Rollback:
+                pass
+
+    @staticmethod
+    def benchmark(size, rng):
+        started = time.perf_counter()
+        payees = create_synthetic_payroll(size, rng)
+        setup_seconds = time.perf_counter() - started
+
+        pay_run = PayRun.objects.create(
+            month=BENCHMARK_MONTH, year=BENCHMARK_YEAR,
+            status=PayRunStatusChoices.IN_PROGRESS)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            run_pay_run(pay_run, payees)
+            complete_pay_run(pay_run)
+            run_seconds = time.perf_counter() - started
+
+        # Memory is traced in a second pay run over the same payees, as
+        # tracing slows the run down too much to time it in the same pass
+        PayRun.objects.filter(id=pay_run.id).update(
+            status=PayRunStatusChoices.APPROVED)
+        tracemalloc.start()
+        memory_pay_run = PayRun.objects.create(
+            month=BENCHMARK_MONTH + 1, year=BENCHMARK_YEAR,
+            status=PayRunStatusChoices.IN_PROGRESS)
+        run_pay_run(memory_pay_run, payees)
+        complete_pay_run(memory_pay_run)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        rows = PayRecordRegister.objects.filter(pay_run=pay_run).count()
+
+        return (f"{size:>8} {setup_seconds:>8.2f}s {run_seconds:>8.2f}s "
+                f"{len(queries):>8} {peak_bytes / 2 ** 20:>9.1f} "
+                f"{rows / run_seconds:>10,.0f}")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from payroll.ytd import rebuild_payee_ytd
+
+
+class Command(BaseCommand):
+    help = ("Recomputes the year-to-date gross, TDS and net income of every "
+            "payee from the approved pay runs, e.g. to backfill the "
+            "accumulators or repair them after a manual correction.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--financial-year",
+                            help="Only rebuild this financial year, "
+                                 "e.g. 2024-25")
+
+    def handle(self, *args, **options):
+        financial_year = options["financial_year"]
+        count = rebuild_payee_ytd(financial_year)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt the YTD accumulators of "
+            f"{financial_year or 'every financial year'} from {count} "
+            f"approved pay runs."))
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.11 on 2026-10-18 06:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0006_payrun_error_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payrun',
+            name='started_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='PayRunCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_payee_id', models.BigIntegerField()),
+                ('last_payee_id', models.BigIntegerField()),
+                ('error_log', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('pay_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='payroll.payrun')),
+            ],
+            options={
+                'verbose_name': 'Pay Run Checkpoint',
+                'verbose_name_plural': 'Pay Run Checkpoints',
+                'ordering': ['first_payee_id'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0007_payrun_started_at_payruncheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payrecordregister',
+            name='input_fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.11 on 2026-10-18 06:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payees', '0005_alter_payee_pan_no'),
+        ('payroll', '0008_payrecordregister_input_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='payruncheckpoint',
+            name='error_log',
+        ),
+        migrations.CreateModel(
+            name='PayRunError',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(choices=[('missing_bank_details', 'Missing acknowledged bank details'), ('missing_payment', 'No payment data available')], max_length=30)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('pay_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='errors', to='payroll.payrun')),
+                ('payee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payees.payee')),
+            ],
+            options={
+                'verbose_name': 'Pay Run Error',
+                'verbose_name_plural': 'Pay Run Errors',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['pay_run', 'code'], name='payroll_pay_pay_run_37b77b_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0009_payrunerror'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='payrun',
+            constraint=models.UniqueConstraint(models.Value(True), condition=models.Q(('status__in', ['due', 'in_progress', 'completed'])), name='payroll_payrun_one_open', violation_error_message='A Pay Run is already open. Please finish the existing Pay Run before creating a new one.'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.11 on 2026-10-18 07:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0010_payrun_one_open'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayRunSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tds_type', models.CharField(blank=True, choices=[('technical-consultants', 'Technical Consultants'), ('professional-consultant', 'Professional Consultant'), ('employment', 'Employment'), ('apprentices', 'Apprentices')], default='', help_text='blank for payees without a TDS type', max_length=50)),
+                ('headcount', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_gross_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_tds_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_net_income', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('pay_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='payroll.payrun')),
+            ],
+            options={
+                'verbose_name': 'Pay Run Summary',
+                'verbose_name_plural': 'Pay Run Summaries',
+                'ordering': ['tds_type'],
+                'unique_together': {('pay_run', 'tds_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.11 on 2026-10-18 07:13
+
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from payroll.utils import get_financial_year
+
+
+def _money(value):
+    return Decimal(str(value)) if value is not None else Decimal('0')
+
+
+def backfill_payee_ytd(apps, schema_editor):
+    """
+    Accumulates the pay runs approved before PayeeYTD existed, so rejecting
+    one of them later subtracts from a row that counted it.
+    """
+    PayeeYTD = apps.get_model('payroll', 'PayeeYTD')
+    PayRecordRegister = apps.get_model('payroll', 'PayRecordRegister')
+
+    accumulators = {}
+    for payee_id, month, year, gross_amount, net_income in \
+            PayRecordRegister.objects.filter(
+                pay_run__status='approved').values_list(
+                'payee_id', 'pay_run__month', 'pay_run__year',
+                'gross_amount', 'net_income').iterator():
+        financial_year = get_financial_year(month, year)
+        ytd = accumulators.get((payee_id, financial_year))
+        if ytd is None:
+            ytd = accumulators[payee_id, financial_year] = PayeeYTD(
+                payee_id=payee_id, financial_year=financial_year)
+        gross = _money(gross_amount)
+        net = _money(net_income)
+        ytd.pay_runs += 1
+        ytd.gross_amount += gross
+        ytd.tds_amount += gross - net
+        ytd.net_income += net
+
+    PayeeYTD.objects.bulk_create(accumulators.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payees', '0005_alter_payee_pan_no'),
+        ('payroll', '0011_payrunsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayeeYTD',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('financial_year', models.CharField(help_text='e.g. 2024-25 for April 2024 to March 2025', max_length=7)),
+                ('pay_runs', models.PositiveIntegerField(default=0)),
+                ('gross_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('tds_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('net_income', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('payee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ytd_totals', to='payees.payee')),
+            ],
+            options={
+                'verbose_name': 'Payee Year To Date',
+                'verbose_name_plural': 'Payee Year To Date',
+                'unique_together': {('payee', 'financial_year')},
+            },
+        ),
+        migrations.RunPython(backfill_payee_ytd, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.11 on 2026-10-18 07:16
+
+from django.db import migrations, models
+
+
+def mark_extracted(apps, schema_editor):
+    Form16 = apps.get_model('payroll', 'Form16')
+    Form16.objects.filter(is_extracted=True).update(status='extracted')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0012_payeeytd'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='form16',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='form16',
+            name='extracted_files',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='form16',
+            name='status',
+            field=models.CharField(choices=[('pending', 'PENDING'), ('extracting', 'EXTRACTING'), ('extracted', 'EXTRACTED'), ('failed', 'FAILED')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='form16',
+            name='total_files',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(mark_extracted, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.11 on 2026-10-18 07:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0013_form16_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Form16UnmatchedPAN',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pan_no', models.CharField(max_length=255)),
+                ('file_name', models.CharField(max_length=255)),
+                ('form16', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unmatched_pans', to='payroll.form16')),
+            ],
+            options={
+                'verbose_name': 'Form16 Unmatched PAN',
+                'verbose_name_plural': 'Form16 Unmatched PANs',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.11 on 2026-10-18 07:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0014_form16unmatchedpan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='form16entries',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 of the document', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='form16entries',
+            name='superseded_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='supersedes', to='payroll.form16entries'),
+        ),
+    ]
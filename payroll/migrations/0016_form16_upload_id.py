@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-18 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0015_form16entries_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='form16',
+            name='upload_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='form16',
+            name='status',
+            field=models.CharField(choices=[('uploading', 'UPLOADING'), ('pending', 'PENDING'), ('extracting', 'EXTRACTING'), ('extracted', 'EXTRACTED'), ('failed', 'FAILED')], default='pending', max_length=20),
+        ),
+    ]
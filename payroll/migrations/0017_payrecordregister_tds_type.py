@@ -0,0 +1,34 @@
+# Generated by Django 4.2.11 on 2026-10-18 08:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def copy_payee_tds_type(apps, schema_editor):
+    """
+    Takes the current TDS type of the payees for the existing records, the
+    one their pay run summaries were built with.
+    """
+    PayRecordRegister = apps.get_model('payroll', 'PayRecordRegister')
+    Payee = apps.get_model('payees', 'Payee')
+    PayRecordRegister.objects.update(tds_type=Coalesce(Subquery(
+        Payee.objects.filter(pk=OuterRef('payee_id')).values(
+            'tds_type')), Value('')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payees', '0005_alter_payee_pan_no'),
+        ('payroll', '0016_form16_upload_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payrecordregister',
+            name='tds_type',
+            field=models.CharField(blank=True, choices=[('technical-consultants', 'Technical Consultants'), ('professional-consultant', 'Professional Consultant'), ('employment', 'Employment'), ('apprentices', 'Apprentices')], default='', editable=False, max_length=50),
+        ),
+        migrations.RunPython(copy_payee_tds_type, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,14 @@
 import os
 import uuid
+from datetime import timedelta
+from django.conf import settings
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.db import models
 from django.contrib.auth.models import User
 from auditlog.registry import auditlog
 from .utils import get_month_name
+from payees.constants import TDS_LEGAL_NAME_CHOICES
 from payees.models import Payee
 from configs.models import Component
 from .upload_helpers import (validate_zip_file,
@@ -41,6 +44,15 @@ class PayRunStatusChoices(models.TextChoices):
     APPROVED = 'approved', _('APPROVED')
 
 
+# A pay run in one of these statuses is still open: only one may exist at a
+# time, and a new pay run can be created once it is approved or rejected.
+OPEN_PAYRUN_STATUSES = [
+    PayRunStatusChoices.DUE,
+    PayRunStatusChoices.IN_PROGRESS,
+    PayRunStatusChoices.COMPLETED,
+]
+
+
 class PayRun(models.Model):
     """
     This model keeps track of payment details for each month before
@@ -60,10 +72,21 @@ class PayRun(models.Model):
     error_log = models.TextField(blank=True, null=True,
                                  help_text="shows only if any error occur "
                                            "in payees data ")
+    started_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = _("Pay Run")
         verbose_name_plural = _("Pay Runs")
+        constraints = [
+            # A unique index over a constant, restricted to the open pay
+            # runs, so the database admits at most one of them
+            models.UniqueConstraint(
+                models.Value(True), name='payroll_payrun_one_open',
+                condition=models.Q(status__in=OPEN_PAYRUN_STATUSES),
+                violation_error_message=_(
+                    "A Pay Run is already open. Please finish the existing "
+                    "Pay Run before creating a new one.")),
+        ]
 
     def get_error_log_lines(self):
         return self.error_log.splitlines() if self.error_log else []
@@ -71,6 +94,23 @@ class PayRun(models.Model):
     def display_month_name(self):
         return get_month_name(self.month)
 
+    def is_interrupted(self):
+        """
+        Returns True when the pay run is in progress but neither started nor
+        committed a checkpoint within the last PAYRUN_RESUME_AFTER_MINUTES.
+        """
+        if self.status != PayRunStatusChoices.IN_PROGRESS:
+            return False
+
+        last_checkpoint = self.checkpoints.order_by('-created_at').first()
+        last_activity = max(filter(None, [
+            self.started_at,
+            last_checkpoint.created_at if last_checkpoint else None]),
+            default=None)
+
+        return last_activity is None or last_activity < timezone.now() - \
+            timedelta(minutes=settings.PAYRUN_RESUME_AFTER_MINUTES)
+
     def __str__(self):
         return (f"{self.display_month_name()} {self.year} - "
                 f"{self.get_status_display()}")
@@ -79,6 +119,54 @@ class PayRun(models.Model):
 auditlog.register(PayRun)
 
 
+class PayRunCheckpoint(models.Model):
+    """
+    Records a range of payees, ordered by ID, whose PayRecordRegister rows
+    and PayRunError rows were committed during a pay run.
+    A checkpoint is written in the same transaction as its records, so an
+    interrupted pay run can be resumed from the payees it does not cover.
+    """
+    pay_run = models.ForeignKey(PayRun, on_delete=models.CASCADE,
+                                related_name='checkpoints')
+    first_payee_id = models.BigIntegerField()
+    last_payee_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['first_payee_id']
+        verbose_name = _("Pay Run Checkpoint")
+        verbose_name_plural = _("Pay Run Checkpoints")
+
+    def __str__(self):
+        return f"{self.pay_run} | {self.first_payee_id}-{self.last_payee_id}"
+
+
+class PayRunErrorCodeChoices(models.TextChoices):
+    MISSING_BANK_DETAILS = ('missing_bank_details',
+                            _('Missing acknowledged bank details'))
+    MISSING_PAYMENT = 'missing_payment', _('No payment data available')
+
+
+class PayRunError(models.Model):
+    """ Stores why a payee was skipped during a pay run """
+
+    pay_run = models.ForeignKey(PayRun, on_delete=models.CASCADE,
+                                related_name='errors')
+    payee = models.ForeignKey(Payee, on_delete=models.CASCADE)
+    code = models.CharField(max_length=30,
+                            choices=PayRunErrorCodeChoices.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['pay_run', 'code'])]
+        verbose_name = _("Pay Run Error")
+        verbose_name_plural = _("Pay Run Errors")
+
+    def __str__(self):
+        return f"{self.payee} - {self.get_code_display()}"
+
+
 class PayRecordRegister(models.Model):
     """ Stores the details of amount paid to each tds type and their account
     details after each successful Pay run """
@@ -100,9 +188,16 @@ class PayRecordRegister(models.Model):
     swift_code = models.CharField(max_length=100, null=True, blank=True)
     branch_address = models.TextField(null=True, blank=True)
     tds_percentage = models.FloatField(null=True, blank=True)
+    # TDS type of the payee when the record was built, which the record is
+    # summarized under even if the payee's TDS type changes later
+    tds_type = models.CharField(max_length=50, blank=True, default='',
+                                choices=TDS_LEGAL_NAME_CHOICES,
+                                editable=False)
     gross_amount = models.DecimalField(max_digits=10, decimal_places=2,
                                        null=True, blank=True)
     net_income = models.FloatField(null=True, blank=True)
+    input_fingerprint = models.CharField(max_length=64, blank=True,
+                                         default='', editable=False)
 
     class Meta:
         unique_together = ('payee', 'pay_run')
@@ -117,6 +212,38 @@ class PayRecordRegister(models.Model):
 auditlog.register(PayRecordRegister)
 
 
+class PayRunSummary(models.Model):
+    """
+    Totals of the pay records of a pay run for the payees of one TDS type,
+    built when the pay run completes and adjusted as its records change
+    """
+
+    pay_run = models.ForeignKey(PayRun, on_delete=models.CASCADE,
+                                related_name='summaries')
+    tds_type = models.CharField(max_length=50, blank=True, default='',
+                                choices=TDS_LEGAL_NAME_CHOICES,
+                                help_text="blank for payees without a TDS "
+                                          "type")
+    headcount = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2,
+                                       default=0)
+    total_gross_amount = models.DecimalField(max_digits=14, decimal_places=2,
+                                             default=0)
+    total_tds_amount = models.DecimalField(max_digits=14, decimal_places=2,
+                                           default=0)
+    total_net_income = models.DecimalField(max_digits=14, decimal_places=2,
+                                           default=0)
+
+    class Meta:
+        unique_together = ('pay_run', 'tds_type')
+        ordering = ['tds_type']
+        verbose_name = _("Pay Run Summary")
+        verbose_name_plural = _("Pay Run Summaries")
+
+    def __str__(self):
+        return f"{self.pay_run} | {self.get_tds_type_display() or '-'}"
+
+
 class ComponentValue(models.Model):
     pay_record = models.ForeignKey(PayRecordRegister, on_delete=models.CASCADE)
     component = models.ForeignKey(Component, on_delete=models.CASCADE)
@@ -129,16 +256,66 @@ class ComponentValue(models.Model):
 auditlog.register(ComponentValue)
 
 
+class PayeeYTD(models.Model):
+    """
+    Year-to-date totals of a payee over the approved pay runs of a financial
+    year, kept up to date as pay runs are approved
+    """
+
+    payee = models.ForeignKey(Payee, on_delete=models.CASCADE,
+                              related_name='ytd_totals')
+    financial_year = models.CharField(max_length=7,
+                                      help_text="e.g. 2024-25 for April "
+                                                "2024 to March 2025")
+    pay_runs = models.PositiveIntegerField(default=0)
+    gross_amount = models.DecimalField(max_digits=14, decimal_places=2,
+                                       default=0)
+    tds_amount = models.DecimalField(max_digits=14, decimal_places=2,
+                                     default=0)
+    net_income = models.DecimalField(max_digits=14, decimal_places=2,
+                                     default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('payee', 'financial_year')
+        verbose_name = _("Payee Year To Date")
+        verbose_name_plural = _("Payee Year To Date")
+
+    def __str__(self):
+        return f"{self.payee} | {self.financial_year}"
+
+
+class Form16StatusChoices(models.TextChoices):
+    UPLOADING = 'uploading', _('UPLOADING')
+    PENDING = 'pending', _('PENDING')
+    EXTRACTING = 'extracting', _('EXTRACTING')
+    EXTRACTED = 'extracted', _('EXTRACTED')
+    FAILED = 'failed', _('FAILED')
+
+
 class Form16(models.Model):
     financial_year = models.CharField(max_length=10, null=True, blank=True)
     uploaded_on = models.DateTimeField(auto_now_add=True)
     form16_zip_file = models.FileField(upload_to='uploads/payroll/form16/',
                                        validators=[validate_zip_file])
     is_extracted = models.BooleanField(default=False)
+    # ID of the multipart upload of the ZIP while it is UPLOADING
+    upload_id = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20,
+                              choices=Form16StatusChoices.choices,
+                              default=Form16StatusChoices.PENDING)
+    total_files = models.PositiveIntegerField(default=0)
+    extracted_files = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
 
     def __str__(self):
         return self.financial_year
 
+    def progress(self):
+        if not self.total_files:
+            return None
+        return round(self.extracted_files * 100 / self.total_files, 1)
+
 
 auditlog.register(Form16)
 
@@ -148,9 +325,31 @@ class Form16Entries(models.Model):
     payee = models.ForeignKey(Payee, on_delete=models.SET_NULL, null=True,
                               blank=True)
     form_16 = models.FileField(upload_to=form16_extracted_path)
+    content_hash = models.CharField(max_length=64, blank=True,
+                                    help_text='SHA-256 of the document')
+    superseded_by = models.ForeignKey('self', on_delete=models.SET_NULL,
+                                      null=True, blank=True,
+                                      related_name='supersedes')
 
     def __str__(self):
         return os.path.basename(self.form_16.name)
 
 
 auditlog.register(Form16Entries)
+
+
+class Form16UnmatchedPAN(models.Model):
+    """ Stores a Form16 document whose PAN matched no payee """
+
+    form16 = models.ForeignKey(Form16, on_delete=models.CASCADE,
+                               related_name='unmatched_pans')
+    pan_no = models.CharField(max_length=255)
+    file_name = models.CharField(max_length=255)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = _("Form16 Unmatched PAN")
+        verbose_name_plural = _("Form16 Unmatched PANs")
+
+    def __str__(self):
+        return f"{self.pan_no} - {self.file_name}"
@@ -0,0 +1,254 @@
+"""
+Direct-to-storage multipart uploads of Form16 ZIPs.
+
+The browser asks for an upload, PUTs the parts of the file to the URLs it
+is given and reports the parts back; Django only records the upload and
+completes it. On S3 the part URLs are presigned, so the ZIP never passes
+through the app server. On any other storage (the local filesystem in
+development and tests) a stand-in stores the parts through an admin
+endpoint and joins them on completion.
+
+The completed ZIP is validated lazily: only its central directory is read
+from storage, with ranged reads on S3, before it is queued for extraction.
+
+An upload whose completion fails, or that the browser cancels after a part
+fails, is aborted so S3 discards the parts already stored. Parts of uploads
+abandoned without a word, such as a closed tab, are only discarded by a
+lifecycle rule on the bucket, which must be configured alongside it:
+
+    {"Rules": [{"ID": "abort-incomplete-multipart-uploads",
+                "Status": "Enabled", "Filter": {},
+                "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": 1}}]}
+
+applied with `aws s3api put-bucket-lifecycle-configuration`. One day is
+well past PART_URL_EXPIRY, after which no part can be uploaded anyway.
+
+The browser PUTs the parts across origins and reads the ETag of each
+response, so the bucket also needs a CORS rule allowing PUT from the admin
+origin and exposing that header; without it every upload fails:
+
+    {"CORSRules": [{"AllowedOrigins": ["https://admin.example.com"],
+                    "AllowedMethods": ["PUT"], "AllowedHeaders": ["*"],
+                    "ExposeHeaders": ["ETag"], "MaxAgeSeconds": 3600}]}
+
+applied with `aws s3api put-bucket-cors`, with the origin of the admin.
+"""
+import hashlib
+import logging
+import math
+import os
+import shutil
+import uuid
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
+
+from .form16 import validate_form16_zip
+from .models import Form16, Form16StatusChoices
+from .uploaders import create_s3_client, open_stored_file
+
+# For getting the named logger
+logger = logging.getLogger('celery_debug')
+
+# Seconds the presigned part URLs stay valid
+PART_URL_EXPIRY = 60 * 60 * 6
+
+# S3 accepts at most this many parts per multipart upload
+MAX_PARTS = 10000
+
+# Bytes copied at a time by the local stand-in
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class S3MultipartBackend:
+    """ Multipart uploads straight to the bucket with presigned URLs """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.client = create_s3_client(storage)
+
+    def _key(self, name):
+        return self.storage._normalize_name(clean_name(name))
+
+    def start(self, name):
+        return self.client.create_multipart_upload(
+            Bucket=self.storage.bucket_name, Key=self._key(name),
+            **self.storage._get_write_parameters(name))['UploadId']
+
+    def get_part_url(self, form16, part_number):
+        return self.client.generate_presigned_url(
+            'upload_part', ExpiresIn=PART_URL_EXPIRY, Params={
+                'Bucket': self.storage.bucket_name,
+                'Key': self._key(form16.form16_zip_file.name),
+                'UploadId': form16.upload_id,
+                'PartNumber': part_number})
+
+    def complete(self, form16, parts):
+        try:
+            self.client.complete_multipart_upload(
+                Bucket=self.storage.bucket_name,
+                Key=self._key(form16.form16_zip_file.name),
+                UploadId=form16.upload_id,
+                MultipartUpload={'Parts': [
+                    {'PartNumber': part_number, 'ETag': etag}
+                    for part_number, etag in parts]})
+        except ClientError as error:
+            raise ValidationError(
+                f"The upload could not be completed: {error}")
+
+    def abort(self, form16):
+        """ Aborts the upload, discarding the parts stored so far """
+        try:
+            self.client.abort_multipart_upload(
+                Bucket=self.storage.bucket_name,
+                Key=self._key(form16.form16_zip_file.name),
+                UploadId=form16.upload_id)
+        except ClientError as error:
+            logger.warning('Multipart upload of Form16 %s not aborted: %s',
+                           form16.pk, error)
+
+
+class LocalMultipartBackend:
+    """
+    Stand-in for the S3 multipart API on a filesystem storage: the parts
+    are PUT to an admin endpoint, stored next to the ZIP and joined on
+    completion. ETags are the MD5 of the parts, as on S3.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def _parts_dir(self, form16):
+        return self.storage.path(
+            f'{form16.form16_zip_file.name}.{form16.upload_id}.parts')
+
+    def start(self, name):
+        return uuid.uuid4().hex
+
+    def get_part_url(self, form16, part_number):
+        return reverse('admin:payroll_form16_upload_part',
+                       args=[form16.pk, part_number])
+
+    def save_part(self, form16, part_number, stream):
+        """ Stores a part read from `stream` and returns its ETag """
+        parts_dir = self._parts_dir(form16)
+        os.makedirs(parts_dir, exist_ok=True)
+        digest = hashlib.md5()
+        with open(os.path.join(parts_dir, str(part_number)), 'wb') as part:
+            for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                part.write(chunk)
+        return f'"{digest.hexdigest()}"'
+
+    def complete(self, form16, parts):
+        parts_dir = self._parts_dir(form16)
+        path = self.storage.path(form16.form16_zip_file.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as destination:
+            for part_number, _ in parts:
+                part_path = os.path.join(parts_dir, str(part_number))
+                if not os.path.exists(part_path):
+                    raise ValidationError(f"Part {part_number} is missing.")
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, destination, COPY_CHUNK_SIZE)
+        shutil.rmtree(parts_dir)
+
+    def abort(self, form16):
+        """ Deletes the parts stored so far and any partly joined ZIP """
+        shutil.rmtree(self._parts_dir(form16), ignore_errors=True)
+        self.storage.delete(form16.form16_zip_file.name)
+
+
+def get_multipart_backend(storage=None):
+    storage = storage or default_storage
+    if isinstance(storage, S3Boto3Storage):
+        return S3MultipartBackend(storage)
+    return LocalMultipartBackend(storage)
+
+
+def get_part_size(size):
+    """
+    Returns the part size for a file of `size` bytes, which is
+    FORM16_UPLOAD_PART_SIZE unless the file would need more than MAX_PARTS
+    parts of that size.
+    """
+    return max(settings.FORM16_UPLOAD_PART_SIZE, math.ceil(size / MAX_PARTS))
+
+
+def start_form16_upload(financial_year, file_name, size, backend=None):
+    """
+    Creates an UPLOADING Form16 for a ZIP of `size` bytes and starts its
+    multipart upload. Returns the Form16, the part size and the URL of
+    every part.
+    """
+    backend = backend or get_multipart_backend()
+    form16 = Form16(financial_year=financial_year,
+                    status=Form16StatusChoices.UPLOADING)
+    field = Form16._meta.get_field('form16_zip_file')
+    name = field.storage.get_available_name(field.generate_filename(
+        form16, os.path.basename(file_name)),
+        max_length=field.max_length)
+    form16.form16_zip_file.name = name
+    form16.upload_id = backend.start(name)
+    form16.save()
+
+    part_size = get_part_size(size)
+    part_urls = [backend.get_part_url(form16, part_number)
+                 for part_number in range(
+                     1, max(math.ceil(size / part_size), 1) + 1)]
+    return form16, part_size, part_urls
+
+
+def abort_form16_upload(form16, error, backend=None):
+    """
+    Aborts the multipart upload of a Form16, discarding its parts, and
+    marks the Form16 FAILED with `error`.
+    """
+    backend = backend or get_multipart_backend()
+    backend.abort(form16)
+    form16.status = Form16StatusChoices.FAILED
+    form16.error = error
+    form16.upload_id = ''
+    form16.save(update_fields=['status', 'error', 'upload_id'])
+    return form16
+
+
+def complete_form16_upload(form16, parts, backend=None):
+    """
+    Completes the multipart upload of a Form16 from its (part number, ETag)
+    pairs and validates the ZIP's central directory. A valid ZIP moves the
+    Form16 to PENDING, which queues its extraction; otherwise the Form16 is
+    marked FAILED and the ValidationError is raised. An upload that cannot
+    be completed is aborted.
+    """
+    backend = backend or get_multipart_backend()
+    try:
+        backend.complete(form16, sorted(parts))
+    except ValidationError as error:
+        abort_form16_upload(form16, ' '.join(error.messages), backend)
+        raise
+
+    try:
+        try:
+            with open_stored_file(form16.form16_zip_file.name,
+                                  backend.storage) as file:
+                validate_form16_zip(file)
+        except (OSError, ClientError) as error:
+            raise ValidationError(
+                f"The uploaded ZIP could not be read: {error}")
+    except ValidationError as error:
+        form16.status = Form16StatusChoices.FAILED
+        form16.error = ' '.join(error.messages)
+        form16.upload_id = ''
+        form16.save(update_fields=['status', 'error', 'upload_id'])
+        raise
+
+    form16.status = Form16StatusChoices.PENDING
+    form16.upload_id = ''
+    form16.save(update_fields=['status', 'upload_id'])
+    return form16
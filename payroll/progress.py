@@ -0,0 +1,73 @@
+import time
+
+from django.core.cache import cache
+
+from .models import PayRunStatusChoices
+
+# Progress is kept for a day after the last update of a pay run
+PROGRESS_TIMEOUT = 60 * 60 * 24
+
+COUNTERS = ('processed', 'succeeded', 'errored')
+
+
+def _key(payrun_id, name):
+    return f'payroll:payrun:{payrun_id}:progress:{name}'
+
+
+def start_progress(payrun_id, total):
+    """
+    Resets the progress counters of a pay run that is about to process
+    `total` payees.
+    """
+    cache.set_many({
+        _key(payrun_id, 'status'): PayRunStatusChoices.IN_PROGRESS,
+        _key(payrun_id, 'total'): total,
+        _key(payrun_id, 'started_at'): time.time(),
+        **{_key(payrun_id, counter): 0 for counter in COUNTERS},
+    }, timeout=PROGRESS_TIMEOUT)
+
+
+def record_progress(payrun_id, succeeded, errored):
+    """
+    Adds the payees of a committed chunk to the progress counters. The
+    counters are incremented atomically so shards can report concurrently.
+    """
+    for counter, value in (('processed', succeeded + errored),
+                           ('succeeded', succeeded),
+                           ('errored', errored)):
+        try:
+            cache.incr(_key(payrun_id, counter), value)
+        except ValueError:
+            # The counters expired or were never started
+            cache.add(_key(payrun_id, counter), value,
+                      timeout=PROGRESS_TIMEOUT)
+
+
+def finish_progress(payrun_id, status=PayRunStatusChoices.COMPLETED):
+    cache.set(_key(payrun_id, 'status'), status, timeout=PROGRESS_TIMEOUT)
+
+
+def get_progress(payrun_id):
+    """
+    Returns the progress of a pay run from the cache alone, with the
+    percentage done and the estimated seconds remaining, or None when no
+    progress was recorded.
+    """
+    names = ('status', 'total', 'started_at') + COUNTERS
+    values = cache.get_many([_key(payrun_id, name) for name in names])
+    progress = {name: values.get(_key(payrun_id, name)) for name in names}
+
+    if progress['status'] is None:
+        return None
+
+    total = progress['total'] or 0
+    processed = progress['processed'] or 0
+    elapsed = time.time() - (progress.pop('started_at') or time.time())
+
+    progress['percent'] = round(processed * 100 / total, 1) if total else 100
+    progress['eta_seconds'] = (
+        round(elapsed / processed * (total - processed))
+        if processed and progress['status'] == PayRunStatusChoices.IN_PROGRESS
+        else None)
+
+    return progress
@@ -0,0 +1,150 @@
+"""
+Export of the payroll register of a pay run as CSV or XLSX.
+
+The component values are pivoted into one column per component by the
+database, and the rows are read through a server-side cursor in chunks of
+PAYRUN_EXPORT_CHUNK_SIZE, so large registers are exported in constant
+memory.
+"""
+import csv
+import tempfile
+
+from django.conf import settings
+from django.db.models import DecimalField, Q, Sum
+from django.http import FileResponse, StreamingHttpResponse
+
+from .bank_files import Echo
+from .models import ComponentValue, PayRecordRegister
+from configs.catalog import get_components
+
+CSV = 'csv'
+XLSX = 'xlsx'
+
+CONTENT_TYPES = {
+    CSV: 'text/csv',
+    XLSX: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+OPERATION_LABELS = {'sum': 'earning', 'subtract': 'deduction'}
+
+# (header, field) of the register columns around the component columns
+LEADING_COLUMNS = (('Payee ID', 'payee__hrm_id'),
+                   ('Payee name', 'payee__full_name'),
+                   ('Amount', 'amount'))
+TRAILING_COLUMNS = (('Gross amount', 'gross_amount'),
+                    ('TDS percentage', 'tds_percentage'),
+                    ('Net income', 'net_income'),
+                    ('Bank name', 'bank_name'),
+                    ('Account number', 'account_number'),
+                    ('IFSC code', 'ifsc_code'))
+
+
+def get_register_records(pay_run, records=None):
+    """
+    Returns the pay records of a pay run among `records`, a queryset of
+    PayRecordRegister the user may see, or all of them.
+    """
+    if records is None:
+        records = PayRecordRegister.objects.all()
+    return records.filter(pay_run=pay_run)
+
+
+def get_register_components(records):
+    """
+    Returns the components used by a queryset of pay records, the earnings
+    before the deductions.
+    """
+    used_ids = set(ComponentValue.objects.filter(
+        pay_record__in=records.values('id')).values_list(
+        'component_id', flat=True).distinct())
+    return [component
+            for operation in ('sum', 'subtract')
+            for component in get_components(operation)
+            if component.id in used_ids]
+
+
+def get_register_header(components):
+    return ([header for header, _ in LEADING_COLUMNS]
+            + [f'{component.component_name} '
+               f'({OPERATION_LABELS[component.operation]})'
+               for component in components]
+            + [header for header, _ in TRAILING_COLUMNS])
+
+
+def iter_register_rows(records, components):
+    """
+    Yields the register rows of a queryset of pay records, one value per
+    column of get_register_header, with the component values summed per
+    record and component by a single grouped query.
+    """
+    money = DecimalField(max_digits=12, decimal_places=2)
+    component_fields = {
+        f'component_{component.id}': Sum(
+            'componentvalue__value', output_field=money,
+            filter=Q(componentvalue__component_id=component.id))
+        for component in components}
+    fields = ([field for _, field in LEADING_COLUMNS]
+              + list(component_fields)
+              + [field for _, field in TRAILING_COLUMNS])
+
+    rows = records.annotate(
+        **component_fields).order_by('id').values_list(*fields)
+
+    yield from rows.iterator(chunk_size=settings.PAYRUN_EXPORT_CHUNK_SIZE)
+
+
+def get_register_file_name(pay_run, file_format):
+    return f'register-{pay_run.year}-{pay_run.month:02d}.{file_format}'
+
+
+def generate_register_csv(records):
+    """ Yields the CSV lines of the register of a queryset of pay records """
+    writer = csv.writer(Echo())
+    components = get_register_components(records)
+
+    yield writer.writerow(get_register_header(components))
+    for row in iter_register_rows(records, components):
+        yield writer.writerow(row)
+
+
+def write_register_xlsx(pay_run, records, file):
+    """
+    Writes the register of a queryset of pay records of a pay run to `file`
+    as an XLSX workbook in write-only mode, which keeps only the current row
+    in memory.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=get_register_file_name(
+        pay_run, XLSX).rsplit('.', 1)[0])
+    components = get_register_components(records)
+
+    sheet.append(get_register_header(components))
+    for row in iter_register_rows(records, components):
+        sheet.append(row)
+
+    workbook.save(file)
+
+
+def register_response(pay_run, file_format=CSV, records=None):
+    """
+    Returns a response that downloads the register of a pay run, limited to
+    the queryset of pay records `records` when given. CSV is streamed as it
+    is generated; XLSX is written to a temporary file first, as the workbook
+    is only complete once saved, and then streamed from it.
+    """
+    file_name = get_register_file_name(pay_run, file_format)
+    records = get_register_records(pay_run, records)
+
+    if file_format == XLSX:
+        file = tempfile.TemporaryFile()
+        write_register_xlsx(pay_run, records, file)
+        file.seek(0)
+        return FileResponse(file, as_attachment=True, filename=file_name,
+                            content_type=CONTENT_TYPES[XLSX])
+
+    response = StreamingHttpResponse(generate_register_csv(records),
+                                     content_type=CONTENT_TYPES[CSV])
+    response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    return response
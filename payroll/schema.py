@@ -1,6 +1,7 @@
 import graphene
 from graphene_django.types import DjangoObjectType
-from .models import Payment, PayRecordRegister
+from graphql import GraphQLError
+from .models import Payment, PayRecordRegister, PayeeYTD
 from youpayroll.settings.decorators import login_required
 
 
@@ -26,9 +27,23 @@ class PaymentType(DjangoObjectType):
         fields = ('amount', 'label', 'payee')
 
 
+class PayeeYTDType(DjangoObjectType):
+    class Meta:
+        """
+        This section displays the payee's year-to-date gross amount, TDS and
+        net income over the approved pay runs of a financial year.
+        """
+        model = PayeeYTD
+        fields = ('payee', 'financial_year', 'pay_runs', 'gross_amount',
+                  'tds_amount', 'net_income', 'updated_at')
+
+
 class PayrollQuery(graphene.ObjectType):
     all_payments = graphene.List(PaymentType)
     all_pay_record_register = graphene.List(PayRecordRegisterType)
+    payee_ytd = graphene.Field(PayeeYTDType,
+                               financial_year=graphene.String(required=True),
+                               hrm_id=graphene.String())
 
     @staticmethod
     @login_required
@@ -45,3 +60,22 @@ class PayrollQuery(graphene.ObjectType):
         PayrollQuery.check_authorization(info.context)
         # Fetch all pay records
         return PayRecordRegister.objects.all()
+
+    @staticmethod
+    @login_required
+    def resolve_payee_ytd(root, info, financial_year, hrm_id=None):
+        """
+        Returns the YTD totals of the requesting payee, or with `hrm_id` of
+        any payee for staff users, with a single lookup on the unique
+        (payee, financial year) index.
+        """
+        user = info.context.user
+        ytd_totals = PayeeYTD.objects.select_related('payee').filter(
+            financial_year=financial_year)
+
+        if hrm_id is None:
+            return ytd_totals.filter(payee__user=user).first()
+        if not user.is_staff:
+            raise GraphQLError(
+                "You are not authorized to perform this action.")
+        return ytd_totals.filter(payee__hrm_id=hrm_id).first()
@@ -0,0 +1,99 @@
+"""
+State machine of pay runs.
+
+Transitions are made on pay runs locked with SELECT ... FOR UPDATE, so
+concurrent admin actions and workers on the same pay run are serialized by
+the database; the `payroll_payrun_one_open` index guarantees a single open
+pay run.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OPEN_PAYRUN_STATUSES, PayRun, PayRunStatusChoices
+from .ytd import apply_pay_run_to_ytd
+
+ALLOWED_TRANSITIONS = {
+    PayRunStatusChoices.DUE: [PayRunStatusChoices.IN_PROGRESS,
+                              PayRunStatusChoices.REJECTED],
+    PayRunStatusChoices.IN_PROGRESS: [PayRunStatusChoices.COMPLETED,
+                                      PayRunStatusChoices.REJECTED],
+    PayRunStatusChoices.COMPLETED: [PayRunStatusChoices.APPROVED,
+                                    PayRunStatusChoices.REJECTED],
+    PayRunStatusChoices.APPROVED: [PayRunStatusChoices.REJECTED],
+    PayRunStatusChoices.REJECTED: [],
+}
+
+
+class PayRunStateError(Exception):
+    """ Raised for a pay run status change the state machine forbids """
+
+
+def get_current_pay_run(lock=False):
+    """
+    Returns the most recent pay run, or None, with one query on the primary
+    key index. With `lock`, the row is locked until the end of the
+    surrounding transaction.
+    """
+    queryset = PayRun.objects.order_by('-id')
+    if lock:
+        queryset = queryset.select_for_update()
+    return queryset.first()
+
+
+def get_open_pay_run():
+    """
+    Returns the pay run that is not approved or rejected yet, or None.
+    """
+    return PayRun.objects.filter(status__in=OPEN_PAYRUN_STATUSES).first()
+
+
+def set_status(pay_run, status, fields=()):
+    """
+    Moves a pay run to the given status and saves it with the other changed
+    `fields`, raising PayRunStateError when the transition is not allowed.
+    Approving a pay run, or rejecting an approved one, updates the YTD
+    accumulators of its payees in the same transaction.
+    """
+    if status not in ALLOWED_TRANSITIONS[pay_run.status]:
+        raise PayRunStateError(
+            f"A pay run cannot go from '{pay_run.get_status_display()}' to "
+            f"'{PayRunStatusChoices(status).label}'.")
+
+    with transaction.atomic():
+        # The YTD accumulators of the payees follow the approved pay runs
+        if status == PayRunStatusChoices.APPROVED:
+            apply_pay_run_to_ytd(pay_run)
+        elif pay_run.status == PayRunStatusChoices.APPROVED:
+            apply_pay_run_to_ytd(pay_run, sign=-1)
+
+        pay_run.status = status
+        pay_run.save(update_fields=['status', *fields])
+
+
+def claim_pay_run(payrun_id):
+    """
+    Locks a pay run and marks it as started by the calling worker.
+    A pay run can be claimed while it is due, or in progress but queued by
+    the run action and not started yet; claiming sets started_at, so a
+    duplicate delivery of the task finds it taken.
+    Returns the claimed pay run, or None when it does not exist or cannot
+    be claimed.
+    """
+    with transaction.atomic():
+        pay_run = PayRun.objects.select_for_update().filter(
+            id=payrun_id).first()
+
+        if pay_run is None:
+            return None
+
+        if pay_run.status == PayRunStatusChoices.DUE:
+            pay_run.status = PayRunStatusChoices.IN_PROGRESS
+        elif pay_run.status != PayRunStatusChoices.IN_PROGRESS or \
+                pay_run.started_at is not None:
+            return None
+
+        pay_run.started_at = timezone.now()
+        pay_run.save()
+
+    return pay_run
+
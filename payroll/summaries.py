@@ -0,0 +1,95 @@
+"""
+PayRunSummary rows: the totals of a pay run per TDS type.
+
+They are built from the register once when a pay run completes and then
+adjusted by the difference whenever a single record is recalculated, so
+readers never aggregate over the register. Records are grouped by the TDS
+type stored on them when they were built, not the payee's current one, so
+an adjustment always lands on the row the record was counted in.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+
+from .models import PayRecordRegister, PayRunSummary
+
+TOTAL_FIELDS = ('headcount', 'total_amount', 'total_gross_amount',
+                'total_tds_amount', 'total_net_income')
+
+
+def _money(value):
+    return Decimal(str(value)) if value is not None else Decimal('0')
+
+
+def build_pay_run_summary(pay_run):
+    """
+    Replaces the summary rows of a pay run with totals aggregated from its
+    register in one grouped query.
+    """
+    money = DecimalField(max_digits=14, decimal_places=2)
+    zero = Value(Decimal('0'))
+    totals = PayRecordRegister.objects.filter(pay_run=pay_run).order_by(
+        ).values('tds_type').annotate(
+        headcount=Count('id'),
+        total_amount=Coalesce(Sum('amount'), zero, output_field=money),
+        total_gross_amount=Coalesce(Sum('gross_amount'), zero,
+                                    output_field=money),
+        total_net_income=Coalesce(Sum(Cast('net_income', money)), zero,
+                                  output_field=money))
+
+    summaries = [
+        PayRunSummary(
+            pay_run=pay_run,
+            tds_type=row['tds_type'],
+            headcount=row['headcount'],
+            total_amount=row['total_amount'],
+            total_gross_amount=row['total_gross_amount'],
+            total_tds_amount=(row['total_gross_amount']
+                              - row['total_net_income']),
+            total_net_income=row['total_net_income'])
+        for row in totals]
+
+    with transaction.atomic():
+        PayRunSummary.objects.filter(pay_run=pay_run).delete()
+        PayRunSummary.objects.bulk_create(summaries)
+
+
+def adjust_pay_run_summary(pay_record, previous=None):
+    """
+    Applies the change of one pay record to the summary row of its pay run
+    and TDS type, creating the row if needed, with a single UPDATE of the
+    totals.
+    `previous` is the (amount, gross_amount, net_income) of the record
+    before the change, or None when the record is new.
+    """
+    if pay_record.pay_run_id is None:
+        return
+
+    amount, gross, net = (_money(value) for value in previous or
+                          (None, None, None))
+    delta = {
+        'headcount': 0 if previous else 1,
+        'total_amount': _money(pay_record.amount) - amount,
+        'total_gross_amount': _money(pay_record.gross_amount) - gross,
+        'total_net_income': _money(pay_record.net_income) - net,
+    }
+    delta['total_tds_amount'] = (delta['total_gross_amount']
+                                 - delta['total_net_income'])
+
+    summary, _ = PayRunSummary.objects.get_or_create(
+        pay_run_id=pay_record.pay_run_id,
+        tds_type=pay_record.tds_type)
+    PayRunSummary.objects.filter(pk=summary.pk).update(**{
+        field: F(field) + value for field, value in delta.items()})
+
+
+def get_pay_run_totals(pay_run):
+    """
+    Returns the totals of a pay run over its summary rows, keyed by the
+    names in TOTAL_FIELDS.
+    """
+    totals = pay_run.summaries.aggregate(
+        **{field: Sum(field) for field in TOTAL_FIELDS})
+    return {field: value or 0 for field, value in totals.items()}
@@ -1,84 +1,143 @@
 import logging
 
-from celery import shared_task
-from decimal import Decimal
+from celery import chord, shared_task
+from django.utils import timezone
 
-from .models import (PayRun, Payment, PayRunStatusChoices, PayRecordRegister)
-from payees.models import Payee, BankDetails
+from .engine import (complete_pay_run, get_eligible_payees, get_payee_shards,
+                     get_unprocessed_payees, run_pay_run)
+from .form16 import claim_form16, extract_form16
+from .models import PayRun, PayRunStatusChoices
+from .locks import pay_run_task_guard
+from .progress import start_progress
+from .state import claim_pay_run
 
 # For getting the named logger
 logger = logging.getLogger('celery_debug')
 
 
-@shared_task
-def run_pay_run_task(payrun_id):
+@shared_task(bind=True)
+def run_pay_run_task(self, payrun_id):
     logger.info('Starting task with pay_run_id: %s', payrun_id)
 
-    try:
-        pay_run = PayRun.objects.get(id=payrun_id)
-    except PayRun.DoesNotExist:
-        logger.error('PayRun with ID %s does not exist.', payrun_id)
-        return
+    with pay_run_task_guard(self, payrun_id, 'process') as lock:
+        if lock is None:
+            return
 
-    if pay_run.status in [PayRunStatusChoices.COMPLETED,
-                            PayRunStatusChoices.APPROVED,
-                            PayRunStatusChoices.REJECTED,
-                            PayRunStatusChoices.IN_PROGRESS,]:
-        logger.warning('PayRun %s is not in DUE status. Skipping.', payrun_id)
-        return
+        pay_run = claim_pay_run(payrun_id)
+        if pay_run is None:
+            logger.warning('PayRun %s does not exist or is not waiting to be '
+                           'processed. Skipping.', payrun_id)
+            return
 
-    payees = Payee.objects.filter(status='active', is_deleted='False')
-    pay_run.status = PayRunStatusChoices.IN_PROGRESS
-    pay_run.save()
+        process_pay_run(pay_run, lock)
 
-    error_log = []
 
-    for payee in payees:
-        logger.info('Processing payee: %s', payee)
+@shared_task(bind=True)
+def resume_pay_run_task(self, payrun_id):
+    """
+    Resumes an interrupted pay run: only the eligible payees not covered by
+    one of its checkpoints are processed.
+    """
+    logger.info('Resuming task with pay_run_id: %s', payrun_id)
 
-        try:
-            bank_details = BankDetails.objects.get(payee=payee, payee_acknowledgement=True)
-        except BankDetails.DoesNotExist:
-            error_log.append(f"{payee.full_name} - Missing acknowledged bank "
-                             f"details")
-            continue
+    with pay_run_task_guard(self, payrun_id, 'process') as lock:
+        if lock is None:
+            return
 
         try:
-            total_amount = Payment.objects.get(payee=payee)
-        except Payment.DoesNotExist:
-            error_log.append(f"{payee.full_name} - No payment data available")
-            continue
-
-        tds_percentage = Decimal(str(payee.tds_type.tds_percentage if payee.tds_type else 0))
-        tds_amount = (total_amount.amount * tds_percentage) / Decimal('100')
-        total_net_income = total_amount.amount - tds_amount
-
-        PayRecordRegister.objects.create(
-            pay_run=pay_run,
-            amount=total_amount.amount,
-            payee=payee,
-            bank_name=bank_details.bank_name,
-            account_number=bank_details.account_no,
-            account_holder_name=bank_details.account_holder_name,
-            account_type=bank_details.account_type,
-            ifsc_code=bank_details.ifsc_code,
-            micr_code=bank_details.micr_code,
-            swift_code=bank_details.swift_code,
-            branch_address=bank_details.branch_address,
-            tds_percentage=tds_percentage,
-            gross_amount=total_amount.amount,
-            net_income=total_net_income,
-        )
-        logger.info('PayRecordRegister created for payee: %s',payee.full_name )
-
-    if error_log:
-        pay_run.error_log = '\n'.join(error_log)
-    else:
-        pay_run.error_log = 'PayRecordRegister created successfully for every payee.'
-
-    pay_run.status = PayRunStatusChoices.COMPLETED
-    pay_run.save()
+            pay_run = PayRun.objects.get(id=payrun_id)
+        except PayRun.DoesNotExist:
+            logger.error('PayRun with ID %s does not exist.', payrun_id)
+            return
+
+        if pay_run.status != PayRunStatusChoices.IN_PROGRESS:
+            logger.warning('PayRun %s is not in IN PROGRESS status. '
+                           'Skipping.', payrun_id)
+            return
+
+        pay_run.started_at = timezone.now()
+        pay_run.save(update_fields=['started_at'])
+
+        process_pay_run(pay_run, lock)
+
+
+def process_pay_run(pay_run, lock=None):
+    """
+    Creates the missing PayRecordRegister rows of an in-progress pay run,
+    fanning the payees out in shards when there are enough of them, and
+    completes the pay run. The held PayRunLock, if given, is extended after
+    every checkpoint.
+    """
+    payees = get_unprocessed_payees(pay_run, get_eligible_payees())
+    shards = get_payee_shards(payees)
+    start_progress(pay_run.id, payees.count())
+
+    if len(shards) > 1:
+        logger.info('PayRun %s split into %s shards.', pay_run.id,
+                    len(shards))
+        chord(run_pay_run_shard_task.s(pay_run.id, first_payee_id,
+                                       last_payee_id)
+              for first_payee_id, last_payee_id in shards)(
+            complete_pay_run_task.s(pay_run.id))
+        return
+
+    run_pay_run(pay_run, heartbeat=lock.extend if lock else None)
+    complete_pay_run(pay_run)
+
+    logger.info('PayRun %s processing completed.', pay_run.id)
+
+
+@shared_task(bind=True)
+def run_pay_run_shard_task(self, payrun_id, first_payee_id, last_payee_id):
+    """
+    Creates the PayRecordRegister rows for the eligible payees whose ID lies
+    in the given range and returns the number of payees it skipped.
+    """
+    logger.info('Starting shard %s-%s of pay_run_id: %s', first_payee_id,
+                last_payee_id, payrun_id)
+
+    scope = f'shard-{first_payee_id}-{last_payee_id}'
+    with pay_run_task_guard(self, payrun_id, scope) as lock:
+        if lock is None:
+            return 0
+
+        pay_run = PayRun.objects.get(id=payrun_id)
+        payees = get_eligible_payees().filter(
+            id__range=(first_payee_id, last_payee_id))
+
+        return run_pay_run(pay_run, payees, heartbeat=lock.extend)
+
+
+@shared_task(bind=True)
+def complete_pay_run_task(self, shard_error_counts, payrun_id):
+    """
+    Chord callback of a sharded pay run: summarizes the errors recorded by
+    every shard and marks the pay run as completed.
+    """
+    logger.info('PayRun %s: %s payees skipped across shards.', payrun_id,
+                sum(shard_error_counts))
+
+    with pay_run_task_guard(self, payrun_id, 'complete') as lock:
+        if lock is None:
+            return
+
+        pay_run = PayRun.objects.get(id=payrun_id)
+        complete_pay_run(pay_run)
 
     logger.info('PayRun %s processing completed.', payrun_id)
 
 
+@shared_task
+def extract_form16_task(form16_id):
+    """
+    Extracts the ZIP of an uploaded Form16 into Form16Entries and returns
+    the upload throughput. A duplicate delivery finds the Form16 already
+    claimed and does nothing.
+    """
+    form16 = claim_form16(form16_id)
+    if form16 is None:
+        logger.warning('Form16 %s does not exist or is not pending '
+                       'extraction. Skipping.', form16_id)
+        return None
+
+    return extract_form16(form16)
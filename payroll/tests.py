@@ -1,3 +1,1247 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import math
+import os
+import tempfile
+import zipfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest.mock import MagicMock, patch
+
+from auditlog.models import LogEntry
+from botocore.exceptions import ClientError
+from django.contrib import admin
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from openpyxl import load_workbook
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from configs.catalog import get_tds_percentage
+from configs.models import TDS, Component
+from payees.models import Payee, BankDetails
+from youpayroll.schema import schema
+from .models import (Payment, PayRun, PayRunStatusChoices, PayRecordRegister,
+                     ComponentValue, PayeeYTD, Form16, Form16Entries,
+                     Form16StatusChoices)
+from .bank_files import generate_bank_file, get_bank_file_errors
+from .calculations import compute_pay
+from .engine import (complete_pay_run, preview_pay_run,
+                     recalculate_pay_record, recalculate_pay_records,
+                     run_pay_run)
+from .form16_archive import generate_form16_zip
+from .form16 import (claim_form16, extract_form16, form16_entry_path,
+                     validate_form16_zip)
+from .locks import PayRunLock, get_lock_metrics
+from .multipart import (LocalMultipartBackend, S3MultipartBackend,
+                        complete_form16_upload)
+from .progress import get_progress
+from .state import claim_pay_run, set_status
+from .summaries import (adjust_pay_run_summary, build_pay_run_summary,
+                        get_pay_run_totals)
+from .tasks import (run_pay_run_task, resume_pay_run_task,
+                    extract_form16_task)
+from .upload_helpers import validate_zip_file
+from .uploaders import RangedStorageFile, StorageUploader
+from .variance import (CHANGED, NEW, REMOVED, get_variance,
+                       get_variance_base_run)
+
+
+def create_payee(index, amount=Decimal('1000.00'), acknowledged=True,
+                 tds_type=None):
+    """ Creates a payee with a payment and bank details for the tests """
+    user = User.objects.create(username=f'payee{index}')
+    payee = Payee.objects.create(user=user, hrm_id=f'HRM{index}',
+                                 full_name=f'Payee {index}',
+                                 pan_no=f'ABCDE{index:04d}F',
+                                 tds_type=tds_type)
+    BankDetails.objects.create(payee=payee, bank_name='Bank',
+                               account_no=f'{index:010d}',
+                               account_holder_name=payee.full_name,
+                               ifsc_code='BANK0000001',
+                               payee_acknowledgement=acknowledged)
+    if amount is not None:
+        Payment.objects.create(payee=payee, amount=amount, label='Salary')
+    return payee
+
+
+class ComputePayTests(TestCase):
+
+    def test_rounds_tds_half_up_to_the_paisa(self):
+        self.assertEqual(
+            compute_pay(Decimal('1000.55'), Decimal('10.00'), Decimal('0'),
+                        7.5),
+            (Decimal('1010.55'), Decimal('75.79'), Decimal('934.76')))
+        self.assertEqual(
+            compute_pay(Decimal('100.00'), Decimal('0'), Decimal('150.00'),
+                        10),
+            (Decimal('-50.00'), Decimal('-5.00'), Decimal('-45.00')))
+
+
+class RunPayRunTaskTests(TestCase):
+
+    def setUp(self):
+        self.tds = TDS.objects.create(tds_legal_name='individual',
+                                      tds_percentage=10)
+        self.pay_run = PayRun.objects.create(month=1, year=2025)
+
+    def test_creates_records_and_logs_skipped_payees(self):
+        create_payee(1, tds_type=self.tds)
+        create_payee(2)
+        create_payee(3, acknowledged=False)
+        create_payee(4, amount=None)
+
+        run_pay_run_task(self.pay_run.id)
+
+        self.pay_run.refresh_from_db()
+        self.assertEqual(self.pay_run.status, PayRunStatusChoices.COMPLETED)
+        self.assertEqual(self.pay_run.get_error_log_lines(), [
+            'Missing acknowledged bank details: 1',
+            'No payment data available: 1',
+        ])
+        self.assertEqual(
+            [str(error) for error in self.pay_run.errors.all()],
+            ['Payee 3 - Missing acknowledged bank details',
+             'Payee 4 - No payment data available'])
+
+        records = PayRecordRegister.objects.filter(pay_run=self.pay_run)
+        self.assertEqual(records.count(), 2)
+        record = records.get(payee__hrm_id='HRM1')
+        self.assertEqual(record.gross_amount, Decimal('1000.00'))
+        self.assertEqual(record.tds_percentage, 10)
+        self.assertEqual(record.net_income, 900)
+        self.assertEqual(record.account_number, '0000000001')
+
+    def test_query_count_does_not_grow_with_payees(self):
+        for index in range(1, 4):
+            create_payee(index, tds_type=self.tds)
+        # TDS rates come from the in-process catalog once it is loaded
+        get_tds_percentage(self.tds.tds_legal_name)
+        with self.assertNumQueries(32):
+            run_pay_run_task(self.pay_run.id)
+
+        PayRun.objects.filter(id=self.pay_run.id).update(
+            status=PayRunStatusChoices.APPROVED)
+        other_run = PayRun.objects.create(month=2, year=2025)
+        for index in range(4, 20):
+            create_payee(index, tds_type=self.tds)
+        with self.assertNumQueries(32):
+            run_pay_run_task(other_run.id)
+
+    def test_catalog_cache_calls_do_not_grow_with_payees(self):
+        for index in range(1, 21):
+            create_payee(index, tds_type=self.tds)
+
+        with patch('configs.catalog.cache', wraps=cache) as catalog_cache:
+            run_pay_run_task(self.pay_run.id)
+
+        self.assertEqual(PayRecordRegister.objects.filter(
+            pay_run=self.pay_run).count(), 20)
+        self.assertLessEqual(catalog_cache.get.call_count, 4)
+
+    # The shards run eagerly through CELERY_TASK_ALWAYS_EAGER in the
+    # testing settings, which the Celery app reads when it is configured
+    @override_settings(PAYRUN_SHARD_SIZE=2, PAYRUN_SHARD_PARALLELISM=3)
+    def test_sharded_run_merges_shard_errors(self):
+        for index in range(1, 8):
+            create_payee(index, acknowledged=index != 6)
+
+        run_pay_run_task(self.pay_run.id)
+
+        self.pay_run.refresh_from_db()
+        self.assertEqual(self.pay_run.status, PayRunStatusChoices.COMPLETED)
+        self.assertEqual(self.pay_run.get_error_log_lines(),
+                         ['Missing acknowledged bank details: 1'])
+        self.assertEqual(PayRecordRegister.objects.filter(
+            pay_run=self.pay_run).count(), 6)
+
+    @override_settings(PAYRUN_CHECKPOINT_SIZE=2,
+                       PAYRUN_RESUME_AFTER_MINUTES=0)
+    def test_resume_only_processes_payees_without_checkpoint(self):
+        payees = [create_payee(index, acknowledged=index != 2)
+                  for index in range(1, 6)]
+        # Simulates a worker that died after committing the first chunk.
+        run_pay_run(self.pay_run, Payee.objects.filter(
+            id__in=[payee.id for payee in payees[:2]]))
+        self.pay_run.status = PayRunStatusChoices.IN_PROGRESS
+        self.pay_run.save()
+        self.assertTrue(self.pay_run.is_interrupted())
+
+        resume_pay_run_task(self.pay_run.id)
+
+        self.pay_run.refresh_from_db()
+        self.assertEqual(self.pay_run.status, PayRunStatusChoices.COMPLETED)
+        self.assertEqual(self.pay_run.get_error_log_lines(),
+                         ['Missing acknowledged bank details: 1'])
+        self.assertEqual(PayRecordRegister.objects.filter(
+            pay_run=self.pay_run).count(), 4)
+        self.assertEqual(self.pay_run.checkpoints.count(), 3)
+
+    def test_rerun_carries_unchanged_records_forward(self):
+        unchanged = create_payee(1)
+        changed = create_payee(2)
+        run_pay_run_task(self.pay_run.id)
+
+        bonus = Component.objects.create(component_name='Bonus',
+                                         operation='sum')
+        for record in PayRecordRegister.objects.filter(pay_run=self.pay_run):
+            ComponentValue.objects.create(pay_record=record, component=bonus,
+                                          value=Decimal('100.00'))
+        PayRecordRegister.objects.filter(payee=unchanged).update(
+            gross_amount=Decimal('1100.00'), net_income=1100)
+        self.pay_run.status = PayRunStatusChoices.REJECTED
+        self.pay_run.save()
+        Payment.objects.filter(payee=changed).update(amount=Decimal('2000'))
+
+        rerun = PayRun.objects.create(month=1, year=2025)
+        run_pay_run_task(rerun.id)
+
+        carried = PayRecordRegister.objects.get(pay_run=rerun,
+                                                payee=unchanged)
+        self.assertEqual(carried.gross_amount, Decimal('1100.00'))
+        recomputed = PayRecordRegister.objects.get(pay_run=rerun,
+                                                   payee=changed)
+        self.assertEqual(recomputed.gross_amount, Decimal('2100.00'))
+        self.assertEqual(ComponentValue.objects.filter(
+            pay_record__pay_run=rerun, component=bonus).count(), 2)
+
+
+class PayRunStateTests(TestCase):
+
+    def setUp(self):
+        self.pay_run = PayRun.objects.create(month=1, year=2025)
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+    def test_database_allows_a_single_open_pay_run(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PayRun.objects.create(month=2, year=2025)
+
+        self.pay_run.status = PayRunStatusChoices.REJECTED
+        self.pay_run.save()
+        PayRun.objects.create(month=1, year=2025)
+
+    def test_running_twice_queues_the_pay_run_once(self):
+        create_payee(1)
+        url = reverse('admin:payroll_payrun_changelist')
+        data = {'action': 'run_payrun',
+                admin.helpers.ACTION_CHECKBOX_NAME: [self.pay_run.pk]}
+
+        with patch('payroll.alerts.run_pay_run_task.apply_async') as queue, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, data)
+            self.client.post(url, data)
+
+        queue.assert_called_once_with(
+            (self.pay_run.pk,), task_id=f'run-pay-run-{self.pay_run.pk}')
+        self.pay_run.refresh_from_db()
+        self.assertEqual(self.pay_run.status, PayRunStatusChoices.IN_PROGRESS)
+        self.assertIsNone(self.pay_run.started_at)
+
+        self.assertEqual(claim_pay_run(self.pay_run.pk), self.pay_run)
+        self.assertIsNone(claim_pay_run(self.pay_run.pk))
+
+    def test_pay_run_rejected_while_finishing_stays_rejected(self):
+        create_payee(1)
+        pay_run = claim_pay_run(self.pay_run.pk)
+        run_pay_run(pay_run)
+        # The admin rejects the pay run before the worker completes it.
+        set_status(PayRun.objects.get(pk=self.pay_run.pk),
+                   PayRunStatusChoices.REJECTED)
+
+        self.assertIsNone(complete_pay_run(pay_run))
+
+        self.pay_run.refresh_from_db()
+        self.assertEqual(self.pay_run.status, PayRunStatusChoices.REJECTED)
+        self.assertFalse(self.pay_run.summaries.exists())
+        self.assertEqual(get_progress(self.pay_run.pk)['status'],
+                         PayRunStatusChoices.REJECTED)
+        PayRun.objects.create(month=1, year=2025)
+
+
+class PayRunTaskGuardTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.pay_run = PayRun.objects.create(month=1, year=2025)
+        create_payee(1)
+
+    def get_metrics(self):
+        return get_lock_metrics([run_pay_run_task.name])[run_pay_run_task.name]
+
+    def test_duplicate_delivery_is_dropped_before_database_work(self):
+        run_pay_run_task.apply((self.pay_run.id,), task_id='delivery')
+
+        with self.assertNumQueries(0):
+            run_pay_run_task.apply((self.pay_run.id,), task_id='delivery')
+
+        self.assertEqual(PayRecordRegister.objects.count(), 1)
+        metrics = self.get_metrics()
+        self.assertEqual(metrics['acquired'], 1)
+        self.assertEqual(metrics['duplicates'], 1)
+
+    def test_concurrent_delivery_is_dropped_while_locked(self):
+        lock = PayRunLock(self.pay_run.id, 'process')
+        self.assertTrue(lock.acquire())
+
+        with self.assertNumQueries(0):
+            run_pay_run_task.apply((self.pay_run.id,), task_id='other')
+        self.assertEqual(self.get_metrics()['contended'], 1)
+
+        lock.release()
+        run_pay_run_task.apply((self.pay_run.id,), task_id='other')
+        self.pay_run.refresh_from_db()
+        self.assertEqual(self.pay_run.status, PayRunStatusChoices.COMPLETED)
+
+
+class PayRunAdminViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.pay_run = PayRun.objects.create(month=1, year=2025)
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+    def test_preview_computes_register_without_writing(self):
+        create_payee(1, amount=Decimal('1500.00'))
+        create_payee(2, acknowledged=False)
+
+        response = self.client.get(
+            reverse('admin:payroll_payrun_preview', args=[self.pay_run.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        preview = response.context['preview']
+        self.assertEqual(preview['headcount'], 1)
+        self.assertEqual(preview['total_net_income'], Decimal('1500.00'))
+        self.assertEqual([str(error) for error in preview['errors']],
+                         ['Payee 2 - Missing acknowledged bank details'])
+        self.assertFalse(self.pay_run.errors.exists())
+        self.assertFalse(PayRecordRegister.objects.exists())
+        self.assertFalse(self.pay_run.checkpoints.exists())
+
+    @patch('payroll.engine.PREVIEW_ERROR_LIMIT', 2)
+    def test_preview_counts_errors_and_is_computed_once(self):
+        create_payee(1)
+        for index in range(2, 5):
+            create_payee(index, acknowledged=False)
+        create_payee(5, amount=None)
+        url = reverse('admin:payroll_payrun_preview', args=[self.pay_run.pk])
+
+        with patch('payroll.engine.preview_pay_run',
+                   wraps=preview_pay_run) as compute:
+            response = self.client.get(url)
+            self.client.get(url, {'page': 1})
+            self.assertEqual(compute.call_count, 1)
+            self.client.get(url, {'refresh': 1})
+            self.assertEqual(compute.call_count, 2)
+
+        preview = response.context['preview']
+        self.assertEqual(preview['error_count'], 4)
+        self.assertEqual(preview['error_counts'],
+                         [('Missing acknowledged bank details', 3),
+                          ('No payment data available', 1)])
+        self.assertEqual(len(preview['errors']), 2)
+        self.assertContains(response, 'The first 2 of 4 skipped payees')
+
+    def test_preview_of_a_rerun_after_a_rejection(self):
+        tds = TDS.objects.create(tds_legal_name='individual',
+                                 tds_percentage=10)
+        unchanged = create_payee(1, tds_type=tds)
+        create_payee(2, tds_type=tds)
+        run_pay_run_task(self.pay_run.id)
+        bonus = Component.objects.create(component_name='Bonus',
+                                         operation='sum')
+        ComponentValue.objects.create(
+            pay_record=PayRecordRegister.objects.get(payee=unchanged),
+            component=bonus, value=Decimal('100.00'))
+        PayRecordRegister.objects.filter(payee=unchanged).update(
+            gross_amount=Decimal('1100.00'), net_income=990)
+        self.pay_run.status = PayRunStatusChoices.REJECTED
+        self.pay_run.save()
+        rerun = PayRun.objects.create(month=1, year=2025)
+
+        response = self.client.get(
+            reverse('admin:payroll_payrun_preview', args=[rerun.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        preview = response.context['preview']
+        self.assertEqual(preview['total_amount'], Decimal('2000.00'))
+        self.assertEqual(preview['total_gross_amount'], Decimal('2100.00'))
+        self.assertEqual(preview['total_net_income'], Decimal('1890.00'))
+        self.assertEqual(preview['total_tds'], Decimal('210.00'))
+
+    def test_progress_is_read_from_the_cache(self):
+        create_payee(1)
+        create_payee(2, amount=None)
+        run_pay_run_task(self.pay_run.id)
+        url = reverse('admin:payroll_payrun_progress', args=[self.pay_run.pk])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertFalse(any('payroll_payrun' in query['sql']
+                             for query in queries.captured_queries))
+        self.assertEqual(response.json(), {
+            'status': 'completed', 'total': 2, 'processed': 2,
+            'succeeded': 1, 'errored': 1, 'percent': 100.0,
+            'eta_seconds': None})
+
+    def test_change_page_shows_progress_bar_while_in_progress(self):
+        self.pay_run.status = PayRunStatusChoices.IN_PROGRESS
+        self.pay_run.save()
+
+        response = self.client.get(reverse('admin:payroll_payrun_change',
+                                           args=[self.pay_run.pk]))
+
+        self.assertContains(response, 'id="payrun-progress"')
+
+    def test_error_changelist_shows_counts_per_error_type(self):
+        create_payee(1, acknowledged=False)
+        create_payee(2, acknowledged=False)
+        create_payee(3, amount=None)
+        run_pay_run_task(self.pay_run.id)
+
+        response = self.client.get(
+            reverse('admin:payroll_payrunerror_changelist'),
+            {'pay_run__id__exact': self.pay_run.pk})
+
+        self.assertEqual(response.context_data['error_counts'],
+                         [('Missing acknowledged bank details', 2),
+                          ('No payment data available', 1)])
+
+        response = self.client.get(reverse('admin:payroll_payrun_change',
+                                           args=[self.pay_run.pk]))
+        self.assertContains(response, 'Missing acknowledged bank details: 2')
+
+
+class BankFileExportTests(TestCase):
+
+    def setUp(self):
+        self.pay_run = PayRun.objects.create(month=1, year=2025)
+        create_payee(1, amount=Decimal('1500.50'))
+        create_payee(2, amount=Decimal('250000.00'))
+        run_pay_run_task(self.pay_run.id)
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+    def get_bank_file(self, file_format):
+        return self.client.get(reverse('admin:payroll_payrun_bank_file',
+                                       args=[self.pay_run.pk, file_format]))
+
+    def test_only_approved_pay_runs_are_exported(self):
+        self.assertEqual(self.get_bank_file('csv').status_code, 404)
+
+    def test_streams_detail_lines_and_control_trailer(self):
+        self.pay_run.status = PayRunStatusChoices.APPROVED
+        self.pay_run.save()
+
+        response = self.get_bank_file('csv')
+
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[2], 'D,NEFT,0000000001,BANK0000001,Payee 1,'
+                                   '1500.50,HRM1,Salary January 2025')
+        self.assertEqual(lines[3].split(',')[:2], ['D', 'RTGS'])
+        checksum = hashlib.sha256(''.join(
+            f'{line}\r\n' for line in lines[2:4]).encode()).hexdigest()
+        self.assertEqual(lines[4], f'T,2,251500.50,{checksum}')
+
+        response = self.get_bank_file('fixed')
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual({len(line) for line in lines[1:3]}, {136})
+        self.assertEqual(lines[2][:5], 'DRTGS')
+        self.assertEqual(lines[3][:28], f'T{2:09d}{25150050:018d}')
+
+    def test_overlong_account_number_is_not_truncated(self):
+        PayRun.objects.filter(pk=self.pay_run.pk).update(
+            status=PayRunStatusChoices.APPROVED)
+        PayRecordRegister.objects.filter(payee__hrm_id='HRM1').update(
+            account_number='1' * 21)
+
+        response = self.get_bank_file('fixed')
+
+        self.assertRedirects(response, reverse(
+            'admin:payroll_payrun_change', args=[self.pay_run.pk]))
+        message, = response.wsgi_request._messages
+        self.assertIn(f"HRM1: Account number '{'1' * 21}' is longer than 20 "
+                      f"characters.", str(message))
+
+    def test_negative_amount_is_rejected(self):
+        PayRecordRegister.objects.filter(payee__hrm_id='HRM2').update(
+            net_income=-5)
+
+        self.assertEqual(get_bank_file_errors(self.pay_run),
+                         ['HRM2: Amount -5.00 is not positive.'])
+        with self.assertRaises(ValueError):
+            list(generate_bank_file(self.pay_run, 'fixed'))
+
+    def test_zero_amount_is_rejected(self):
+        PayRecordRegister.objects.filter(payee__hrm_id='HRM2').update(
+            net_income=0)
+
+        self.assertEqual(get_bank_file_errors(self.pay_run),
+                         ['HRM2: Amount 0.00 is not positive.'])
+
+    def test_missing_bank_details_are_rejected(self):
+        for field, label in (('account_number', 'Account number'),
+                             ('ifsc_code', 'IFSC code'),
+                             ('account_holder_name', 'Beneficiary name')):
+            for value in (None, '  '):
+                with self.subTest(field=field, value=value):
+                    records = PayRecordRegister.objects.filter(
+                        payee__hrm_id='HRM1')
+                    original = records.values_list(field, flat=True).get()
+                    records.update(**{field: value})
+
+                    self.assertEqual(get_bank_file_errors(self.pay_run),
+                                     [f'HRM1: {label} is missing.'])
+                    with self.assertRaises(ValueError):
+                        list(generate_bank_file(self.pay_run, 'csv'))
+                    records.update(**{field: original})
+
+
+class PayRunSummaryTests(TestCase):
+
+    def setUp(self):
+        self.tds = TDS.objects.create(tds_legal_name='individual',
+                                      tds_percentage=10)
+        self.pay_run = PayRun.objects.create(month=1, year=2025)
+        create_payee(1, tds_type=self.tds)
+        create_payee(2, amount=Decimal('500.00'), tds_type=self.tds)
+        create_payee(3, amount=Decimal('300.00'))
+        run_pay_run_task(self.pay_run.id)
+
+    def get_summaries(self):
+        return list(self.pay_run.summaries.values_list(
+            'tds_type', 'headcount', 'total_amount', 'total_gross_amount',
+            'total_tds_amount', 'total_net_income'))
+
+    def test_summary_is_built_per_tds_type_on_completion(self):
+        self.assertEqual(self.get_summaries(), [
+            ('', 1, Decimal('300.00'), Decimal('300.00'), Decimal('0.00'),
+             Decimal('300.00')),
+            ('individual', 2, Decimal('1500.00'), Decimal('1500.00'),
+             Decimal('150.00'), Decimal('1350.00')),
+        ])
+        self.assertEqual(get_pay_run_totals(self.pay_run)['headcount'], 3)
+
+    def test_changed_record_adjusts_the_summary_incrementally(self):
+        bonus = Component.objects.create(component_name='Bonus',
+                                         operation='sum')
+        record = PayRecordRegister.objects.get(payee__hrm_id='HRM1')
+        ComponentValue.objects.create(pay_record=record, component=bonus,
+                                      value=Decimal('100.00'))
+        previous = (record.amount, record.gross_amount, record.net_income)
+        recalculate_pay_record(record)
+
+        with self.assertNumQueries(2):
+            adjust_pay_run_summary(record, previous)
+
+        adjusted = self.get_summaries()
+        build_pay_run_summary(self.pay_run)
+        self.assertEqual(adjusted, self.get_summaries())
+        self.assertEqual(adjusted[1][3:], (Decimal('1600.00'),
+                                           Decimal('160.00'),
+                                           Decimal('1440.00')))
+
+    def test_adjustment_follows_the_tds_type_the_record_was_built_with(self):
+        employment = TDS.objects.create(tds_legal_name='employment',
+                                        tds_percentage=20)
+        Payee.objects.filter(hrm_id='HRM1').update(tds_type=employment)
+        bonus = Component.objects.create(component_name='Bonus',
+                                         operation='sum')
+        record = PayRecordRegister.objects.select_related('payee').get(
+            payee__hrm_id='HRM1')
+        ComponentValue.objects.create(pay_record=record, component=bonus,
+                                      value=Decimal('100.00'))
+        previous = (record.amount, record.gross_amount, record.net_income)
+        recalculate_pay_record(record)
+
+        adjust_pay_run_summary(record, previous)
+
+        adjusted = self.get_summaries()
+        self.assertEqual([row[:2] for row in adjusted],
+                         [('', 1), ('individual', 2)])
+        build_pay_run_summary(self.pay_run)
+        self.assertEqual(adjusted, self.get_summaries())
+
+    def test_changelist_shows_totals(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+        response = self.client.get(reverse('admin:payroll_payrun_changelist'))
+
+        self.assertEqual(response.context['cl'].result_list[0].headcount, 3)
+        response = self.client.get(reverse('admin:payroll_payrun_change',
+                                           args=[self.pay_run.pk]))
+        self.assertContains(response, '<td>No TDS type</td>')
+
+
+class PayeeYTDTests(TestCase):
+
+    def setUp(self):
+        tds = TDS.objects.create(tds_legal_name='individual',
+                                 tds_percentage=10)
+        self.payee = create_payee(1, tds_type=tds)
+        self.pay_runs = []
+        for month, year in ((2, 2025), (3, 2025), (4, 2025)):
+            pay_run = PayRun.objects.create(month=month, year=year)
+            run_pay_run_task(pay_run.id)
+            pay_run.refresh_from_db()
+            set_status(pay_run, PayRunStatusChoices.APPROVED)
+            self.pay_runs.append(pay_run)
+
+    def get_ytd(self, financial_year):
+        return PayeeYTD.objects.filter(
+            payee=self.payee, financial_year=financial_year).values_list(
+            'pay_runs', 'gross_amount', 'tds_amount', 'net_income').first()
+
+    def test_approval_accumulates_per_financial_year(self):
+        self.assertEqual(self.get_ytd('2024-25'), (
+            2, Decimal('2000.00'), Decimal('200.00'), Decimal('1800.00')))
+        self.assertEqual(self.get_ytd('2025-26'), (
+            1, Decimal('1000.00'), Decimal('100.00'), Decimal('900.00')))
+
+    def test_rejecting_a_pay_run_without_accumulators(self):
+        # As for a pay run approved before the accumulators existed
+        PayeeYTD.objects.all().delete()
+
+        set_status(self.pay_runs[1], PayRunStatusChoices.REJECTED)
+
+        self.assertFalse(PayeeYTD.objects.exists())
+
+    def test_rejecting_an_approved_pay_run_reverses_it(self):
+        set_status(self.pay_runs[1], PayRunStatusChoices.REJECTED)
+
+        self.assertEqual(self.get_ytd('2024-25'), (
+            1, Decimal('1000.00'), Decimal('100.00'), Decimal('900.00')))
+
+    def test_rebuild_command_matches_the_accumulators(self):
+        expected = [self.get_ytd('2024-25'), self.get_ytd('2025-26')]
+        PayeeYTD.objects.update(gross_amount=0)
+
+        call_command('rebuild_payee_ytd', stdout=StringIO())
+
+        self.assertEqual([self.get_ytd('2024-25'), self.get_ytd('2025-26')],
+                         expected)
+
+    def test_graphql_returns_the_ytd_of_the_requesting_payee(self):
+        request = RequestFactory().post('/graphql/')
+        request.user = self.payee.user
+
+        result = schema.execute(
+            '{ payeeYtd(financialYear: "2024-25") { payRuns grossAmount '
+            'tdsAmount } }', context_value=request)
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['payeeYtd'], {
+            'payRuns': 2, 'grossAmount': '2000.00', 'tdsAmount': '200.00'})
+
+
+class RegisterExportTests(TestCase):
+
+    def setUp(self):
+        self.pay_run = PayRun.objects.create(month=1, year=2025)
+        create_payee(1)
+        create_payee(2)
+        run_pay_run_task(self.pay_run.id)
+        bonus = Component.objects.create(component_name='Bonus',
+                                         operation='sum')
+        recovery = Component.objects.create(component_name='Recovery',
+                                            operation='subtract')
+        record = PayRecordRegister.objects.get(payee__hrm_id='HRM1')
+        ComponentValue.objects.create(pay_record=record, component=recovery,
+                                      value=Decimal('20.00'))
+        ComponentValue.objects.create(pay_record=record, component=bonus,
+                                      value=Decimal('50.00'))
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+    def get_register(self, file_format):
+        return self.client.get(reverse('admin:payroll_payrun_register',
+                                       args=[self.pay_run.pk, file_format]))
+
+    def test_csv_pivots_component_columns(self):
+        response = self.get_register('csv')
+
+        rows = list(csv.reader(b''.join(
+            response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:6], ['Payee ID', 'Payee name', 'Amount',
+                                       'Bonus (earning)',
+                                       'Recovery (deduction)',
+                                       'Gross amount'])
+        self.assertEqual(rows[1][:3], ['HRM1', 'Payee 1', '1000.00'])
+        self.assertEqual([Decimal(value) for value in rows[1][3:5]],
+                         [Decimal('50.00'), Decimal('20.00')])
+        self.assertEqual(rows[2][:5], ['HRM2', 'Payee 2', '1000.00', '', ''])
+
+    def test_xlsx_contains_the_same_rows(self):
+        response = self.get_register('xlsx')
+
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)))
+        rows = list(workbook.active.values)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][:5], ('HRM1', 'Payee 1', 1000, 50, 20))
+
+
+    def login_as(self, username, codenames, groups=()):
+        user = User.objects.get(username=username)
+        user.is_staff = True
+        user.save()
+        user.user_permissions.set(Permission.objects.filter(
+            codename__in=codenames))
+        for name in groups:
+            user.groups.add(Group.objects.get_or_create(name=name)[0])
+        self.client.force_login(user)
+
+    def test_payee_only_exports_their_own_records(self):
+        PayRun.objects.filter(pk=self.pay_run.pk).update(
+            status=PayRunStatusChoices.APPROVED)
+        self.login_as('payee1', ['view_payrun', 'view_payrecordregister'],
+                      groups=['PAYEE'])
+
+        rows = list(csv.reader(b''.join(self.get_register(
+            'csv').streaming_content).decode().splitlines()))
+
+        self.assertEqual([row[0] for row in rows[1:]], ['HRM1'])
+
+    def test_export_requires_the_register_view_permission(self):
+        self.login_as('payee1', ['view_payrun'])
+
+        self.assertEqual(self.get_register('csv').status_code, 403)
+
+class PayRunVarianceTests(TestCase):
+
+    def setUp(self):
+        self.base_run = PayRun.objects.create(month=1, year=2025)
+        create_payee(1)
+        create_payee(2)
+        create_payee(3)
+        run_pay_run_task(self.base_run.id)
+        self.base_run.refresh_from_db()
+        set_status(self.base_run, PayRunStatusChoices.APPROVED)
+
+        Payment.objects.filter(payee__hrm_id='HRM2').update(
+            amount=Decimal('1200.00'))
+        Payment.objects.filter(payee__hrm_id='HRM3').delete()
+        create_payee(4, amount=Decimal('800.00'))
+        self.pay_run = PayRun.objects.create(month=2, year=2025)
+        run_pay_run_task(self.pay_run.id)
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+    def get_variance(self, **params):
+        return self.client.get(reverse('admin:payroll_payrun_variance',
+                                       args=[self.pay_run.pk]), params)
+
+    def test_flags_new_removed_and_changed_payees(self):
+        self.assertEqual(get_variance_base_run(self.pay_run), self.base_run)
+
+        with self.assertNumQueries(1):
+            rows = list(get_variance(self.pay_run, self.base_run))
+
+        self.assertEqual(
+            [(row['hrm_id'], row['variance']) for row in rows],
+            [('HRM2', CHANGED), ('HRM4', NEW), ('HRM3', REMOVED)])
+        self.assertEqual(Decimal(rows[0]['previous_gross']),
+                         Decimal('1000.00'))
+        self.assertEqual(Decimal(rows[0]['gross']), Decimal('1200.00'))
+        self.assertIsNone(rows[1]['previous_gross'])
+        self.assertIsNone(rows[2]['gross'])
+
+    def test_threshold_drops_small_changes(self):
+        response = self.get_variance(threshold='500')
+
+        self.assertEqual(response.context['base_run'], self.base_run)
+        self.assertEqual([row['hrm_id'] for row in response.context[
+            'page_obj']], ['HRM4', 'HRM3'])
+
+    def test_csv_export(self):
+        response = self.get_variance(format='csv')
+
+        rows = list(csv.reader(b''.join(
+            response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:3], ['Payee ID', 'Payee name', 'Variance'])
+        self.assertEqual([row[2] for row in rows[1:]],
+                         [CHANGED, NEW, REMOVED])
+
+
+class RecalculatePayRecordTests(TestCase):
+
+    def setUp(self):
+        tds = TDS.objects.create(tds_legal_name='individual',
+                                 tds_percentage=7.5)
+        self.pay_run = PayRun.objects.create(month=1, year=2025)
+        create_payee(1, amount=Decimal('1000.55'), tds_type=tds)
+        create_payee(2, amount=Decimal('2000.00'), tds_type=tds)
+        run_pay_run_task(self.pay_run.id)
+
+        bonus = Component.objects.create(component_name='Bonus',
+                                         operation='sum')
+        recovery = Component.objects.create(component_name='Recovery',
+                                            operation='subtract')
+        self.record = PayRecordRegister.objects.get(payee__hrm_id='HRM1')
+        ComponentValue.objects.create(pay_record=self.record, component=bonus,
+                                      value=Decimal('10.00'))
+        ComponentValue.objects.create(pay_record=self.record,
+                                      component=recovery,
+                                      value=Decimal('0.50'))
+
+    def test_recalculates_a_single_record(self):
+        recalculate_pay_record(self.record)
+
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.gross_amount, Decimal('1010.05'))
+        self.assertEqual(self.record.net_income, 934.30)
+
+    def test_set_based_recalculation_matches_compute_pay(self):
+        records = PayRecordRegister.objects.filter(pay_run=self.pay_run)
+        PayRecordRegister.objects.update(gross_amount=0, net_income=0)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(recalculate_pay_records(records), 2)
+
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.gross_amount, Decimal('1010.05'))
+        self.assertEqual(self.record.net_income, 934.30)
+        other = records.get(payee__hrm_id='HRM2')
+        self.assertEqual(other.gross_amount, Decimal('2000.00'))
+        self.assertEqual(other.net_income, 1850)
+
+
+    def test_action_recalculates_completed_pay_runs_only(self):
+        admin_user = User.objects.create_superuser('admin')
+        self.client.force_login(admin_user)
+        url = reverse('admin:payroll_payrun_changelist')
+        PayRecordRegister.objects.update(gross_amount=0, net_income=0)
+
+        for status in (PayRunStatusChoices.IN_PROGRESS,
+                       PayRunStatusChoices.REJECTED,
+                       PayRunStatusChoices.APPROVED):
+            PayRun.objects.filter(pk=self.pay_run.pk).update(status=status)
+            self.client.post(url, {'action': 'recalculate_payrun',
+                                   '_selected_action': [self.pay_run.pk]})
+            self.record.refresh_from_db()
+            self.assertEqual(self.record.gross_amount, 0)
+
+        PayRun.objects.filter(pk=self.pay_run.pk).update(
+            status=PayRunStatusChoices.COMPLETED)
+        self.client.post(url, {'action': 'recalculate_payrun',
+                               '_selected_action': [self.pay_run.pk]})
+
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.gross_amount, Decimal('1010.05'))
+        entry = LogEntry.objects.get_for_object(self.pay_run).filter(
+            changes__has_key='pay records').get()
+        self.assertEqual(entry.actor, admin_user)
+        self.assertEqual(entry.changes['pay records'], ['', '2 recalculated'])
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class Form16ExtractionTests(TestCase):
+
+    def create_form16(self, members):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            for name, content in members.items():
+                zip_file.writestr(name, content)
+        return Form16.objects.create(
+            financial_year='2024-25', form16_zip_file=SimpleUploadedFile(
+                'form16.zip', archive.getvalue()))
+
+    def test_extraction_is_queued_after_commit(self):
+        payee = create_payee(1)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            form16 = self.create_form16({
+                'ABCDE0001F_2024-25.pdf': b'%PDF-1',
+                'XYZAB9999C_2024-25.pdf': b'%PDF-2',
+                '__MACOSX/._ABCDE0001F_2024-25.pdf': b'meta',
+                'empty.pdf': b''})
+
+        self.assertEqual(form16.status, Form16StatusChoices.PENDING)
+        self.assertFalse(Form16Entries.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+
+        callbacks[0]()
+
+        form16.refresh_from_db()
+        self.assertEqual(form16.status, Form16StatusChoices.EXTRACTED)
+        self.assertTrue(form16.is_extracted)
+        self.assertEqual((form16.extracted_files, form16.total_files), (3, 3))
+        entries = Form16Entries.objects.order_by('form_16')
+        self.assertEqual([entry.payee for entry in entries], [payee, None])
+        with entries[0].form_16.open('rb') as file:
+            self.assertEqual(file.read(), b'%PDF-1')
+
+    def test_duplicate_delivery_is_skipped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            form16 = self.create_form16({'ABCDE0001F_2024-25.pdf': b'%PDF'})
+
+        extract_form16_task(form16.id)
+
+        self.assertEqual(Form16Entries.objects.count(), 1)
+
+    def test_uploads_concurrently_under_deterministic_keys(self):
+        members = {f'ABCDE{index:04d}F_2024-25.pdf': b'%PDF'
+                   for index in range(20)}
+        with self.captureOnCommitCallbacks():
+            form16 = self.create_form16(members)
+        claim_form16(form16.id)
+
+        with patch.object(default_storage, 'exists') as exists, \
+                patch.object(default_storage, 'delete') as delete:
+            stats = extract_form16(form16, StorageUploader(workers=4))
+
+        exists.assert_not_called()
+        delete.assert_not_called()
+        self.assertEqual(stats['files'], 20)
+        self.assertGreater(stats['files_per_second'], 0)
+        self.assertEqual(
+            sorted(Form16Entries.objects.values_list('form_16', flat=True)),
+            sorted(form16_entry_path(form16, name) for name in members))
+
+    def test_archive_on_s3_is_downloaded_once(self):
+        members = {f'ABCDE{index:04d}F_2024-25.pdf': os.urandom(64 * 1024)
+                   for index in range(40)}
+        with self.captureOnCommitCallbacks():
+            form16 = self.create_form16(members)
+        claim_form16(form16.id)
+        with form16.form16_zip_file.open('rb') as file:
+            client = StubS3Client(file.read())
+        form16.form16_zip_file.storage = S3Boto3Storage(bucket_name='bucket')
+
+        with patch('payroll.uploaders.create_s3_client',
+                   return_value=client):
+            stats = extract_form16(form16, StorageUploader(default_storage,
+                                                           workers=4))
+
+        self.assertEqual(stats['files'], 40)
+        self.assertEqual(client.gets, 1)
+        self.assertEqual(client.bytes_read, len(client.data))
+
+    def test_pans_are_resolved_in_one_query(self):
+        payees = [create_payee(index) for index in range(3)]
+        members = {f'ABCDE{index:04d}F_2024-25.pdf': b'%PDF'
+                   for index in range(10)}
+        with self.captureOnCommitCallbacks():
+            form16 = self.create_form16(members)
+        claim_form16(form16.id)
+
+        with CaptureQueriesContext(connection) as queries:
+            extract_form16(form16)
+
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'payees_payee' in query['sql']]), 1)
+        self.assertEqual(
+            set(Form16Entries.objects.exclude(payee=None).values_list(
+                'payee', flat=True)), {payee.id for payee in payees})
+        self.assertEqual(
+            sorted(form16.unmatched_pans.values_list('pan_no', flat=True)),
+            [f'ABCDE{index:04d}F' for index in range(3, 10)])
+
+        self.client.force_login(User.objects.create_superuser('admin'))
+        response = self.client.get(
+            reverse('admin:payroll_form16unmatchedpan_changelist'),
+            {'form16__id__exact': form16.id})
+        self.assertEqual(response.context['cl'].result_count, 7)
+
+    def extract(self, members):
+        with self.captureOnCommitCallbacks():
+            form16 = self.create_form16(members)
+        claim_form16(form16.id)
+        return form16, extract_form16(form16)
+
+    def test_reupload_skips_unchanged_documents(self):
+        first, _ = self.extract({'ABCDE0001F_2024-25.pdf': b'%PDF-1',
+                                 'ABCDE0002F_2024-25.pdf': b'%PDF-2'})
+
+        second, stats = self.extract({'ABCDE0001F_2024-25.pdf': b'%PDF-1',
+                                      'ABCDE0002F_2024-25.pdf': b'%PDF-2b',
+                                      'ABCDE0003F_2024-25.pdf': b'%PDF-3'})
+
+        self.assertEqual((stats['files'], stats['skipped']), (2, 1))
+        entries = second.form16entries_set.order_by('form_16')
+        self.assertEqual(entries[0].content_hash,
+                         hashlib.sha256(b'%PDF-1').hexdigest())
+        with entries[1].form_16.open('rb') as file:
+            self.assertEqual(file.read(), b'%PDF-2b')
+        superseded = first.form16entries_set.order_by('form_16')
+        self.assertEqual([entry.superseded_by_id for entry in superseded],
+                         [entries[0].id, entries[1].id])
+        # The unchanged document is shared, the replaced one is kept
+        self.assertEqual(entries[0].form_16.name, superseded[0].form_16.name)
+        with superseded[1].form_16.open('rb') as file:
+            self.assertEqual(file.read(), b'%PDF-2')
+        self.assertFalse(second.form16entries_set.exclude(
+            superseded_by=None).exists())
+
+    def test_bulk_download_streams_a_zip(self):
+        self.extract({'ABCDE0001F_2024-25.pdf': b'%PDF-1'})
+        form16, _ = self.extract({'ABCDE0001F_2024-25.pdf': b'%PDF-1b',
+                                  'ABCDE0002F_2024-25.pdf': b'%PDF-2'})
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+        response = self.client.get(
+            reverse('admin:payroll_form16entries_download'),
+            {'financial_year': '2024-25'})
+
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(BytesIO(b''.join(
+            response.streaming_content)))
+        self.assertEqual(sorted(archive.namelist()),
+                         ['2024-25/ABCDE0001F_2024-25.pdf',
+                          '2024-25/ABCDE0002F_2024-25.pdf'])
+        self.assertEqual(archive.read('2024-25/ABCDE0001F_2024-25.pdf'),
+                         b'%PDF-1b')
+
+        response = self.client.post(
+            reverse('admin:payroll_form16entries_changelist'),
+            {'action': 'download_zip', '_selected_action': list(
+                form16.form16entries_set.values_list('id', flat=True))})
+
+        archive = zipfile.ZipFile(BytesIO(b''.join(
+            response.streaming_content)))
+        self.assertEqual(len(archive.namelist()), 2)
+        self.assertIsNone(archive.testzip())
+
+    def test_bulk_download_leaves_out_missing_documents(self):
+        form16, _ = self.extract({'ABCDE0001F_2024-25.pdf': b'%PDF-1',
+                                  'ABCDE0002F_2024-25.pdf': b'%PDF-2'})
+        missing = form16.form16entries_set.order_by('form_16').first()
+        default_storage.delete(missing.form_16.name)
+
+        archive = zipfile.ZipFile(BytesIO(b''.join(generate_form16_zip(
+            form16.form16entries_set.all()))))
+
+        self.assertEqual(archive.namelist(),
+                         ['2024-25/ABCDE0002F_2024-25.pdf'])
+        self.assertIsNone(archive.testzip())
+
+    @override_settings(FORM16_ZIP_MAX_MEMBERS=2)
+    def test_archives_over_the_limits_are_not_extracted(self):
+        form16, stats = self.extract({
+            f'ABCDE{index:04d}F_2024-25.pdf': b'%PDF' for index in range(3)})
+
+        self.assertIsNone(stats)
+        form16.refresh_from_db()
+        self.assertEqual(form16.status, Form16StatusChoices.FAILED)
+        self.assertEqual(form16.error, 'The ZIP file has more than 2 files.')
+        self.assertFalse(Form16Entries.objects.exists())
+
+    def test_zip_validator_rejects_zip_bombs(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr('ABCDE0001F_2024-25.pdf', bytes(2 * 1024 ** 2))
+
+        with self.assertRaisesMessage(ValidationError,
+                                      'compressed more than 100 times'):
+            validate_zip_file(archive)
+        with override_settings(FORM16_ZIP_MAX_COMPRESSION_RATIO=10000,
+                               FORM16_ZIP_MAX_MEMBER_SIZE=1024 ** 2):
+            with self.assertRaisesMessage(ValidationError,
+                                          'larger than 1048576 bytes'):
+                validate_zip_file(archive)
+        with override_settings(FORM16_ZIP_MAX_COMPRESSION_RATIO=10000,
+                               FORM16_ZIP_MAX_TOTAL_SIZE=1024 ** 2):
+            with self.assertRaisesMessage(ValidationError,
+                                          'expands to more than'):
+                validate_zip_file(archive)
+        with override_settings(FORM16_ZIP_MAX_COMPRESSION_RATIO=10000):
+            validate_zip_file(archive)
+
+    def test_zip_validator_checks_the_ratio_of_the_whole_archive(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for index in range(4):
+                zip_file.writestr(f'ABCDE{index:04d}F_2024-25.pdf',
+                                  bytes(512 * 1024))
+
+        with self.assertRaisesMessage(
+                ValidationError,
+                'The ZIP file is compressed more than 100 times.'):
+            validate_zip_file(archive)
+
+    def test_bad_zip_marks_the_upload_failed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            form16 = Form16.objects.create(
+                financial_year='2024-25', form16_zip_file=SimpleUploadedFile(
+                    'form16.zip', b'not a zip'))
+
+        form16.refresh_from_db()
+        self.assertEqual(form16.status, Form16StatusChoices.FAILED)
+        self.assertTrue(form16.error)
+
+
+class StubS3Client:
+    """ Serves an object from memory and counts the bytes read from it """
+
+    def __init__(self, data):
+        self.data = data
+        self.gets = 0
+        self.bytes_read = 0
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.data)}
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = (int(value) for value in Range[6:].split('-'))
+        self.gets += 1
+        self.bytes_read += end + 1 - start
+        return {'Body': BytesIO(self.data[start:end + 1])}
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(),
+                   FORM16_UPLOAD_PART_SIZE=100)
+class Form16DirectUploadTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+    def create_zip(self, count):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            for index in range(count):
+                zip_file.writestr(f'ABCDE{index:04d}F_2024-25.pdf',
+                                  b'%PDF' * 50)
+        return archive.getvalue()
+
+    def upload(self, data):
+        upload = self.client.post(
+            reverse('admin:payroll_form16_upload_start'),
+            {'financial_year': '2024-25', 'file_name': 'form16.zip',
+             'size': len(data)}, content_type='application/json').json()
+        parts = []
+        for index, url in enumerate(upload['part_urls']):
+            start = index * upload['part_size']
+            response = self.client.put(
+                url, data[start:start + upload['part_size']],
+                content_type='application/octet-stream')
+            parts.append({'part_number': index + 1,
+                          'etag': response['ETag']})
+        return upload, self.client.post(
+            upload['complete_url'], {'parts': parts},
+            content_type='application/json')
+
+    def test_parts_are_joined_validated_and_queued_for_extraction(self):
+        data = self.create_zip(2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            upload, response = self.upload(data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(upload['part_urls']), math.ceil(len(data) / 100))
+        form16 = Form16.objects.get(pk=upload['id'])
+        self.assertEqual(form16.status, Form16StatusChoices.EXTRACTED)
+        with form16.form16_zip_file.open('rb') as file:
+            self.assertEqual(file.read(), data)
+        self.assertEqual(form16.form16entries_set.count(), 2)
+
+    def test_changelist_links_to_the_upload_page(self):
+        response = self.client.get(reverse('admin:payroll_form16_changelist'))
+
+        self.assertContains(response, reverse('admin:payroll_form16_upload'))
+        response = self.client.get(reverse('admin:payroll_form16_upload'))
+        self.assertContains(response,
+                            reverse('admin:payroll_form16_upload_start'))
+
+    def test_invalid_zip_fails_the_upload(self):
+        upload, response = self.upload(b'not a zip' * 20)
+
+        self.assertEqual(response.status_code, 400)
+        form16 = Form16.objects.get(pk=upload['id'])
+        self.assertEqual(form16.status, Form16StatusChoices.FAILED)
+        self.assertEqual(form16.error,
+                         'The uploaded file is not a valid ZIP file.')
+
+    def test_cancelled_upload_discards_its_parts(self):
+        data = self.create_zip(2)
+        upload = self.client.post(
+            reverse('admin:payroll_form16_upload_start'),
+            {'financial_year': '2024-25', 'file_name': 'form16.zip',
+             'size': len(data)}, content_type='application/json').json()
+        self.client.put(upload['part_urls'][0], data[:100],
+                        content_type='application/octet-stream')
+        form16 = Form16.objects.get(pk=upload['id'])
+        parts_dir = LocalMultipartBackend(default_storage)._parts_dir(form16)
+        self.assertTrue(os.path.isdir(parts_dir))
+
+        response = self.client.post(upload['abort_url'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(parts_dir))
+        form16.refresh_from_db()
+        self.assertEqual(form16.status, Form16StatusChoices.FAILED)
+        self.assertEqual(form16.error, 'The upload was cancelled.')
+        self.assertEqual(form16.upload_id, '')
+
+    def test_s3_upload_that_cannot_be_completed_is_aborted(self):
+        form16 = Form16.objects.create(
+            financial_year='2024-25', upload_id='upload-1',
+            form16_zip_file='uploads/payroll/form16/form16.zip',
+            status=Form16StatusChoices.UPLOADING)
+        client = MagicMock()
+        client.complete_multipart_upload.side_effect = ClientError(
+            {'Error': {'Code': 'InvalidPart'}}, 'CompleteMultipartUpload')
+        with patch('payroll.multipart.create_s3_client',
+                   return_value=client):
+            backend = S3MultipartBackend(S3Boto3Storage(bucket_name='bucket',
+                                                         location=''))
+
+        with self.assertRaises(ValidationError):
+            complete_form16_upload(form16, [(1, '"etag"')], backend)
+
+        client.abort_multipart_upload.assert_called_once_with(
+            Bucket='bucket', Key='uploads/payroll/form16/form16.zip',
+            UploadId='upload-1')
+        form16.refresh_from_db()
+        self.assertEqual(form16.status, Form16StatusChoices.FAILED)
+        self.assertEqual(form16.upload_id, '')
+
+    def test_parts_without_an_etag_are_refused(self):
+        data = self.create_zip(1)
+        upload = self.client.post(
+            reverse('admin:payroll_form16_upload_start'),
+            {'financial_year': '2024-25', 'file_name': 'form16.zip',
+             'size': len(data)}, content_type='application/json').json()
+
+        for etag in (None, ''):
+            response = self.client.post(
+                upload['complete_url'],
+                {'parts': [{'part_number': 1, 'etag': etag}]},
+                content_type='application/json')
+
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('ETag', response.json()['error'])
+        self.assertEqual(Form16.objects.get(pk=upload['id']).status,
+                         Form16StatusChoices.UPLOADING)
+
+    def test_completed_object_that_cannot_be_read_fails_the_upload(self):
+        form16 = Form16.objects.create(
+            financial_year='2024-25', upload_id='upload-1',
+            form16_zip_file='uploads/payroll/form16/form16.zip',
+            status=Form16StatusChoices.UPLOADING)
+        with patch('payroll.multipart.create_s3_client'):
+            backend = S3MultipartBackend(S3Boto3Storage(bucket_name='bucket'))
+
+        with patch('payroll.multipart.open_stored_file',
+                   side_effect=ClientError({'Error': {'Code': '404'}},
+                                           'HeadObject')), \
+                self.assertRaises(ValidationError):
+            complete_form16_upload(form16, [(1, '"etag"')], backend)
+
+        form16.refresh_from_db()
+        self.assertEqual(form16.status, Form16StatusChoices.FAILED)
+        self.assertIn('could not be read', form16.error)
+
+    def test_central_directory_is_read_with_ranged_reads(self):
+        data = self.create_zip(200)
+        client = StubS3Client(data)
+
+        validate_form16_zip(io.BufferedReader(
+            RangedStorageFile(client, 'bucket', 'key'), buffer_size=4096))
+
+        self.assertLess(client.bytes_read, len(data) / 2)
 
-# Create your tests here.
@@ -1,15 +1,73 @@
 import zipfile
+from django.conf import settings
 from django.core.exceptions import ValidationError
 
+# Members, and archives, smaller than this are not checked against the
+# compression ratio, as tiny files legitimately compress far better than
+# documents
+RATIO_CHECK_MIN_SIZE = 1024 * 1024
+
+
+def check_zip_limits(infolist):
+    """
+    Raises a ValidationError if the central directory of a ZIP exceeds the
+    FORM16_ZIP_MAX_* limits on the number of members, the uncompressed size
+    of a member and of all members, and the compression ratio of a member
+    and of all members, which catches many small members that each escape
+    the member check. zipfile never inflates a member past the size
+    declared here, so these limits also bound what extracting the archive
+    can produce.
+    """
+    if len(infolist) > settings.FORM16_ZIP_MAX_MEMBERS:
+        raise ValidationError(
+            f"The ZIP file has more than {settings.FORM16_ZIP_MAX_MEMBERS} "
+            f"files.")
+
+    total_size = 0
+    total_compress_size = 0
+    for info in infolist:
+        if info.file_size > settings.FORM16_ZIP_MAX_MEMBER_SIZE:
+            raise ValidationError(
+                f"'{info.filename}' is larger than "
+                f"{settings.FORM16_ZIP_MAX_MEMBER_SIZE} bytes.")
+        if info.file_size >= RATIO_CHECK_MIN_SIZE and \
+                info.file_size > info.compress_size * \
+                settings.FORM16_ZIP_MAX_COMPRESSION_RATIO:
+            raise ValidationError(
+                f"'{info.filename}' is compressed more than "
+                f"{settings.FORM16_ZIP_MAX_COMPRESSION_RATIO} times.")
+        total_size += info.file_size
+        total_compress_size += info.compress_size
+
+    if total_size > settings.FORM16_ZIP_MAX_TOTAL_SIZE:
+        raise ValidationError(
+            f"The ZIP file expands to more than "
+            f"{settings.FORM16_ZIP_MAX_TOTAL_SIZE} bytes.")
+    if total_size >= RATIO_CHECK_MIN_SIZE and \
+            total_size > total_compress_size * \
+            settings.FORM16_ZIP_MAX_COMPRESSION_RATIO:
+        raise ValidationError(
+            f"The ZIP file is compressed more than "
+            f"{settings.FORM16_ZIP_MAX_COMPRESSION_RATIO} times.")
+
 
 def validate_zip_file(file):
     try:
-        if not zipfile.is_zipfile(file):
-            raise ValidationError("The uploaded file is not a valid ZIP file.")
+        with zipfile.ZipFile(file) as zip_ref:
+            check_zip_limits(zip_ref.infolist())
+    except zipfile.BadZipFile:
+        raise ValidationError("The uploaded file is not a valid ZIP file.")
+    except ValidationError:
+        raise
     except Exception as e:
         raise ValidationError("Error validating ZIP file.")
 
 
 def form16_extracted_path(instance, filename):
-    """ Define path for extracted files """
-    return f'uploads/payroll/form16/extracted/{instance.financial_year.financial_year}/{filename}'
+    """
+    Define path for extracted files, under the upload they come from so a
+    later upload never overwrites them
+    """
+    return (f'uploads/payroll/form16/extracted/'
+            f'{instance.financial_year.financial_year}/'
+            f'{instance.financial_year_id}/{filename}')
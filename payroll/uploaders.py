@@ -0,0 +1,221 @@
+"""
+Concurrent uploads of many small files to the media storage, and ranged
+reads and one-off downloads of large stored files.
+
+The files are written under keys chosen by the caller from a bounded
+thread pool. On S3 all the threads share one boto3 client whose connection
+pool matches the number of threads; on any other storage (the local
+filesystem in development and tests) the files are written to the storage
+path directly. In both cases an existing file under the same key is
+overwritten, so no exists() or delete() round trip is needed per file.
+"""
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.config import Config
+from django.conf import settings
+from django.core.files.storage import default_storage
+from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
+
+# For getting the named logger
+logger = logging.getLogger('celery_debug')
+
+# Bytes fetched per ranged GET when reading a stored file
+READ_BUFFER_SIZE = 1024 * 1024
+
+# Bytes fetched per ranged GET when downloading a stored file
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Bytes of a downloaded file kept in memory before it is spooled to disk
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+
+def create_s3_client(storage, max_pool_connections=10):
+    """
+    Returns a boto3 S3 client configured like an S3Boto3Storage, which
+    unlike the storage's own resource may be shared between threads.
+    """
+    return storage._create_session().client(
+        's3', region_name=storage.region_name, use_ssl=storage.use_ssl,
+        endpoint_url=storage.endpoint_url, verify=storage.verify,
+        config=storage.client_config.merge(
+            Config(max_pool_connections=max_pool_connections)))
+
+
+class RangedStorageFile(io.RawIOBase):
+    """
+    Seekable read-only file over an S3 object that fetches every read() with
+    a ranged GET, so reading the end of a large object does not download
+    the rest of it.
+    """
+
+    def __init__(self, client, bucket, key):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = client.head_object(Bucket=bucket,
+                                       Key=key)['ContentLength']
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def read(self, size=-1):
+        if self.position >= self.size or size == 0:
+            return b''
+        end = self.size if size is None or size < 0 else min(
+            self.position + size, self.size)
+        data = self.client.get_object(
+            Bucket=self.bucket, Key=self.key,
+            Range=f'bytes={self.position}-{end - 1}')['Body'].read()
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_stored_file(name, storage=None):
+    """
+    Opens a stored file for random access reads. On S3 the reads are
+    ranged GETs through a READ_BUFFER_SIZE buffer, instead of the storage's
+    own file which downloads the whole object first.
+    """
+    storage = storage or default_storage
+    if not isinstance(storage, S3Boto3Storage):
+        return storage.open(name, 'rb')
+    return io.BufferedReader(
+        RangedStorageFile(create_s3_client(storage), storage.bucket_name,
+                          storage._normalize_name(clean_name(name))),
+        buffer_size=READ_BUFFER_SIZE)
+
+
+def download_stored_file(name, storage=None):
+    """
+    Opens a stored file for reads from many threads. On S3 the object is
+    downloaded once, in DOWNLOAD_CHUNK_SIZE ranged GETs, into a temporary
+    file spooled to disk past SPOOL_MAX_SIZE, since threads reading apart
+    from each other through open_stored_file() would keep discarding its
+    buffer and fetch the object many times over.
+    """
+    storage = storage or default_storage
+    if not isinstance(storage, S3Boto3Storage):
+        return storage.open(name, 'rb')
+    source = RangedStorageFile(create_s3_client(storage),
+                               storage.bucket_name,
+                               storage._normalize_name(clean_name(name)))
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    shutil.copyfileobj(source, file, DOWNLOAD_CHUNK_SIZE)
+    file.seek(0)
+    return file
+
+
+class StorageUploader:
+    """
+    Uploads files to a storage from a pool of `workers` threads, keeping at
+    most twice as many files open at a time.
+    """
+
+    def __init__(self, storage=None, workers=None):
+        self.storage = storage or default_storage
+        self.workers = workers or settings.FORM16_UPLOAD_WORKERS
+        self.client = self._create_client()
+        self.uploaded = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+
+    def _create_client(self):
+        if not isinstance(self.storage, S3Boto3Storage):
+            return None
+        return create_s3_client(self.storage, self.workers)
+
+    @property
+    def files_per_second(self):
+        if not self.elapsed:
+            return 0.0
+        return round(self.uploaded / self.elapsed, 1)
+
+    def upload(self, key, file):
+        """ Writes a file object to the storage under `key` """
+        if self.client is None:
+            path = self.storage.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as destination:
+                shutil.copyfileobj(file, destination)
+            return
+
+        name = self.storage._normalize_name(clean_name(key))
+        self.client.upload_fileobj(
+            file, self.storage.bucket_name, name,
+            ExtraArgs=self.storage._get_write_parameters(name),
+            Config=self.storage.transfer_config)
+
+    def _upload_opened(self, key, open_file):
+        file = open_file()
+        if file is None:
+            return key, False
+        with file:
+            self.upload(key, file)
+        return key, True
+
+    def upload_all(self, files):
+        """
+        Uploads the (key, open_file) pairs of `files`, where open_file()
+        returns the file object to read, or None when the stored file is
+        already up to date, and yields every key once its file is stored or
+        skipped, in completion order. open_file() is called from the pool.
+        An upload error is raised when its key would have been yielded.
+        """
+        started = time.monotonic()
+        pending = set()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for key, open_file in files:
+                if len(pending) >= self.workers * 2:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    yield from self._collect(done)
+                pending.add(executor.submit(self._upload_opened, key,
+                                            open_file))
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from self._collect(done)
+
+        self.elapsed = time.monotonic() - started
+        logger.info('Uploaded %s files in %.1fs (%s files/s) with %s '
+                    'threads, %s unchanged files skipped', self.uploaded,
+                    self.elapsed, self.files_per_second, self.workers,
+                    self.skipped)
+
+    def _collect(self, futures):
+        for future in futures:
+            key, uploaded = future.result()
+            if uploaded:
+                self.uploaded += 1
+            else:
+                self.skipped += 1
+            yield key
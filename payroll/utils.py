@@ -42,3 +42,12 @@ def get_month_name(month):
 
     month_names = dict(MONTH_CHOICES)
     return month_names.get(month)
+
+
+def get_financial_year(month, year):
+    """
+    Returns the Indian financial year (April to March) of the given month
+    and year, e.g. '2024-25' for January 2025.
+    """
+    start_year = year if month >= 4 else year - 1
+    return f"{start_year}-{(start_year + 1) % 100:02d}"
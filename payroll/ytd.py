@@ -0,0 +1,95 @@
+"""
+PayeeYTD accumulators: the year-to-date gross, TDS and net income of every
+payee per financial year.
+
+A pay run is added to the accumulators of its payees when it is approved and
+subtracted again if an approved pay run is rejected, so lookups read a
+single row instead of re-summing the register.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PayeeYTD, PayRecordRegister, PayRun, PayRunStatusChoices
+from .utils import get_financial_year
+
+YTD_FIELDS = ('pay_runs', 'gross_amount', 'tds_amount', 'net_income')
+
+
+def _money(value):
+    return Decimal(str(value)) if value is not None else Decimal('0')
+
+
+def apply_pay_run_to_ytd(pay_run, sign=1):
+    """
+    Adds (sign=1) or subtracts (sign=-1) the pay records of a pay run to
+    the YTD accumulators of their payees for the pay run's financial year.
+    Runs in one transaction, in chunks of PAYRUN_BULK_CREATE_BATCH_SIZE
+    payees with one locking read, one bulk update and one bulk insert each.
+    Subtracting skips the payees without an accumulator, which never counted
+    the pay run.
+    """
+    financial_year = get_financial_year(pay_run.month, pay_run.year)
+    batch_size = settings.PAYRUN_BULK_CREATE_BATCH_SIZE
+    now = timezone.now()
+    records = list(PayRecordRegister.objects.filter(
+        pay_run=pay_run).order_by('payee_id').values_list(
+        'payee_id', 'gross_amount', 'net_income'))
+
+    with transaction.atomic():
+        for start in range(0, len(records), batch_size):
+            chunk = records[start:start + batch_size]
+            accumulators = {
+                ytd.payee_id: ytd
+                for ytd in PayeeYTD.objects.select_for_update().filter(
+                    financial_year=financial_year,
+                    payee_id__in=[payee_id for payee_id, _, _ in chunk])}
+            created = []
+
+            for payee_id, gross_amount, net_income in chunk:
+                gross = _money(gross_amount)
+                net = _money(net_income)
+
+                ytd = accumulators.get(payee_id)
+                if ytd is None and sign < 0:
+                    continue
+                if ytd is None:
+                    ytd = PayeeYTD(payee_id=payee_id,
+                                   financial_year=financial_year)
+                    created.append(ytd)
+
+                ytd.pay_runs += sign
+                ytd.gross_amount += sign * gross
+                ytd.tds_amount += sign * (gross - net)
+                ytd.net_income += sign * net
+                ytd.updated_at = now
+
+            PayeeYTD.objects.bulk_update(accumulators.values(),
+                                         YTD_FIELDS + ('updated_at',),
+                                         batch_size=batch_size)
+            PayeeYTD.objects.bulk_create(created, batch_size=batch_size)
+
+
+def rebuild_payee_ytd(financial_year=None):
+    """
+    Recomputes the YTD accumulators from the approved pay runs, for one
+    financial year or all of them. Returns the number of pay runs applied.
+    """
+    pay_runs = [
+        pay_run for pay_run in PayRun.objects.filter(
+            status=PayRunStatusChoices.APPROVED).order_by('year', 'month')
+        if financial_year is None or
+        get_financial_year(pay_run.month, pay_run.year) == financial_year]
+
+    with transaction.atomic():
+        accumulators = PayeeYTD.objects.all()
+        if financial_year is not None:
+            accumulators = accumulators.filter(financial_year=financial_year)
+        accumulators.delete()
+
+        for pay_run in pay_runs:
+            apply_pay_run_to_ytd(pay_run)
+
+    return len(pay_runs)
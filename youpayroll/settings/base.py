@@ -197,6 +197,81 @@ CELERY_BROKER_URL = config('CELERY_BROKER_URL')
 CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND')
 CELERY_TIMEZONE = 'Asia/Kolkata'
 
+# Shared cache used for pay run progress, locks and the config catalog.
+# It must not share a Redis database with the Celery broker: clearing the
+# cache would drop the queued tasks.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND',
+                          default='django.core.cache.backends.redis'
+                                  '.RedisCache'),
+        'LOCATION': config('CACHE_LOCATION',
+                           default='redis://localhost:6379/1'),
+    }
+}
+
+# Number of PayRecordRegister rows written per INSERT during a pay run.
+PAYRUN_BULK_CREATE_BATCH_SIZE = config('PAYRUN_BULK_CREATE_BATCH_SIZE',
+                                       default=1000, cast=int)
+
+# Payees per shard and maximum number of shards of a sharded pay run.
+# With a parallelism of 1 the pay run is processed by a single task.
+PAYRUN_SHARD_SIZE = config('PAYRUN_SHARD_SIZE', default=5000, cast=int)
+PAYRUN_SHARD_PARALLELISM = config('PAYRUN_SHARD_PARALLELISM', default=1,
+                                  cast=int)
+
+# Payees committed per checkpoint, and the minutes without progress after
+# which an in-progress pay run is considered interrupted and can be resumed.
+# The task locks on a pay run expire after the same number of minutes.
+PAYRUN_CHECKPOINT_SIZE = config('PAYRUN_CHECKPOINT_SIZE', default=1000,
+                                cast=int)
+PAYRUN_RESUME_AFTER_MINUTES = config('PAYRUN_RESUME_AFTER_MINUTES',
+                                     default=15, cast=int)
+
+# Carry unchanged pay records forward from a rejected pay run of the same
+# month instead of recomputing them.
+PAYRUN_DIFFERENTIAL_RERUN = config('PAYRUN_DIFFERENTIAL_RERUN', default=True,
+                                   cast=bool)
+
+# Rows fetched per round trip by the server-side cursor of the exports.
+PAYRUN_EXPORT_CHUNK_SIZE = config('PAYRUN_EXPORT_CHUNK_SIZE', default=2000,
+                                  cast=int)
+
+# Account debited in the header of the bulk bank transfer files.
+BANK_TRANSFER_DEBIT_ACCOUNT = config('BANK_TRANSFER_DEBIT_ACCOUNT',
+                                     default='')
+
+# Threads uploading the extracted Form16 documents to the media storage,
+# which is also the size of their shared S3 connection pool.
+FORM16_UPLOAD_WORKERS = config('FORM16_UPLOAD_WORKERS', default=8, cast=int)
+
+# Bytes per part of the direct multipart uploads of the Form16 ZIPs. S3
+# requires at least 5 MiB for every part but the last. The media bucket
+# needs a lifecycle rule aborting incomplete multipart uploads, as the
+# parts of an upload abandoned by the browser are billed until then; see
+# payroll/multipart.py.
+FORM16_UPLOAD_PART_SIZE = config('FORM16_UPLOAD_PART_SIZE',
+                                 default=16 * 1024 * 1024, cast=int)
+
+# Limits on the Form16 ZIPs, checked against their central directory before
+# anything is extracted: the number of files, the uncompressed size of a
+# file and of the whole archive in bytes, and the compression ratio of a
+# file and of the whole archive. A year of Form16 PDFs, well under 100 KB
+# each, fits the total size many times over.
+FORM16_ZIP_MAX_MEMBERS = config('FORM16_ZIP_MAX_MEMBERS', default=20000,
+                                cast=int)
+FORM16_ZIP_MAX_MEMBER_SIZE = config('FORM16_ZIP_MAX_MEMBER_SIZE',
+                                    default=50 * 1024 * 1024, cast=int)
+FORM16_ZIP_MAX_TOTAL_SIZE = config('FORM16_ZIP_MAX_TOTAL_SIZE',
+                                   default=2 * 1024 ** 3, cast=int)
+FORM16_ZIP_MAX_COMPRESSION_RATIO = config('FORM16_ZIP_MAX_COMPRESSION_RATIO',
+                                          default=100, cast=int)
+
+# Changes in gross amount or net income (in rupees) above which a payee is
+# listed in the month-over-month variance report.
+PAYRUN_VARIANCE_THRESHOLD = config('PAYRUN_VARIANCE_THRESHOLD', default=0,
+                                   cast=float)
+
 LOGS_DIR = config('LOG_BASE_DIR')
 if not os.path.exists(LOGS_DIR):
     os.makedirs(LOGS_DIR)
@@ -0,0 +1,15 @@
+from .base import *
+
+# Tests clear the cache, so they never run against a shared Redis
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Media files are written under MEDIA_ROOT rather than to S3, whatever DEBUG
+DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+
+# Tasks queued by the code under test run in the test, whatever DEBUG
+CELERY_TASK_ALWAYS_EAGER = True
+CELERY_TASK_EAGER_PROPAGATES = True